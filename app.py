@@ -1,14 +1,15 @@
 # app.py
 import streamlit as st
 from config.settings import get_settings
+from services.auth import streamlit_auth
 from services.storage import StorageService
 from services.pipeline import ProcessingPipeline
 from supabase import create_client, Client
 
 # Initialize settings and services
 settings = get_settings()
-storage_service = StorageService()
-pipeline = ProcessingPipeline()
+storage_service = StorageService(streamlit_auth())
+pipeline = ProcessingPipeline(storage_service)
 supabase: Client = create_client(settings.supabase_url, settings.supabase_key)
 
 # Page configuration - sidebar collapsed by default for login
@@ -73,6 +74,9 @@ else:
         st.caption(f"Logged in as: {teacher_name}")
         
         if st.button("Logout", type="secondary", use_container_width=True):
+            # Background uploads nobody will claim now
+            if 'speculative_ingestor' in st.session_state:
+                st.session_state.speculative_ingestor.close()
             st.session_state.clear()
             st.rerun()
     
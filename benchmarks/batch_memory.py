@@ -0,0 +1,96 @@
+# benchmarks/batch_memory.py
+"""
+Peak RSS of BatchProcessor as the batch grows.
+
+A stand-in pipeline does the real in-memory work for each submission
+(stream the upload, build the OCR request body) and sleeps for the API
+latency. `stream` feeds images lazily, as the upload page and CLI do;
+`eager` holds every image up front, like keeping all UploadedFiles.
+
+    python -m benchmarks.batch_memory --sizes 10 50 100 250 500
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Settings validation needs these; nothing here talks to the real services
+for _key in ("OPENAI_API_KEY", "SUPABASE_URL", "SUPABASE_KEY", "SUPABASE_SERVICE_KEY"):
+    os.environ.setdefault(_key, "benchmark")
+
+from benchmarks.memory import current_rss_mb, peak_rss_mb
+from services.batch import BatchItem, BatchProcessor
+from services.ingest import ImageSource, encode_data_url
+
+class FakePipeline:
+    """Does the memory-relevant parts of ProcessingPipeline.process_submission"""
+    def __init__(self, api_latency: float):
+        self.api_latency = api_latency
+
+    def process_submission(self, image, assignment_id, student_id,
+                           on_stage_change=None, prefetched=None, batch_id=None):
+        upload = image.open()
+        while upload.read(64 * 1024):
+            pass
+        body = json.dumps({"messages": [{"image_url": {"url": encode_data_url(image)}}]})
+        time.sleep(self.api_latency)  # OCR request in flight
+        del body
+        image.release()
+        time.sleep(self.api_latency * 2)  # grading + feedback
+        return {"status": "complete"}
+
+def measure(mode: str, count: int, size_mb: float, workers: int, inflight_mb: int,
+            api_latency: float) -> dict:
+    size = int(size_mb * 1024 * 1024)
+
+    def items():
+        for i in range(count):
+            yield BatchItem(f"student_{i}", ImageSource(f"student_{i}.jpg", os.urandom(size)))
+
+    baseline = current_rss_mb()
+    source = list(items()) if mode == "eager" else items()
+    processor = BatchProcessor(FakePipeline(api_latency), max_workers=workers,
+                               max_inflight_bytes=inflight_mb * 1024 * 1024)
+    started = time.perf_counter()
+    results = sum(1 for event in processor.run("benchmark", source) if event['type'] == 'result')
+    return {
+        "mode": mode,
+        "batch_size": count,
+        "results": results,
+        "seconds": round(time.perf_counter() - started, 2),
+        "peak_over_baseline_mb": round(peak_rss_mb() - baseline, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS of BatchProcessor by batch size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100, 250, 500])
+    parser.add_argument("--modes", nargs="+", default=["stream", "eager"])
+    parser.add_argument("--image-mb", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--inflight-mb", type=int, default=16)
+    parser.add_argument("--api-latency", type=float, default=0.005)
+    parser.add_argument("--single", nargs=2, metavar=("MODE", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(measure(args.single[0], int(args.single[1]), args.image_mb,
+                                 args.workers, args.inflight_mb, args.api_latency)))
+        return
+
+    print(f"{'mode':>7} {'batch':>6} {'seconds':>8} {'peak RSS +MB':>13}")
+    for mode in args.modes:
+        for count in args.sizes:
+            # Fresh process per run so ru_maxrss isn't shared
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.batch_memory", "--single", mode, str(count),
+                 "--image-mb", str(args.image_mb), "--workers", str(args.workers),
+                 "--inflight-mb", str(args.inflight_mb), "--api-latency", str(args.api_latency)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:>7} {count:>6} {result['seconds']:>8} {result['peak_over_baseline_mb']:>13}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# benchmarks/compare.py
+"""
+Compare two benchmarks.throughput result files, batch size by batch size.
+
+    python -m benchmarks.compare benchmarks/results/<before>.json benchmarks/results/<after>.json
+
+Exits with status 1 when any metric regresses by more than --threshold
+(default 10%), so it can gate a change in CI.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# (label, how to read it from a run, True if higher is better)
+METRICS = [
+    ("throughput/min", lambda r: r['throughput_per_min'], True),
+    ("p50 latency s", lambda r: r['latency_s'].get('p50'), False),
+    ("p95 latency s", lambda r: r['latency_s'].get('p95'), False),
+    ("p99 latency s", lambda r: r['latency_s'].get('p99'), False),
+    ("peak RSS MB", lambda r: r['peak_rss_mb'], False),
+    ("API calls/submission", lambda r: r['client']['openai_requests'] / max(1, r['batch_size']), False),
+    ("DB trips/submission", lambda r: r['client']['supabase_round_trips'] / max(1, r['batch_size']), False),
+    ("failed", lambda r: r['failed'], False),
+]
+
+def compare(before: Dict, after: Dict, threshold: float) -> Tuple[List[Dict], bool]:
+    """Rows for every metric of every batch size both files measured, and whether anything regressed"""
+    old_runs = {r['batch_size']: r for r in before['runs']}
+    rows, regressed = [], False
+    for run in after['runs']:
+        old = old_runs.get(run['batch_size'])
+        if not old:
+            continue
+        for label, read, higher_is_better in METRICS:
+            was, now = read(old), read(run)
+            change: Optional[float] = None
+            if was is not None and now is not None:
+                if was:
+                    change = (now - was) / was
+                elif now:
+                    change = float("inf")
+            worse = change is not None and (-change if higher_is_better else change) > threshold
+            regressed = regressed or worse
+            rows.append({'batch_size': run['batch_size'], 'metric': label,
+                         'before': was, 'after': now, 'change': change, 'regressed': worse})
+    return rows, regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two throughput benchmark results")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative change (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"before: {before['meta']['commit']}  after: {after['meta']['commit']}")
+    print(f"{'batch':>6} {'metric':<22} {'before':>10} {'after':>10} {'change':>8}")
+    rows, regressed = compare(before, after, args.threshold)
+    for row in rows:
+        change = "--" if row['change'] is None else f"{row['change']:+.1%}"
+        fmt = lambda v: "--" if v is None else f"{v:.4g}"
+        print(f"{row['batch_size']:>6} {row['metric']:<22} {fmt(row['before']):>10} {fmt(row['after']):>10} "
+              f"{change:>8}{'  REGRESSION' if row['regressed'] else ''}")
+    if not rows:
+        print("No batch sizes in common")
+    sys.exit(1 if regressed else 0)
+
+if __name__ == "__main__":
+    main()
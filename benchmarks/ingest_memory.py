@@ -0,0 +1,102 @@
+# benchmarks/ingest_memory.py
+"""
+Peak RSS of the ingestion path for one submission: upload stream + OCR encoding.
+
+Compares the old temp_uploads round trip (write to disk, re-read for upload,
+read + base64 + f-string for OCR) with the in-memory ImageSource path.
+Each mode runs in its own process so ru_maxrss is not shared.
+
+    python -m benchmarks.ingest_memory --size-mb 4
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.memory import current_rss_mb, peak_rss_mb
+from services.ingest import ImageSource, encode_data_url
+
+UPLOAD_CHUNK = 64 * 1024  # httpx multipart read size
+
+def _request_body(image_url: str) -> str:
+    """Serialize a vision request the way the OpenAI client does"""
+    return json.dumps({
+        "model": "gpt-4o",
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "prompt"},
+            {"type": "image_url", "image_url": {"url": image_url}}
+        ]}]
+    })
+
+def _drain(stream) -> None:
+    while stream.read(UPLOAD_CHUNK):
+        pass
+
+def run_legacy(uploaded: io.BytesIO, name: str, temp_dir: Path) -> int:
+    # save_uploaded_file
+    file_path = temp_dir / name
+    with open(file_path, "wb") as f:
+        f.write(uploaded.getbuffer())
+    # StorageService.upload_image
+    with open(file_path, "rb") as f:
+        _drain(f)
+    # OCRService.process_image
+    with open(file_path, "rb") as image_file:
+        base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+    image_url = f"data:image/jpeg;base64,{base64_image}"
+    body = _request_body(image_url)
+    os.remove(file_path)
+    return len(body)
+
+def run_in_memory(uploaded: io.BytesIO, name: str) -> int:
+    image = ImageSource(name, uploaded.getbuffer(), "image/jpeg")
+    _drain(image.open())
+    body = _request_body(encode_data_url(image))
+    image.release()
+    return len(body)
+
+def measure(mode: str, size_mb: float, submissions: int) -> dict:
+    uploaded = io.BytesIO(os.urandom(int(size_mb * 1024 * 1024)))
+    baseline = current_rss_mb()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for i in range(submissions):
+            if mode == "legacy":
+                run_legacy(uploaded, f"student_{i}.jpg", Path(temp_dir))
+            else:
+                run_in_memory(uploaded, f"student_{i}.jpg")
+    return {
+        "mode": mode,
+        "image_mb": size_mb,
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "peak_over_baseline_mb": round(peak_rss_mb() - baseline, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=float, default=4.0)
+    parser.add_argument("--submissions", type=int, default=3)
+    parser.add_argument("--mode", choices=["legacy", "memory"])
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(measure(args.mode, args.size_mb, args.submissions)))
+        return
+
+    for mode in ("legacy", "memory"):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.ingest_memory", "--mode", mode,
+             "--size-mb", str(args.size_mb), "--submissions", str(args.submissions)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output)
+        print(f"{mode:>7}: +{result['peak_over_baseline_mb']} MB peak RSS "
+              f"for a {args.size_mb} MB image")
+
+if __name__ == "__main__":
+    main()
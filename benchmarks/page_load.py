@@ -0,0 +1,251 @@
+# benchmarks/page_load.py
+"""
+Rerun cost of each Streamlit page under concurrent teacher sessions.
+
+Every widget interaction reruns the whole page script, so a page's cost is
+its rerun cost. The Supabase stub runs as a separate process, seeded with a
+teacher whose newest assignment has N graded submissions. Each page and
+data size then runs in a fresh child process (the "server") that drives
+several AppTest sessions at once. Each session loads the page and reruns it
+a number of times.
+
+For each page and size it reports rerun wall time (p50/p95), backend
+requests per rerun (counted by the stub) and peak server RSS. A run fails
+(exit status 1) when a page exceeds its budget in benchmarks/page_budgets.json:
+
+    python -m benchmarks.page_load --pages results assignments --sizes 10 100 500 --sessions 8
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List
+
+from benchmarks.memory import current_rss_mb, peak_rss_mb
+
+ROOT = Path(__file__).resolve().parent.parent
+PAGES = {
+    'results': ROOT / "pages" / "results.py",
+    'assignments': ROOT / "pages" / "assignments.py",
+    'upload': ROOT / "pages" / "upload.py",
+    'admin': ROOT / "pages" / "admin.py",
+}
+BUDGETS_PATH = Path(__file__).parent / "page_budgets.json"
+BUCKET = "ap-grader-images"
+
+RUBRIC = {
+    'requirements': [
+        {'text': "Identifies pyruvate as the product of glycolysis", 'points': 1},
+        {'text': "Explains that fermentation regenerates NAD+", 'points': 1},
+        {'text': "Connects NAD+ regeneration to continued ATP production", 'points': 1}
+    ],
+    'metadata': {'notes': "", 'examples': []}
+}
+
+def _request(url: str, method: str = "GET", payload=None) -> Dict:
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8") if payload is not None else None,
+        headers={'Content-Type': 'application/json'},
+        method=method
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        body = response.read()
+        return json.loads(body) if body else {}
+
+def seed(stub_url: str, submissions: int) -> Dict:
+    """A teacher with a few assignments, the newest of which has `submissions` graded rows"""
+    auth_id = str(uuid.uuid4())
+    teacher = _request(f"{stub_url}/rest/v1/teachers", "POST",
+                       {'auth_id': auth_id, 'name': "Benchmark Teacher", 'email': f"{auth_id}@example.com"})[0]
+    started = datetime.now(timezone.utc) - timedelta(days=1)
+    assignments = _request(f"{stub_url}/rest/v1/assignments", "POST", [
+        {
+            'teacher_id': teacher['id'],
+            'name': f"Assignment {i + 1}",
+            'question_text': "Explain why cells ferment pyruvate when oxygen is unavailable.",
+            'points_possible': len(RUBRIC['requirements']),
+            'rubric_structure': json.dumps(RUBRIC),
+            'created_at': (started + timedelta(minutes=i)).isoformat()
+        }
+        for i in range(max(3, submissions // 50))
+    ])
+    newest = assignments[-1]
+
+    verdicts = {req['text']: i % 2 == 0 for i, req in enumerate(RUBRIC['requirements'])}
+    rows = []
+    for i in range(submissions):
+        path = f"{newest['id']}/1700000000_{i:012d}_student_{i:04d}.jpg"
+        rows.append({
+            'assignment_id': newest['id'],
+            'student_id': f"student_{i:04d}",
+            'image_path': f"{stub_url}/storage/v1/object/sign/{BUCKET}/{path}?token=seed",
+            'storage_path': path,
+            'ocr_text': "Glycolysis produces pyruvate. Fermentation regenerates NAD+ so glycolysis continues.",
+            'score': {
+                'teacher_score': f"2/{len(RUBRIC['requirements'])}",
+                'rubric_points_evaluation': verdicts,
+                'misconceptions': ["Pyruvate is reduced, not oxidized, during fermentation"]
+            },
+            'feedback_md': "You explain how fermentation regenerates NAD+ well. Clarify how pyruvate is reduced.",
+            'status': "complete",
+            'stage': "complete",
+            'created_at': (started + timedelta(seconds=i)).isoformat()
+        })
+    for start in range(0, len(rows), 500):
+        _request(f"{stub_url}/rest/v1/submissions", "POST", rows[start:start + 500])
+    return {'teacher': teacher, 'assignment_id': newest['id']}
+
+def _quantile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))] if ordered else 0.0
+
+def measure(page: str, stub_url: str, teacher: Dict, sessions: int, reruns: int, timeout: float) -> Dict:
+    """Drive `sessions` concurrent AppTest sessions through one page (in the child process)"""
+    from streamlit.testing.v1 import AppTest
+
+    baseline = current_rss_mb()
+    timings: Dict[str, List[float]] = {'first': [], 'rerun': []}
+    errors: List[str] = []
+    lock = threading.Lock()
+
+    def session():
+        try:
+            at = AppTest.from_file(str(PAGES[page]), default_timeout=timeout)
+            at.session_state['user'] = SimpleNamespace(id=teacher['auth_id'], email=teacher['email'])
+            at.session_state['teacher'] = teacher
+            for i in range(reruns + 1):
+                started = time.perf_counter()
+                at.run()
+                elapsed = time.perf_counter() - started
+                with lock:
+                    timings['first' if i == 0 else 'rerun'].append(elapsed)
+                    errors.extend(e.value for e in at.exception)
+                    errors.extend(e.value for e in at.error)
+        except Exception as e:
+            with lock:
+                errors.append(f"{type(e).__name__}: {str(e)}")
+
+    before = _request(f"{stub_url}/__stats")['requests']
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    after = _request(f"{stub_url}/__stats")['requests']
+
+    backend = {k: v - before.get(k, 0) for k, v in after.items() if v - before.get(k, 0)}
+    runs = len(timings['first']) + len(timings['rerun'])
+    return {
+        'page': page,
+        'sessions': sessions,
+        'runs': runs,
+        'seconds': round(elapsed, 3),
+        'first_run_ms': round(_quantile(timings['first'], 0.5) * 1000, 1),
+        'rerun_p50_ms': round(_quantile(timings['rerun'], 0.5) * 1000, 1),
+        'rerun_p95_ms': round(_quantile(timings['rerun'], 0.95) * 1000, 1),
+        'backend_calls_per_run': round(sum(backend.values()) / max(1, runs), 2),
+        'backend_calls': backend,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'rss_growth_mb': round(current_rss_mb() - baseline, 1),
+        'errors': sorted(set(errors))[:5]
+    }
+
+def check_budget(result: Dict, budgets: Dict) -> List[str]:
+    """Budget breaches for one result; budgets are per page, optionally per size"""
+    page_budgets = budgets.get(result['page'], {})
+    budget = {**page_budgets.get("*", {}), **page_budgets.get(str(result['size']), {})}
+    breaches = []
+    for metric, limit in budget.items():
+        value = result.get(metric)
+        if value is not None and value > limit:
+            breaches.append(f"{result['page']} @ {result['size']}: {metric} {value} > {limit}")
+    if result['errors']:
+        breaches.append(f"{result['page']} @ {result['size']}: page raised {result['errors'][0]}")
+    return breaches
+
+def main():
+    parser = argparse.ArgumentParser(description="Streamlit page rerun cost under concurrent sessions")
+    parser.add_argument("--pages", nargs="+", choices=sorted(PAGES), default=["results", "assignments"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500],
+                        help="Submissions in the assignment the pages open on")
+    parser.add_argument("--sessions", type=int, default=4, help="Concurrent teacher sessions")
+    parser.add_argument("--reruns", type=int, default=5, help="Reruns per session after the first load")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0, help="Delay per Supabase request")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds allowed per run")
+    parser.add_argument("--budgets", default=str(BUDGETS_PATH))
+    parser.add_argument("--output", help="Save the results as JSON")
+    parser.add_argument("--single", nargs=2, metavar=("PAGE", "TEACHER_JSON"), help=argparse.SUPPRESS)
+    parser.add_argument("--stub-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        page, teacher = args.single[0], json.loads(args.single[1])
+        print(json.dumps(measure(page, args.stub_url, teacher, args.sessions, args.reruns, args.timeout)))
+        return
+
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stubs.supabase_server", "--port", "0",
+         "--latency-ms", str(args.db_latency_ms)],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        config = dict(stub.stdout.readline().strip().split("=", 1) for _ in range(3))
+        env = {
+            **os.environ,
+            **config,
+            'OPENAI_API_KEY': "sk-benchmark",
+            'STORAGE_BUCKET': BUCKET,
+            'LLM_CACHE_ENABLED': "false",
+            'TRACE_EXPORTER': "none",
+            'METRICS_PORT': "0",
+            'SPECULATIVE_INGEST': "false"
+        }
+        budgets = json.loads(Path(args.budgets).read_text()) if Path(args.budgets).exists() else {}
+
+        results, breaches = [], []
+        print(f"{'page':<12} {'size':>5} {'first ms':>9} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'calls/run':>10} {'RSS MB':>7}")
+        for size in args.sizes:
+            seeded = seed(config['SUPABASE_URL'], size)
+            for page in args.pages:
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.page_load", "--single", page, json.dumps(seeded['teacher']),
+                     "--stub-url", config['SUPABASE_URL'], "--sessions", str(args.sessions),
+                     "--reruns", str(args.reruns), "--timeout", str(args.timeout)],
+                    capture_output=True, text=True, env=env
+                )
+                if output.returncode != 0:
+                    print(output.stderr[-2000:], file=sys.stderr)
+                    raise SystemExit(f"{page} at size {size} failed to run")
+                result = {**json.loads(output.stdout.strip().splitlines()[-1]), 'size': size}
+                results.append(result)
+                breaches += check_budget(result, budgets)
+                print(f"{page:<12} {size:>5} {result['first_run_ms']:>9} {result['rerun_p50_ms']:>8} "
+                      f"{result['rerun_p95_ms']:>8} {result['backend_calls_per_run']:>10} {result['peak_rss_mb']:>7}")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            'meta': {'created_at': datetime.now(timezone.utc).isoformat(), 'sessions': args.sessions,
+                     'reruns': args.reruns, 'db_latency_ms': args.db_latency_ms},
+            'results': results
+        }, indent=2))
+    for breach in breaches:
+        print(f"OVER BUDGET {breach}")
+    sys.exit(1 if breaches else 0)
+
+if __name__ == "__main__":
+    main()
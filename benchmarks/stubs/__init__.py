@@ -0,0 +1,3 @@
+# benchmarks/stubs/__init__.py
+from benchmarks.stubs.openai_server import OpenAIStub
+from benchmarks.stubs.supabase_server import SupabaseStub
@@ -0,0 +1,323 @@
+# benchmarks/stubs/openai_server.py
+"""
+Local stand-in for the OpenAI chat completions endpoint.
+
+Answers the app's OCR, grading, feedback and feedback-validation prompts
+with well-formed content, reports token usage the way the API does, and can
+simulate the API's latency and rate limiting:
+
+    python -m benchmarks.stubs.openai_server --port 8010 \\
+        --latency ocr=lognormal:1.2,0.4 --latency feedback=uniform:0.4,0.9 --rate-limit 0.05
+    # then export the printed OPENAI_BASE_URL before starting the app
+
+Latency specs are `fixed:S`, `uniform:LO,HI` or `lognormal:MEAN,SIGMA`
+(seconds; MEAN is the median of the distribution), per request kind or as a
+default. `--time-scale` shrinks every delay, so a 1000-submission batch can
+run in seconds while keeping the shape of the distribution.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+KINDS = ("ocr", "grading", "feedback", "validation", "other")
+
+# Vision requests are billed per 512px tile; a typical page photo at "auto" or "high" detail
+IMAGE_TOKENS = 765
+LOW_DETAIL_TOKENS = 85
+
+# Rough medians observed for gpt-4o from a classroom network
+DEFAULT_LATENCY = {
+    'ocr': "lognormal:4.0,0.35",
+    'grading': "lognormal:2.5,0.3",
+    'feedback': "lognormal:1.8,0.3",
+    'validation': "lognormal:1.2,0.3",
+    'other': "fixed:0.5"
+}
+
+# Smaller models answer faster; latency is scaled by the first matching name part
+MODEL_SPEED = {'mini': 0.4, 'nano': 0.25}
+
+def parse_latency(spec: str):
+    """Turn a latency spec into a zero-argument sampler returning seconds"""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0]) if values[0] > 0 else 0.0
+        return lambda: random.lognormvariate(mu, values[1])
+    raise ValueError(f"Bad latency spec {spec!r}; use fixed:S, uniform:LO,HI or lognormal:MEAN,SIGMA")
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def classify(messages: List[Dict]) -> Tuple[str, str, int]:
+    """Request kind, the prompt text, and the number of images attached"""
+    text, images = "", 0
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            text += content
+            continue
+        for part in content or []:
+            if part.get('type') == "text":
+                text += part.get('text', "")
+            elif part.get('type') == "image_url":
+                images += 1
+    if images:
+        return "ocr", text, images
+    if "criteria_met" in text:
+        return "validation", text, images
+    if "rubric points" in text and "Return a JSON evaluation" in text:
+        return "grading", text, images
+    if "Feedback text only" in text:
+        return "feedback", text, images
+    return "other", text, images
+
+def _requirements(prompt: str) -> List[str]:
+    """The rubric points listed in an OCR or grading prompt"""
+    match = re.search(r"rubric points:\s*(\[.*?\])", prompt, re.S)
+    try:
+        return json.loads(match.group(1)) if match else []
+    except ValueError:
+        return []
+
+def _evaluation(seed: str, requirements: List[str]) -> Dict:
+    """Deterministic per-seed verdicts, so the same answer always grades the same"""
+    digest = hashlib.sha256(seed.encode("utf-8")).digest()
+    verdicts = {text: bool(digest[i % len(digest)] & 1) for i, text in enumerate(requirements)}
+    return {
+        'rubric_points': verdicts,
+        'points_earned': [text for text, met in verdicts.items() if met],
+        'misconceptions': [] if all(verdicts.values()) else ["Incomplete link between the steps"],
+        'explanation': "The response covers some of the expected reasoning."
+    }
+
+def image_parts(messages: List[Dict]) -> List[Dict]:
+    """The image_url objects attached to a request"""
+    return [part['image_url'] for m in messages if isinstance(m.get('content'), list)
+            for part in m['content'] if part.get('type') == "image_url"]
+
+def respond(kind: str, prompt: str, messages: List[Dict], low_detail_unclear: float = 0.0) -> str:
+    """Message content the app's parser for `kind` accepts"""
+    if kind == "ocr":
+        # Transcripts differ per image so the LLM cache can't short-circuit grading
+        images = image_parts(messages)
+        digest = hashlib.sha256(images[0]['url'].encode("utf-8")).hexdigest()
+        transcript = (f"Glycolysis produces pyruvate and NADH. Without oxygen, fermentation "
+                      f"regenerates NAD+ so glycolysis can continue. [sample {digest[:12]}]")
+        # Some pages can't be read from the low-detail rendering; the same pages every time
+        if all(image.get('detail') == "low" for image in images) and \
+                int(digest[12:20], 16) / 0xFFFFFFFF < low_detail_unclear:
+            transcript = ("Glycolysis produces [unclear] and NADH. Without [unclear], fermentation "
+                          f"[unclear] NAD+ so [unclear] can continue. [sample {digest[:12]}]")
+        return json.dumps({'student_response': transcript, **_evaluation(transcript, _requirements(prompt))})
+    if kind == "grading":
+        answer = re.search(r"Student Response:(.*?)Evaluate this response", prompt, re.S)
+        seed = answer.group(1) if answer else prompt
+        return json.dumps(_evaluation(seed, _requirements(prompt)))
+    if kind == "validation":
+        return json.dumps({'criteria_met': ["1", "2", "3", "4", "5", "6"], 'issues': [], 'score': 92})
+    if kind == "feedback":
+        return ("You explain how fermentation regenerates NAD+ well. To improve, describe how "
+                "pyruvate is reduced rather than oxidized, linking it back to redox balance.")
+    return "OK"
+
+def token_logprobs(kind: str, content: str, model: str, borderline: bool) -> List[Dict]:
+    """
+    Per-token log probabilities for `content`. Small models are unsure of
+    borderline submissions: of their rubric verdicts when grading, and of
+    every word when writing feedback.
+    """
+    unsure = borderline and any(part in model for part in MODEL_SPEED)
+    result = []
+    for token in re.findall(r"\w+|\s+|[^\w\s]", content):
+        probability = 0.98
+        if unsure and kind == "grading" and token in ("true", "false"):
+            probability = 0.6
+        elif unsure and kind == "feedback":
+            probability = 0.35
+        result.append({'token': token, 'logprob': math.log(probability),
+                       'bytes': list(token.encode("utf-8")), 'top_logprobs': []})
+    return result
+
+class OpenAIStub:
+    """OpenAI-compatible chat completions served over HTTP"""
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency: Optional[Dict[str, str]] = None, time_scale: float = 1.0,
+                 rate_limit: float = 0.0, retry_after: float = 0.2, seed: Optional[int] = None,
+                 low_detail_unclear: float = 0.2, borderline_rate: float = 0.15):
+        specs = {**DEFAULT_LATENCY, **(latency or {})}
+        self.latency = {kind: parse_latency(specs.get(kind, specs['other'])) for kind in KINDS}
+        self.time_scale = time_scale
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.low_detail_unclear = low_detail_unclear
+        self.borderline_rate = borderline_rate
+        self.request_counts: Counter = Counter()
+        self.usage: Counter = Counter()
+        self.lock = threading.Lock()
+        self._seen_prefixes = set()
+        if seed is not None:
+            random.seed(seed)
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "OpenAIStub":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "OpenAIStub":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {'requests': dict(self.request_counts), 'usage': dict(self.usage)}
+
+    def complete(self, body: Dict) -> Tuple[int, Dict]:
+        """Status and JSON body for one chat completion request"""
+        messages = body.get('messages', [])
+        model = body.get('model', "gpt-4o")
+        kind, prompt, images = classify(messages)
+        speed = next((factor for part, factor in MODEL_SPEED.items() if part in model), 1.0)
+        with self.lock:
+            self.request_counts[kind] += 1
+            limited = random.random() < self.rate_limit
+            if limited:
+                self.request_counts['429'] += 1
+
+        # Rejections come back fast, like the real API's
+        time.sleep(self.latency[kind]() * self.time_scale * speed * (0.05 if limited else 1.0))
+        if limited:
+            return 429, {'error': {'message': "Rate limit reached for requests (stub)",
+                                   'type': "requests", 'code': "rate_limit_exceeded"}}
+
+        content = respond(kind, prompt, messages, self.low_detail_unclear)
+        prompt_tokens = estimate_tokens(prompt) + sum(
+            LOW_DETAIL_TOKENS if image.get('detail') == "low" else IMAGE_TOKENS for image in image_parts(messages)
+        )
+        # The API caches prompt prefixes of 1024+ tokens; approximate with the instructions before the answer
+        prefix = hashlib.sha256(prompt[:4096].encode("utf-8")).hexdigest()
+        with self.lock:
+            cached = prompt_tokens >= 1024 and prefix in self._seen_prefixes
+            self._seen_prefixes.add(prefix)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': estimate_tokens(content),
+            'total_tokens': prompt_tokens + estimate_tokens(content),
+            'prompt_tokens_details': {'cached_tokens': (prompt_tokens // 2) if cached else 0}
+        }
+        with self.lock:
+            self.usage[f"{kind}_prompt_tokens"] += usage['prompt_tokens']
+            self.usage[f"{kind}_completion_tokens"] += usage['completion_tokens']
+
+        choice = {
+            'index': 0,
+            'message': {'role': "assistant", 'content': content},
+            'finish_reason': "stop"
+        }
+        if body.get('logprobs'):
+            # The same submissions are borderline every time
+            digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+            borderline = int.from_bytes(digest[:4], "big") / 0xFFFFFFFF < self.borderline_rate
+            choice['logprobs'] = {'content': token_logprobs(kind, content, model, borderline)}
+        return 200, {
+            'id': f"chatcmpl-stub{random.getrandbits(48):012x}",
+            'object': "chat.completion",
+            'created': int(time.time()),
+            'model': model,
+            'choices': [choice],
+            'usage': usage
+        }
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/__stats":
+                    return self._send(200, stub.stats())
+                if self.path.rstrip("/") == "/v1/models":
+                    return self._send(200, {'object': "list", 'data': [{'id': "gpt-4o", 'object': "model"}]})
+                self._send(404, {'error': {'message': f"No stub route for GET {self.path}"}})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    return self._send(404, {'error': {'message': f"No stub route for POST {self.path}"}})
+                status, payload = stub.complete(body)
+                headers = {}
+                if status == 429:
+                    headers['retry-after-ms'] = str(int(stub.retry_after * 1000))
+                self._send(status, payload, headers)
+
+        return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an OpenAI chat completions stub")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--latency", action="append", default=[], metavar="[KIND=]SPEC",
+                        help=f"Latency per request kind ({', '.join(KINDS)}); repeatable")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiply every delay by this")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Seconds suggested by 429 responses")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--low-detail-unclear", type=float, default=0.2,
+                        help="Fraction of pages whose low-detail reading comes back with [unclear] words")
+    parser.add_argument("--borderline", type=float, default=0.15,
+                        help="Fraction of grading and feedback requests small models are unsure of")
+    args = parser.parse_args()
+
+    latency = {}
+    for item in args.latency:
+        kind, _, spec = item.rpartition("=")
+        for target in ([kind] if kind else KINDS):
+            latency[target] = spec
+
+    with OpenAIStub(port=args.port, latency=latency, time_scale=args.time_scale,
+                    rate_limit=args.rate_limit, retry_after=args.retry_after, seed=args.seed,
+                    low_detail_unclear=args.low_detail_unclear, borderline_rate=args.borderline) as stub:
+        print(f"OPENAI_BASE_URL={stub.base_url}", flush=True)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,365 @@
+# benchmarks/stubs/supabase_server.py
+"""
+Local stand-in for the parts of Supabase that StorageService talks to:
+the storage API and the subset of PostgREST the app uses (eq/neq/in/lt/gt
+filters, order, limit, single-object responses, insert/upsert/update/delete,
+and unique constraints that fail with 23505 like Postgres does).
+
+Runs a real HTTP server so the unmodified supabase client (and a browser
+doing direct uploads) can be pointed at it:
+
+    with SupabaseStub() as stub:
+        os.environ["SUPABASE_URL"] = stub.url
+        ...
+"""
+import json
+import re
+import secrets
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+# Any JWT-shaped string satisfies the client-side key checks
+STUB_KEY = "stub.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.stub"
+
+# Columns besides `id` with a unique index, mirroring migrations/
+UNIQUE_COLUMNS = {
+    'submissions': ['idempotency_key'],
+}
+
+def _compare(value, operator: str, operand: str) -> bool:
+    """Evaluate one PostgREST filter against a stored value"""
+    if operator == "is":
+        return (value is None) if operand == "null" else str(value).lower() == operand
+    if operator == "in":
+        return str(value) in [v.strip('"') for v in operand.strip("()").split(",")]
+    if value is None:
+        return False
+    if operator == "eq":
+        return str(value) == operand or (isinstance(value, bool) and str(value).lower() == operand)
+    if operator == "neq":
+        return str(value) != operand
+    try:
+        left, right = float(value), float(operand)
+    except (TypeError, ValueError):
+        left, right = str(value), operand
+    return {"lt": left < right, "lte": left <= right,
+            "gt": left > right, "gte": left >= right}.get(operator, False)
+
+def parse_multipart(body: bytes, content_type: str) -> Dict[str, Tuple[bytes, Optional[str]]]:
+    """Split a multipart/form-data body into {field name: (data, content type)}"""
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode()
+    fields = {}
+    for part in body.split(b"--" + boundary)[1:]:
+        if part.startswith(b"--"):
+            break
+        headers, _, data = part.partition(b"\r\n\r\n")
+        headers = headers.decode("latin-1")
+        name = re.search(r'name="([^"]*)"', headers)
+        part_type = re.search(r"content-type:\s*([^\r\n]+)", headers, re.IGNORECASE)
+        fields[name.group(1) if name else ""] = (
+            data[:-2] if data.endswith(b"\r\n") else data,
+            part_type.group(1).strip() if part_type else None
+        )
+    return fields
+
+class SupabaseStub:
+    """In-memory Supabase storage and REST API served over HTTP"""
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.latency = latency  # seconds added to every request
+        self.objects: Dict[Tuple[str, str], Tuple[bytes, str]] = {}
+        self.tables: Dict[str, Dict[str, Dict]] = {}
+        self.tokens: Dict[str, Tuple[str, str, str]] = {}  # token -> (kind, bucket, path)
+        self.request_counts: Counter = Counter()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def key(self) -> str:
+        return STUB_KEY
+
+    def start(self) -> "SupabaseStub":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "SupabaseStub":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def insert_row(self, table: str, row: Dict, upsert: bool = False) -> Dict:
+        """Insert (or merge, with `upsert`) a row; raises ValueError on a unique violation"""
+        now = datetime.now(timezone.utc).isoformat()
+        with self.lock:
+            rows = self.tables.setdefault(table, {})
+            row_id = str(row.get('id') or uuid.uuid4())
+            if row_id in rows:
+                if not upsert:
+                    raise ValueError(f"{table}_pkey")
+                rows[row_id].update(row)
+                return dict(rows[row_id])
+            for column in UNIQUE_COLUMNS.get(table, []):
+                value = row.get(column)
+                if value is not None and any(r.get(column) == value for r in rows.values()):
+                    raise ValueError(f"{table}_{column}_key")
+            stored = {'created_at': now, **row, 'id': row_id}
+            rows[row_id] = stored
+            return dict(stored)
+
+    def select_rows(self, table: str, filters: List[Tuple[str, str, str]]) -> List[Dict]:
+        """Rows matching every (column, operator, operand) filter"""
+        with self.lock:
+            rows = list(self.tables.get(table, {}).values())
+        return [dict(r) for r in rows if all(_compare(r.get(c), op, v) for c, op, v in filters)]
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'requests': dict(self.request_counts),
+                'objects': len(self.objects),
+                'object_bytes': sum(len(body) for body, _ in self.objects.values()),
+                'rows': {table: len(rows) for table, rows in self.tables.items()}
+            }
+
+    def _issue_token(self, kind: str, bucket: str, path: str) -> str:
+        token = secrets.token_urlsafe(16)
+        with self.lock:
+            self.tokens[token] = (kind, bucket, path)
+        return token
+
+    def _check_token(self, token: str, kind: str, bucket: str, path: str) -> bool:
+        with self.lock:
+            return self.tokens.get(token) == (kind, bucket, path)
+
+    def _store(self, bucket: str, path: str, body: bytes, content_type: str,
+               upsert: bool) -> Tuple[int, Dict]:
+        if content_type.startswith("multipart/form-data"):
+            fields = parse_multipart(body, content_type)
+            body, content_type = fields.get("file") or fields.get("") or (b"", None)
+            content_type = content_type or "application/octet-stream"
+        with self.lock:
+            if (bucket, path) in self.objects and not upsert:
+                return 400, {"statusCode": "409", "error": "Duplicate",
+                             "message": "The resource already exists"}
+            self.objects[(bucket, path)] = (body, content_type)
+        return 200, {"Key": f"{bucket}/{path}", "Id": secrets.token_hex(8)}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, payload=None, body: bytes = None,
+                      content_type: str = "application/json", headers: Dict = None):
+                if body is None:
+                    body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Access-Control-Allow-Origin", "*")
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self) -> bytes:
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    chunks = []
+                    while True:
+                        size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            return b"".join(chunks)
+                        chunks.append(self.rfile.read(size))
+                        self.rfile.readline()
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def do_OPTIONS(self):
+                self.send_response(204)
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, PATCH, DELETE, OPTIONS")
+                self.send_header("Access-Control-Allow-Headers", "*")
+                self.end_headers()
+
+            def do_GET(self):
+                self._route("GET")
+
+            def do_POST(self):
+                self._route("POST")
+
+            def do_PUT(self):
+                self._route("PUT")
+
+            def do_PATCH(self):
+                self._route("PATCH")
+
+            def do_DELETE(self):
+                self._route("DELETE")
+
+            def _route(self, method: str):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                parts = [unquote(p) for p in url.path.strip("/").split("/")]
+                if parts == ["__stats"]:
+                    return self._send(200, stub.stats())
+                with stub.lock:
+                    stub.request_counts[f"{method} /{'/'.join(parts[:3])}"] += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                if parts[:3] == ["storage", "v1", "object"]:
+                    return self._storage(method, parts[3:], query)
+                if parts[:2] == ["rest", "v1"] and len(parts) == 3:
+                    return self._rest(method, parts[2], url.query)
+                self._send(404, {"message": f"No stub route for {method} {url.path}"})
+
+            def _rest(self, method: str, table: str, raw_query: str):
+                """PostgREST: /rest/v1/{table}?col=op.value&order=col.desc&limit=n"""
+                filters, order, limit = [], None, None
+                for name, values in parse_qs(raw_query, keep_blank_values=True).items():
+                    value = values[0]
+                    if name == "order":
+                        order = value
+                    elif name == "limit":
+                        limit = int(value)
+                    elif name not in ("select", "on_conflict", "columns", "offset"):
+                        operator, _, operand = value.partition(".")
+                        filters.append((name, operator, operand))
+                prefer = self.headers.get("Prefer", "")
+
+                if method == "GET":
+                    rows = stub.select_rows(table, filters)
+                elif method == "POST":
+                    payload = json.loads(self._body() or b"[]")
+                    upsert = "resolution=merge-duplicates" in prefer
+                    try:
+                        rows = [stub.insert_row(table, row, upsert=upsert)
+                                for row in (payload if isinstance(payload, list) else [payload])]
+                    except ValueError as e:
+                        return self._send(409, {"code": "23505", "details": None, "hint": None,
+                                                "message": f'duplicate key value violates unique constraint "{e}"'})
+                elif method == "PATCH":
+                    changes = json.loads(self._body() or b"{}")
+                    rows = []
+                    for row in stub.select_rows(table, filters):
+                        rows.append(stub.insert_row(table, {**changes, 'id': row['id']}, upsert=True))
+                elif method == "DELETE":
+                    rows = stub.select_rows(table, filters)
+                    with stub.lock:
+                        for row in rows:
+                            stub.tables.get(table, {}).pop(row['id'], None)
+                else:
+                    return self._send(405, {"message": "Method not allowed"})
+
+                if order:
+                    column, _, direction = order.partition(".")
+                    rows.sort(key=lambda r: (r.get(column) is None, str(r.get(column))),
+                              reverse=direction.startswith("desc"))
+                if limit is not None:
+                    rows = rows[:limit]
+
+                status = 201 if method == "POST" else 200
+                if "application/vnd.pgrst.object+json" in self.headers.get("Accept", ""):
+                    if len(rows) != 1:
+                        return self._send(406, {"code": "PGRST116", "details": f"{len(rows)} rows",
+                                                "hint": None, "message": "JSON object requested, multiple (or no) rows returned"})
+                    return self._send(status, rows[0])
+                if method != "GET" and "return=minimal" in prefer:
+                    return self._send(status, body=b"")
+                self._send(status, rows)
+
+            def _storage(self, method: str, parts: List[str], query: Dict):
+                # /object/sign/{bucket}/{path} and /object/upload/sign/{bucket}/{path}
+                if parts[:1] == ["sign"] or parts[:2] == ["upload", "sign"]:
+                    kind = "download" if parts[0] == "sign" else "upload"
+                    rest = parts[1:] if kind == "download" else parts[2:]
+                    bucket, path = rest[0], "/".join(rest[1:])
+                    prefix = "/object/sign" if kind == "download" else "/object/upload/sign"
+
+                    if method == "POST":
+                        self._body()
+                        token = stub._issue_token(kind, bucket, path)
+                        url = f"{prefix}/{bucket}/{path}?token={token}"
+                        key = "signedURL" if kind == "download" else "url"
+                        return self._send(200, {key: url, "token": token})
+
+                    if not stub._check_token(query.get("token", ""), kind, bucket, path):
+                        return self._send(400, {"statusCode": "403", "error": "InvalidJWT",
+                                                "message": "invalid signature"})
+                    if kind == "download" and method == "GET":
+                        return self._object(bucket, path)
+                    if kind == "upload" and method == "PUT":
+                        status, payload = stub._store(
+                            bucket, path, self._body(),
+                            self.headers.get("Content-Type", "application/octet-stream"),
+                            upsert=self.headers.get("x-upsert") == "true"
+                        )
+                        return self._send(status, payload)
+
+                # /object/{bucket}/{path}
+                bucket, path = parts[0], "/".join(parts[1:])
+                if method == "GET":
+                    return self._object(bucket, path)
+                if method in ("POST", "PUT"):
+                    status, payload = stub._store(
+                        bucket, path, self._body(),
+                        self.headers.get("Content-Type", "application/octet-stream"),
+                        upsert=method == "PUT" or self.headers.get("x-upsert") == "true"
+                    )
+                    return self._send(status, payload)
+                if method == "DELETE":
+                    prefixes = json.loads(self._body() or b"{}").get("prefixes", [])
+                    removed = []
+                    with stub.lock:
+                        for name in prefixes:
+                            if stub.objects.pop((bucket, name), None) is not None:
+                                removed.append({"name": name, "bucket_id": bucket})
+                    return self._send(200, removed)
+                self._send(405, {"message": "Method not allowed"})
+
+            def _object(self, bucket: str, path: str):
+                with stub.lock:
+                    stored = stub.objects.get((bucket, path))
+                if stored is None:
+                    return self._send(400, {"statusCode": "404", "error": "not_found",
+                                            "message": "Object not found"})
+                body, content_type = stored
+                self._send(200, body=body, content_type=content_type)
+
+        return Handler
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the local Supabase stand-in")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay added to every request")
+    args = parser.parse_args()
+
+    with SupabaseStub(port=args.port, latency=args.latency_ms / 1000) as stub:
+        print(f"SUPABASE_URL={stub.url}")
+        print(f"SUPABASE_KEY={stub.key}")
+        print(f"SUPABASE_SERVICE_KEY={stub.key}", flush=True)
+        while True:
+            time.sleep(3600)
@@ -0,0 +1,294 @@
+# benchmarks/throughput.py
+"""
+End-to-end throughput of the real ProcessingPipeline, fully offline.
+
+The OpenAI and Supabase stubs run in this process; each batch size runs in a
+fresh child process (so peak RSS is per run) whose unmodified OpenAI and
+Supabase clients are pointed at them. Every submission goes through the real
+upload, OCR, grading and feedback code, with API latency and 429s drawn from
+the stub's distributions.
+
+    python -m benchmarks.throughput --sizes 1 10 100 1000 --time-scale 0.05
+    python -m benchmarks.compare benchmarks/results/<before>.json benchmarks/results/<after>.json
+
+With --replay the child processes replay a cassette recorded from a real
+session (CASSETTE_MODE=record) instead, at --time-scale of its latencies.
+
+Results are printed as a table and saved as JSON under benchmarks/results/,
+named after the commit they were measured on.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from benchmarks.memory import current_rss_mb, peak_rss_mb
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+RUBRIC = {
+    'requirements': [
+        {'text': "Identifies pyruvate as the product of glycolysis", 'points': 1},
+        {'text': "Explains that fermentation regenerates NAD+", 'points': 1},
+        {'text': "Connects NAD+ regeneration to continued ATP production", 'points': 1}
+    ]
+}
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _quantiles(values: List[float]) -> Dict:
+    """p50/p95/p99 and mean of latencies in seconds (nearest rank)"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+    return {
+        'p50': round(pick(0.50), 4),
+        'p95': round(pick(0.95), 4),
+        'p99': round(pick(0.99), 4),
+        'mean': round(sum(ordered) / len(ordered), 4)
+    }
+
+def sample_images(count: int, width: int, height: int) -> Iterator:
+    """
+    Distinct JPEGs, generated lazily. One photo-sized image is encoded once;
+    each copy gets unique trailing bytes (ignored by decoders), so content
+    hashes, storage paths and OCR answers all differ per submission.
+    """
+    from PIL import Image, ImageDraw
+    from services.ingest import ImageSource
+
+    page = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(page)
+    for line in range(40, height - 40, 48):
+        draw.line([(60, line), (width - 60, line)], fill=(200, 200, 230), width=2)
+        draw.text((70, line - 30), "Fermentation regenerates NAD+ so glycolysis continues", fill="black")
+    buffer = io.BytesIO()
+    page.save(buffer, format="JPEG", quality=85)
+    base = buffer.getvalue()
+
+    for i in range(count):
+        yield ImageSource(f"student_{i:04d}.jpg", base + f"benchmark-{uuid.uuid4()}".encode(), "image/jpeg")
+
+def measure(count: int, assignment_id: str, workers: int, width: int, height: int, pages: int = 1) -> Dict:
+    """Run one batch through BatchProcessor + ProcessingPipeline (in the child process)"""
+    from services.batch import BatchItem, BatchProcessor
+    from services.metrics import (
+        CASCADE_ATTEMPTS, DB_SECONDS, LLM_COST, LLM_REQUEST_SECONDS, LLM_RETRIES, LLM_TOKENS, STAGE_SECONDS
+    )
+    from services.pipeline import ProcessingPipeline
+    from services.tracing import build_traces, recent_spans
+
+    baseline = current_rss_mb()
+    processor = BatchProcessor(ProcessingPipeline(), max_workers=workers)
+    def items():
+        images = sample_images(count * pages, width, height)
+        for i in range(count):
+            first, *rest = [next(images) for _ in range(pages)]
+            yield BatchItem(f"student_{i:04d}", first, more_pages=tuple(rest))
+
+    completed = failed = 0
+    started = time.perf_counter()
+    for event in processor.run(assignment_id, items(), batch_id=f"benchmark-{uuid.uuid4()}"):
+        if event['type'] != 'result':
+            continue
+        if event['error'] or (event['result'] or {}).get('status') != 'complete':
+            failed += 1
+        else:
+            completed += 1
+    elapsed = time.perf_counter() - started
+
+    # Per-submission latency comes from the root span of each submission's trace
+    traces = [t for t in build_traces(recent_spans()) if t['name'] == "submission"]
+    return {
+        'batch_size': count,
+        'completed': completed,
+        'failed': failed,
+        'seconds': round(elapsed, 3),
+        'throughput_per_min': round(completed / elapsed * 60, 2) if elapsed else 0.0,
+        'latency_s': _quantiles([t['duration_ms'] / 1000 for t in traces]),
+        'stages_s': {
+            stage: {
+                f"p{int(q * 100)}": round(STAGE_SECONDS.quantile(q, stage=stage), 4)
+                for q in (0.5, 0.95, 0.99)
+            }
+            for stage in ("upload", "ocr", "grading", "feedback") if STAGE_SECONDS.count(stage=stage)
+        },
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'peak_over_baseline_mb': round(peak_rss_mb() - baseline, 1),
+        'client': {
+            'openai_requests': LLM_REQUEST_SECONDS.count(),
+            'openai_retries': int(LLM_RETRIES.value()),
+            'supabase_round_trips': DB_SECONDS.count(),
+            'supabase_by_operation': {
+                f"{target}.{operation}": DB_SECONDS.count(target=target, operation=operation)
+                for target in DB_SECONDS.label_values("target")
+                for operation in DB_SECONDS.label_values("operation", target=target)
+            },
+            'input_tokens': int(LLM_TOKENS.value(kind="input")),
+            'output_tokens': int(LLM_TOKENS.value(kind="output")),
+            'cost_usd': round(LLM_COST.value(), 4),
+            'cascade_escalations': {
+                stage: int(CASCADE_ATTEMPTS.value(stage=stage, outcome="escalated"))
+                for stage in CASCADE_ATTEMPTS.label_values("stage")
+            }
+        }
+    }
+
+def _delta(after: Dict, before: Dict) -> Dict:
+    return {key: value - before.get(key, 0) for key, value in after.items() if value - before.get(key, 0)}
+
+def _server_requests(stub) -> Dict:
+    return dict(stub.stats()['requests']) if stub else {}
+
+def run_suite(args) -> Dict:
+    from benchmarks.stubs import OpenAIStub, SupabaseStub
+    from benchmarks.stubs.supabase_server import STUB_KEY
+
+    latency = {}
+    for item in args.latency:
+        kind, _, spec = item.rpartition("=")
+        latency.update({kind: spec} if kind else {'ocr': spec, 'grading': spec, 'feedback': spec,
+                                                   'validation': spec, 'other': spec})
+
+    runs = []
+    with ExitStack() as stack:
+        env = {
+            **os.environ,
+            'OPENAI_API_KEY': "sk-benchmark",
+            # Measure the pipeline, not the cache or the trace file
+            'LLM_CACHE_ENABLED': "false",
+            'TRACE_EXPORTER': "none",
+            'METRICS_PORT': "0",
+            # Every sample is the same picture; don't flag them as one page handed in twice
+            'DUPLICATE_HASH_DISTANCE': "-1"
+        }
+        if args.replay:
+            # Recorded traffic answers every call; nothing listens on these URLs
+            openai_stub = supabase_stub = None
+            env.update({
+                'SUPABASE_URL': "http://supabase.cassette.invalid",
+                'SUPABASE_KEY': STUB_KEY,
+                'SUPABASE_SERVICE_KEY': STUB_KEY,
+                'CASSETTE_MODE': "replay",
+                'CASSETTE_PATH': args.replay,
+                'CASSETTE_SPEED': str(args.time_scale)
+            })
+            # Any id will do, the assignment lookup replays by shape
+            assignment_id = str(uuid.uuid4())
+        else:
+            openai_stub = stack.enter_context(OpenAIStub(
+                latency=latency, time_scale=args.time_scale, rate_limit=args.rate_limit,
+                retry_after=args.retry_after * args.time_scale, seed=args.seed
+            ))
+            supabase_stub = stack.enter_context(SupabaseStub(latency=args.db_latency_ms / 1000))
+            env.update({
+                'OPENAI_BASE_URL': openai_stub.base_url,
+                'SUPABASE_URL': supabase_stub.url,
+                'SUPABASE_KEY': supabase_stub.key,
+                'SUPABASE_SERVICE_KEY': supabase_stub.key
+            })
+            assignment_id = supabase_stub.insert_row('assignments', {
+                'name': "Benchmark: cellular respiration",
+                'question_text': "Explain why cells ferment pyruvate when oxygen is unavailable.",
+                'points_possible': len(RUBRIC['requirements']),
+                'rubric_structure': json.dumps(RUBRIC)
+            })['id']
+
+        print(f"{'batch':>6} {'done':>6} {'failed':>6} {'sec':>8} {'/min':>8} "
+              f"{'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'RSS MB':>7} {'API':>6} {'429':>5} {'DB':>6}")
+        for count in args.sizes:
+            openai_before = _server_requests(openai_stub)
+            supabase_before = _server_requests(supabase_stub)
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.throughput", "--single", str(count),
+                 "--assignment", assignment_id, "--workers", str(args.workers),
+                 "--image-size", str(args.image_size[0]), str(args.image_size[1]),
+                 "--pages", str(args.pages)],
+                capture_output=True, text=True, env=env
+            )
+            if output.returncode != 0:
+                print(output.stderr[-2000:], file=sys.stderr)
+                raise SystemExit(f"Batch of {count} failed")
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            result['server'] = {
+                'openai_requests': _delta(_server_requests(openai_stub), openai_before),
+                'supabase_requests': _delta(_server_requests(supabase_stub), supabase_before)
+            }
+            runs.append(result)
+
+            latency_s = result['latency_s']
+            print(f"{count:>6} {result['completed']:>6} {result['failed']:>6} {result['seconds']:>8} "
+                  f"{result['throughput_per_min']:>8} {latency_s.get('p50', 0):>7} {latency_s.get('p95', 0):>7} "
+                  f"{latency_s.get('p99', 0):>7} {result['peak_rss_mb']:>7} "
+                  f"{result['client']['openai_requests']:>6} {result['server']['openai_requests'].get('429', 0):>5} "
+                  f"{result['client']['supabase_round_trips']:>6}")
+
+    return {
+        'meta': {
+            'commit': _git("rev-parse", "--short", "HEAD"),
+            'dirty': bool(_git("status", "--porcelain", "--untracked-files=no")),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'workers': args.workers,
+            'time_scale': args.time_scale,
+            'rate_limit': args.rate_limit,
+            'latency': args.latency,
+            'db_latency_ms': args.db_latency_ms,
+            'image_size': args.image_size,
+            'pages': args.pages,
+            'replay': args.replay
+        },
+        'runs': runs
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end throughput of the grading pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--workers", type=int, default=None, help="Defaults to PIPELINE_WORKERS")
+    parser.add_argument("--time-scale", type=float, default=0.05,
+                        help="Multiply the stub's (or the cassette's) API latencies by this (1.0 = realistic)")
+    parser.add_argument("--latency", action="append", default=[], metavar="[KIND=]SPEC",
+                        help="Override a stub latency distribution, e.g. ocr=lognormal:4,0.35")
+    parser.add_argument("--rate-limit", type=float, default=0.02, help="Fraction of OpenAI requests given a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Seconds a 429 asks clients to wait")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0, help="Delay per Supabase request")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[1600, 1200], metavar=("W", "H"))
+    parser.add_argument("--pages", type=int, default=1, help="Pages per submission")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--replay", metavar="CASSETTE",
+                        help="Answer API calls from a recorded cassette instead of the stubs")
+    parser.add_argument("--output", help="Where to save the JSON results")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--assignment", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(measure(args.single, args.assignment, args.workers,
+                                 args.image_size[0], args.image_size[1], args.pages)))
+        return
+
+    if args.workers is None:
+        args.workers = int(os.environ.get("PIPELINE_WORKERS", "4"))
+    report = run_suite(args)
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{report['meta']['commit']}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nSaved {output}")
+
+if __name__ == "__main__":
+    main()
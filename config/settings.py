@@ -4,7 +4,7 @@ from typing import Optional
 from functools import lru_cache
 from dotenv import load_dotenv
 import logging
-import streamlit as st
+import sys
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,8 +16,10 @@ load_dotenv()
 def get_secret(key: str, default: str = "") -> str:
     """Get secret from Streamlit secrets or environment variables"""
     try:
-        # Try Streamlit secrets first
-        if hasattr(st, 'secrets'):
+        # Try Streamlit secrets first, but only inside the app: workers and
+        # CLIs never import Streamlit just to read their settings
+        st = sys.modules.get('streamlit')
+        if st is not None and hasattr(st, 'secrets'):
             value = st.secrets.get(key)
             if value is not None:
                 return str(value)
@@ -50,14 +52,192 @@ class Settings(BaseSettings):
     except (ValueError, TypeError):
         batch_size: int = 10
         
+    try:
+        # Submissions processed concurrently in a batch
+        pipeline_workers: int = int(get_secret("PIPELINE_WORKERS", "4"))
+    except (ValueError, TypeError):
+        pipeline_workers: int = 4
+        
+    try:
+        # Cap on image bytes held in memory across in-flight submissions
+        max_inflight_mb: int = int(get_secret("MAX_INFLIGHT_MB", "64"))
+    except (ValueError, TypeError):
+        max_inflight_mb: int = 64
+        
+    try:
+        # Budget charged for images whose size isn't known until downloaded
+        default_image_mb: int = int(get_secret("DEFAULT_IMAGE_MB", "4"))
+    except (ValueError, TypeError):
+        default_image_mb: int = 4
+        
+    try:
+        # Minutes without progress before an unfinished submission counts as stalled
+        stale_submission_minutes: int = int(get_secret("STALE_SUBMISSION_MINUTES", "15"))
+    except (ValueError, TypeError):
+        stale_submission_minutes: int = 15
+        
+    # OCR reads each page at low detail first and escalates to high detail,
+    # then to full-resolution strips, while transcript confidence is below the threshold
+    ocr_adaptive_detail: bool = get_secret("OCR_ADAPTIVE_DETAIL", "True").lower() == "true"
     try:
         ocr_confidence_threshold: float = float(get_secret("OCR_CONFIDENCE_THRESHOLD", "0.8"))
     except (ValueError, TypeError):
         ocr_confidence_threshold: float = 0.8
+    try:
+        # Overlapping horizontal strips a page is cut into for the last OCR attempt
+        ocr_tile_strips: int = int(get_secret("OCR_TILE_STRIPS", "3"))
+    except (ValueError, TypeError):
+        ocr_tile_strips: int = 3
+    try:
+        # Most image input tokens one OCR request may spend across all pages of a
+        # submission; detail levels that would cost more are skipped (0 = no limit)
+        ocr_image_token_budget: int = int(get_secret("OCR_IMAGE_TOKEN_BUDGET", "8000"))
+    except (ValueError, TypeError):
+        ocr_image_token_budget: int = 8000
+    
+    # Models per stage. Grading and feedback are cascades (comma-separated):
+    # each model answers in turn until one is confident enough
+    ocr_model: str = get_secret("OCR_MODEL", "gpt-4o")
+    grading_models: str = get_secret("GRADING_MODELS", "gpt-4o-mini,gpt-4o")
+    feedback_models: str = get_secret("FEEDBACK_MODELS", "gpt-4o-mini,gpt-4o")
+    validation_model: str = get_secret("VALIDATION_MODEL", "gpt-4o")
+    try:
+        # Lowest token probability of any rubric verdict that a grading model may return
+        grading_confidence_threshold: float = float(get_secret("GRADING_CONFIDENCE_THRESHOLD", "0.9"))
+    except (ValueError, TypeError):
+        grading_confidence_threshold: float = 0.9
+    try:
+        # Lowest average token probability of feedback text before the next model rewrites it
+        feedback_confidence_threshold: float = float(get_secret("FEEDBACK_CONFIDENCE_THRESHOLD", "0.5"))
+    except (ValueError, TypeError):
+        feedback_confidence_threshold: float = 0.5
+    
+    # LLM response cache for deterministic completions
+    llm_cache_enabled: bool = get_secret("LLM_CACHE_ENABLED", "True").lower() == "true"
+    llm_cache_backend: str = get_secret("LLM_CACHE_BACKEND", "sqlite")
+    llm_cache_path: str = get_secret("LLM_CACHE_PATH", ".cache/llm_cache.sqlite3")
+    try:
+        llm_cache_max_mb: int = int(get_secret("LLM_CACHE_MAX_MB", "256"))
+    except (ValueError, TypeError):
+        llm_cache_max_mb: int = 256
+    
+    # Prometheus endpoint for pipeline metrics; 0 disables it
+    metrics_host: str = get_secret("METRICS_HOST", "127.0.0.1")
+    try:
+        metrics_port: int = int(get_secret("METRICS_PORT", "0"))
+    except (ValueError, TypeError):
+        metrics_port: int = 0
+    
+    # Tracing: "jsonl" (local file), "otlp" (collector over HTTP) or "none"
+    trace_exporter: str = get_secret("TRACE_EXPORTER", "jsonl")
+    trace_path: str = get_secret("TRACE_PATH", ".cache/traces.jsonl")
+    otlp_endpoint: str = get_secret("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318")
+    try:
+        trace_max_mb: int = int(get_secret("TRACE_MAX_MB", "64"))
+    except (ValueError, TypeError):
+        trace_max_mb: int = 64
+    
+    # Record/replay of OpenAI and Supabase traffic: "off", "record" or "replay"
+    cassette_mode: str = get_secret("CASSETTE_MODE", "off")
+    cassette_path: str = get_secret("CASSETTE_PATH", ".cache/cassettes/session.jsonl")
+    try:
+        # Replay pacing: 1.0 keeps recorded latencies, 0.1 is ten times faster, 0 doesn't wait
+        cassette_speed: float = float(get_secret("CASSETTE_SPEED", "1.0"))
+    except (ValueError, TypeError):
+        cassette_speed: float = 1.0
+    
+    # On-demand profiling of reruns and submissions (DEBUG only)
+    profile_dir: str = get_secret("PROFILE_DIR", ".cache/profiles")
+    try:
+        profile_interval_ms: int = int(get_secret("PROFILE_INTERVAL_MS", "5"))
+    except (ValueError, TypeError):
+        profile_interval_ms: int = 5
+    try:
+        profile_top_n: int = int(get_secret("PROFILE_TOP_N", "25"))
+    except (ValueError, TypeError):
+        profile_top_n: int = 25
+    
+    # Local image checks before OCR; failing images are flagged instead of sent
+    quality_gate: bool = get_secret("QUALITY_GATE", "True").lower() == "true"
+    try:
+        # Laplacian variance (at 512px) below which a photo is too blurry to read
+        blur_threshold: float = float(get_secret("BLUR_THRESHOLD", "40"))
+    except (ValueError, TypeError):
+        blur_threshold: float = 40.0
+    try:
+        # Fraction of the page covered by ink below which it counts as blank
+        min_ink_coverage: float = float(get_secret("MIN_INK_COVERAGE", "0.002"))
+    except (ValueError, TypeError):
+        min_ink_coverage: float = 0.002
+    try:
+        # Max differing bits (of 64) between perceptual hashes of look-alike pages (a warning only); negative disables
+        duplicate_hash_distance: int = int(get_secret("DUPLICATE_HASH_DISTANCE", "4"))
+    except (ValueError, TypeError):
+        duplicate_hash_distance: int = 4
+    
+    # Speculative ingestion: upload + OCR start as soon as files are dropped
+    speculative_ingest: bool = get_secret("SPECULATIVE_INGEST", "False").lower() == "true"
+    try:
+        speculative_workers: int = int(get_secret("SPECULATIVE_WORKERS", "4"))
+    except (ValueError, TypeError):
+        speculative_workers: int = 4
     
     # Storage Settings
     storage_bucket: str = get_secret("STORAGE_BUCKET", "ap-grader-images")
     
+    # Direct browser-to-storage uploads via signed upload URLs
+    direct_uploads: bool = get_secret("DIRECT_UPLOADS", "False").lower() == "true"
+    try:
+        # Longest side after client-side downscaling; 0 uploads originals
+        client_image_max_dimension: int = int(get_secret("CLIENT_IMAGE_MAX_DIMENSION", "2000"))
+    except (ValueError, TypeError):
+        client_image_max_dimension: int = 2000
+    try:
+        # Resolution PDF pages are rasterized at for OCR
+        pdf_render_dpi: int = int(get_secret("PDF_RENDER_DPI", "200"))
+    except (ValueError, TypeError):
+        pdf_render_dpi: int = 200
+    try:
+        # Processes rasterizing PDF pages (0 = half the CPU cores)
+        pdf_render_workers: int = int(get_secret("PDF_RENDER_WORKERS", "0"))
+    except (ValueError, TypeError):
+        pdf_render_workers: int = 0
+
+    # Hot folders watched by `python -m services.hotfolder`: "path=assignment_id,..."
+    hot_folders: str = get_secret("HOT_FOLDERS", "")
+    try:
+        # Folders are rescanned this often, even when inotify is available (network shares miss events)
+        hot_folder_poll_seconds: float = float(get_secret("HOT_FOLDER_POLL_SECONDS", "5"))
+    except (ValueError, TypeError):
+        hot_folder_poll_seconds: float = 5.0
+    try:
+        # A file is picked up once its size and modification time stop changing for this long
+        hot_folder_settle_seconds: float = float(get_secret("HOT_FOLDER_SETTLE_SECONDS", "3"))
+    except (ValueError, TypeError):
+        hot_folder_settle_seconds: float = 3.0
+
+    # Ingestion API settings
+    api_tokens: str = get_secret("API_TOKENS", "")  # Comma-separated bearer tokens accepted by the API
+    api_host: str = get_secret("API_HOST", "127.0.0.1")
+    try:
+        api_port: int = int(get_secret("API_PORT", "8600"))
+    except (ValueError, TypeError):
+        api_port: int = 8600
+    try:
+        # Jobs processed at once; each runs PIPELINE_WORKERS submissions concurrently
+        api_job_workers: int = int(get_secret("API_JOB_WORKERS", "2"))
+    except (ValueError, TypeError):
+        api_job_workers: int = 2
+    try:
+        api_max_files: int = int(get_secret("API_MAX_FILES", "1000"))
+    except (ValueError, TypeError):
+        api_max_files: int = 1000
+    try:
+        # Finished jobs are forgotten after this long; their submissions stay in the database
+        api_job_ttl_hours: float = float(get_secret("API_JOB_TTL_HOURS", "24"))
+    except (ValueError, TypeError):
+        api_job_ttl_hours: float = 24.0
+
     class Config:
         case_sensitive = True
 
@@ -80,9 +260,17 @@ class Settings(BaseSettings):
         missing_settings = [k for k, v in required_settings.items() if not v]
         if missing_settings:
             error_msg = f"Missing required settings: {', '.join(missing_settings)}"
-            if not hasattr(st, 'secrets'):
+            st = sys.modules.get('streamlit')
+            if st is None or not hasattr(st, 'secrets'):
                 error_msg += "\nNo Streamlit secrets found. Are you running locally? Check your .env file."
             raise ValueError(error_msg)
+
+        # A cascade needs at least one model to ask
+        empty_cascades = [name for name, value in (("GRADING_MODELS", self.grading_models),
+                                                   ("FEEDBACK_MODELS", self.feedback_models))
+                          if not any(model.strip() for model in value.split(","))]
+        if empty_cascades:
+            raise ValueError(f"No models configured in {', '.join(empty_cascades)}")
     
     def _log_status(self):
         """Log configuration status"""
@@ -0,0 +1,12 @@
+-- Stage-level checkpoints so failed or stalled submissions can be resumed
+-- from their first incomplete stage instead of being uploaded again.
+alter table submissions add column if not exists stage text not null default 'uploaded';
+alter table submissions add column if not exists storage_path text;
+alter table submissions add column if not exists ocr_result jsonb;
+alter table submissions add column if not exists updated_at timestamptz not null default now();
+
+-- Rows that already finished before checkpoints existed
+update submissions set stage = 'complete' where status = 'complete';
+
+create index if not exists submissions_assignment_status_idx
+    on submissions (assignment_id, status);
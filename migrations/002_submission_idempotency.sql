@@ -0,0 +1,8 @@
+-- One submission per (assignment, student, image, batch): reruns and double
+-- clicks attach to the existing row instead of starting new work.
+alter table submissions add column if not exists batch_id text;
+alter table submissions add column if not exists idempotency_key text;
+
+-- NULL keys (submissions made outside a batch) stay unconstrained
+create unique index if not exists submissions_idempotency_key_idx
+    on submissions (idempotency_key);
@@ -0,0 +1,3 @@
+-- Local image checks run before OCR. Images that fail them are stored with
+-- status 'flagged' and never sent to the vision model.
+alter table submissions add column if not exists quality jsonb;
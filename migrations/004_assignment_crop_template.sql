@@ -0,0 +1,3 @@
+-- Optional answer-region template per assignment. When set, only the answer
+-- boxes of each page are sent for OCR; the full image stays in storage.
+alter table assignments add column if not exists crop_template jsonb;
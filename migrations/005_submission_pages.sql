@@ -0,0 +1,3 @@
+-- Multi-page submissions: public URLs of every page, in order. image_path
+-- and storage_path still point at the first page.
+alter table submissions add column if not exists image_paths jsonb;
@@ -19,6 +19,8 @@ class GPTEvaluation(BaseModel):
     points_earned: List[str]           # Specific points demonstrated
     misconceptions: List[str]          # Errors or misunderstandings
     explanation: str                   # Detailed feedback
+    model: Optional[str] = None        # Model whose answer was used
+    confidence: Optional[float] = None # Lowest verdict probability in that answer
 
 class RubricMapping(BaseModel):
     """Maps teacher's rubric points to standard assessment criteria"""
@@ -37,3 +39,4 @@ class AssessmentResult(BaseModel):
     misconceptions: List[str]          # List of misconceptions
     feedback: str                      # Detailed feedback
     confidence: float                  # Confidence in assessment
+    model: Optional[str] = None        # Model that graded it
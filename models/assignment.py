@@ -1,8 +1,10 @@
 # models/assignment.py
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from pydantic import BaseModel, Field
 from uuid import UUID
 from datetime import datetime
+import hashlib
+import json
 
 class RubricRequirement(BaseModel):
     """Single requirement in a rubric"""
@@ -15,11 +17,61 @@ class RubricMetadata(BaseModel):
     examples: List[str] = Field(default_factory=list)
     version: int = 1
 
+class RubricDiff(BaseModel):
+    """Requirement-level changes between two versions of a rubric"""
+    added: List[str] = Field(default_factory=list)        # New requirement texts - need evaluation
+    removed: List[str] = Field(default_factory=list)      # Dropped requirement texts
+    repointed: List[str] = Field(default_factory=list)    # Same text, different points
+    unchanged: List[str] = Field(default_factory=list)    # Same text and points
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.removed or self.repointed)
+
 class RubricStructure(BaseModel):
     """Complete rubric structure"""
     requirements: List[RubricRequirement] = Field(default_factory=list)
     metadata: RubricMetadata = Field(default_factory=RubricMetadata)
 
+    def diff(self, new: "RubricStructure") -> RubricDiff:
+        """
+        Compare against a newer rubric. Requirements are matched by text, so an
+        edited requirement shows up as one removed and one added point.
+        """
+        old_points = {req.text.strip(): req.points for req in self.requirements}
+        new_points = {req.text.strip(): req.points for req in new.requirements}
+        result = RubricDiff()
+        for text, points in new_points.items():
+            if text not in old_points:
+                result.added.append(text)
+            elif old_points[text] != points:
+                result.repointed.append(text)
+            else:
+                result.unchanged.append(text)
+        result.removed = [text for text in old_points if text not in new_points]
+        return result
+
+class CropRegion(BaseModel):
+    """Answer box on the worksheet, as fractions of the (aligned) page"""
+    x: float = Field(ge=0, le=1)
+    y: float = Field(ge=0, le=1)
+    width: float = Field(gt=0, le=1)
+    height: float = Field(gt=0, le=1)
+    label: str = ""
+
+class CropTemplate(BaseModel):
+    """
+    Where the answers are on a fixed worksheet. Only these regions are sent
+    for OCR; the full photo is still stored and shown.
+    `align` is "none" (regions relative to the whole photo), "page" (relative
+    to the detected sheet of paper) or "fiducials" (corner marks matched
+    against their positions on the reference worksheet).
+    """
+    regions: List[CropRegion] = Field(default_factory=list)
+    align: str = "none"
+    # Corner marks on the reference page (top-left, top-right, bottom-left, bottom-right), normalized
+    fiducials: List[Optional[Tuple[float, float]]] = Field(default_factory=list)
+
 class Assignment(BaseModel):
     """Assignment model"""
     id: Optional[UUID] = None
@@ -28,9 +80,18 @@ class Assignment(BaseModel):
     question_text: str
     points_possible: int
     rubric_structure: RubricStructure = Field(default_factory=RubricStructure)
+    crop_template: Optional[CropTemplate] = None
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     
+    def rubric_hash(self) -> str:
+        """Stable hash of everything that affects grading: question and rubric"""
+        payload = json.dumps(
+            {"question_text": self.question_text, "rubric": self.rubric_structure.model_dump()},
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
     def to_dict(self) -> Dict:
         """Convert to dictionary for database storage"""
         return {
@@ -38,6 +99,7 @@ class Assignment(BaseModel):
             "question_text": self.question_text,
             "points_possible": self.points_possible,
             "rubric_structure": self.rubric_structure.dict(),
+            "crop_template": self.crop_template.model_dump() if self.crop_template else None,
             "teacher_id": str(self.teacher_id) if self.teacher_id else None
         }
     
@@ -46,6 +108,7 @@ class Assignment(BaseModel):
         """Create from database dictionary"""
         if "rubric_structure" in data and isinstance(data["rubric_structure"], str):
             # Handle JSON string from database
-            import json
             data["rubric_structure"] = json.loads(data["rubric_structure"])
+        if isinstance(data.get("crop_template"), str):
+            data["crop_template"] = json.loads(data["crop_template"])
         return cls(**data)
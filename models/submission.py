@@ -23,14 +23,21 @@ class Submission(BaseModel):
     assignment_id: UUID4
     student_id: str
     status: str = "pending"
+    stage: str = "uploaded"
     image_path: str
+    image_paths: Optional[List[str]] = None  # every page, in order, for multi-page submissions
+    storage_path: Optional[str] = None
     ocr_text: Optional[str] = None
+    ocr_result: Optional[Dict] = None
     feedback_md: Optional[str] = None
     score: Optional[Dict] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     processed_at: Optional[datetime] = None
     retry_count: int = 0
     error_message: Optional[str] = None
+    quality: Optional[Dict] = None
+    batch_id: Optional[str] = None
+    idempotency_key: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -58,12 +65,19 @@ class Submission(BaseModel):
             "assignment_id": str(self.assignment_id),
             "student_id": str(self.student_id),
             "status": self.status,
+            "stage": self.stage,
             "image_path": self.image_path,
+            "image_paths": self.image_paths,
+            "storage_path": self.storage_path,
             "ocr_text": self.ocr_text,
+            "ocr_result": self.ocr_result,
             "feedback_md": self.feedback_md,
             "score": self.score,
             "created_at": self.created_at.isoformat(),
             "processed_at": self.processed_at.isoformat() if self.processed_at else None,
             "retry_count": self.retry_count,
-            "error_message": self.error_message
+            "error_message": self.error_message,
+            "quality": self.quality,
+            "batch_id": self.batch_id,
+            "idempotency_key": self.idempotency_key
         }
@@ -0,0 +1,240 @@
+import re
+import streamlit as st
+import altair as alt
+import pandas as pd
+from config.settings import get_settings
+from services.llm_cache import get_llm_cache
+from services.ocr_service import DETAIL_LEVELS
+from services.metrics import (
+    CASCADE_ATTEMPTS, CASCADE_SECONDS, DB_SECONDS, LLM_COST, LLM_ERRORS, LLM_REQUEST_SECONDS, LLM_RETRIES, LLM_TOKENS,
+    OCR_ATTEMPTS, OCR_IMAGE_TOKENS, STAGE_SECONDS, SUBMISSIONS, render_prometheus, start_metrics_server
+)
+from services.tracing import build_traces, read_spans, recent_spans
+from pages.components.profiler import profile_rerun
+
+profile_rerun("admin")
+
+settings = get_settings()
+start_metrics_server()
+
+def ms(seconds) -> str:
+    """Format a latency for display"""
+    return "--" if seconds is None else f"{seconds * 1000:,.0f} ms"
+
+def stage_rows() -> list:
+    rows = []
+    for stage in ["upload", "ocr", "grading", "feedback"]:
+        count = STAGE_SECONDS.count(stage=stage)
+        if not count:
+            continue
+        rows.append({
+            "Stage": stage,
+            "Runs": count,
+            "Errors": STAGE_SECONDS.count(stage=stage, outcome="error"),
+            "p50": ms(STAGE_SECONDS.quantile(0.5, stage=stage)),
+            "p95": ms(STAGE_SECONDS.quantile(0.95, stage=stage)),
+            "Mean": ms(STAGE_SECONDS.sum(stage=stage) / count)
+        })
+    return rows
+
+def llm_rows() -> list:
+    rows = []
+    for service in LLM_REQUEST_SECONDS.label_values("service"):
+        requests = LLM_REQUEST_SECONDS.count(service=service)
+        ok = sum(
+            LLM_REQUEST_SECONDS.count(service=service, status=status)
+            for status in LLM_REQUEST_SECONDS.label_values("status", service=service)
+            if status.startswith("2")
+        )
+        rows.append({
+            "Service": service,
+            "Requests": requests,
+            "Failed": requests - ok + int(LLM_ERRORS.value(service=service)),
+            "Retries": int(LLM_RETRIES.value(service=service)),
+            "p95": ms(LLM_REQUEST_SECONDS.quantile(0.95, service=service)),
+            "Input tokens": int(LLM_TOKENS.value(service=service, kind="input")),
+            "Cached tokens": int(LLM_TOKENS.value(service=service, kind="cached")),
+            "Output tokens": int(LLM_TOKENS.value(service=service, kind="output")),
+            "Cost (USD)": f"{LLM_COST.value(service=service):.4f}"
+        })
+    return rows
+
+def cascade_rows() -> list:
+    rows = []
+    for stage in CASCADE_ATTEMPTS.label_values("stage"):
+        for model in CASCADE_ATTEMPTS.label_values("model", stage=stage):
+            answers = int(CASCADE_ATTEMPTS.value(stage=stage, model=model))
+            escalated = int(CASCADE_ATTEMPTS.value(stage=stage, model=model, outcome="escalated"))
+            # Costs are labelled with the dated model name the API reports
+            cost = sum(LLM_COST.value(service=stage, model=name)
+                       for name in LLM_COST.label_values("model", service=stage)
+                       if re.fullmatch(rf"{re.escape(model)}(-\d{{4}}-\d{{2}}-\d{{2}})?", name))
+            rows.append({
+                "Stage": stage,
+                "Model": model,
+                "Answers": answers,
+                "Escalated": f"{escalated} ({escalated / answers:.0%})",
+                "p50": ms(CASCADE_SECONDS.quantile(0.5, stage=stage, model=model)),
+                "p95": ms(CASCADE_SECONDS.quantile(0.95, stage=stage, model=model)),
+                "Cost (USD)": f"{cost:.4f}"
+            })
+    return rows
+
+def ocr_detail_rows() -> list:
+    rows = []
+    for assignment_id in OCR_ATTEMPTS.label_values("assignment_id"):
+        pages = int(OCR_ATTEMPTS.value(assignment_id=assignment_id, outcome="accepted"))
+        row = {"Assignment": assignment_id, "Pages": pages}
+        for level in DETAIL_LEVELS:
+            row[f"Read at {level}"] = int(OCR_ATTEMPTS.value(assignment_id=assignment_id, detail=level,
+                                                             outcome="accepted"))
+        escalated = int(OCR_ATTEMPTS.value(assignment_id=assignment_id, detail="low", outcome="escalated"))
+        row["Escalation rate"] = f"{escalated / pages:.0%}" if pages else "--"
+        row["Image tokens saved"] = int(OCR_IMAGE_TOKENS.value(assignment_id=assignment_id, kind="baseline")
+                                        - OCR_IMAGE_TOKENS.value(assignment_id=assignment_id, kind="spent"))
+        rows.append(row)
+    return rows
+
+def db_rows() -> list:
+    rows = []
+    for target in DB_SECONDS.label_values("target"):
+        for operation in DB_SECONDS.label_values("operation", target=target):
+            count = DB_SECONDS.count(target=target, operation=operation)
+            rows.append({
+                "Target": target,
+                "Operation": operation,
+                "Round trips": count,
+                "Errors": DB_SECONDS.count(target=target, operation=operation, outcome="error"),
+                "p95": ms(DB_SECONDS.quantile(0.95, target=target, operation=operation)),
+                "Total time": f"{DB_SECONDS.sum(target=target, operation=operation):.2f} s"
+            })
+    return rows
+
+def submission_traces(from_file: bool) -> list:
+    """Traces rooted at a submission run, slowest first"""
+    spans = read_spans() if from_file else recent_spans()
+    traces = [t for t in build_traces(spans) if t['name'] in ("submission", "submission.resume")]
+    return sorted(traces, key=lambda t: t['duration_ms'], reverse=True)
+
+def render_waterfall(trace: dict):
+    """Gantt-style chart of a trace's spans, nested spans indented under their parent"""
+    rows = pd.DataFrame([
+        {
+            "span": f"{i:02d} {'· ' * s['depth']}{s['name']}",
+            "start": s['start_ms'],
+            "end": s['end_ms'],
+            "duration (ms)": round(s['duration_ms'], 1),
+            "status": "error" if s['error'] else "ok"
+        }
+        for i, s in enumerate(trace['spans'])
+    ])
+    chart = alt.Chart(rows).mark_bar().encode(
+        x=alt.X("start:Q", title="ms since submission start"),
+        x2="end:Q",
+        y=alt.Y("span:N", sort=None, title=None),
+        color=alt.Color("status:N", scale=alt.Scale(domain=["ok", "error"], range=["#4c78a8", "#e45756"])),
+        tooltip=["span", "duration (ms)", "start"]
+    ).properties(height=max(120, 22 * len(rows)))
+    st.altair_chart(chart, use_container_width=True)
+
+st.header("Pipeline Metrics")
+st.caption("Collected by this app process since it started.")
+
+# Headline numbers
+completed = SUBMISSIONS.value(outcome="complete")
+tokens = LLM_TOKENS.value(kind="input") + LLM_TOKENS.value(kind="output")
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Submissions completed", int(completed))
+col2.metric("Submissions failed", int(SUBMISSIONS.value(outcome="error")))
+col3.metric("Tokens per submission", f"{tokens / completed:,.0f}" if completed else "--")
+col4.metric("Estimated spend", f"${LLM_COST.value():.2f}")
+
+st.subheader("Stage latency")
+rows = stage_rows()
+if rows:
+    st.table(rows)
+else:
+    st.info("No submissions processed yet")
+
+st.subheader("OpenAI requests")
+rows = llm_rows()
+if rows:
+    st.table(rows)
+else:
+    st.info("No OpenAI requests yet")
+
+st.subheader("Model cascades")
+st.caption("Escalated answers were below the stage's confidence threshold and went to the next model.")
+rows = cascade_rows()
+if rows:
+    st.table(rows)
+else:
+    st.info("No grading or feedback answers yet")
+
+st.subheader("OCR detail escalation")
+rows = ocr_detail_rows()
+if rows:
+    st.table(rows)
+else:
+    st.info("No pages read with adaptive detail yet")
+
+st.subheader("Supabase round trips")
+rows = db_rows()
+if rows:
+    st.table(rows)
+else:
+    st.info("No Supabase requests yet")
+
+st.subheader("LLM cache")
+cache_stats = get_llm_cache().stats()
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Hit rate", f"{cache_stats['hit_rate']:.0%}")
+col2.metric("Hits / misses", f"{cache_stats['hits']} / {cache_stats['misses']}")
+col3.metric("Entries", cache_stats.get('entries', 0))
+col4.metric("Size", f"{cache_stats.get('bytes', 0) / (1024 * 1024):.1f} MB")
+
+st.subheader("Slowest submissions")
+from_file = settings.trace_exporter == "jsonl" and st.toggle(
+    "Include traces from the trace file",
+    help=f"Read {settings.trace_path} instead of only this process's recent traces"
+)
+traces = submission_traces(from_file)
+if traces:
+    batches = sorted({t['attributes'].get('batch_id') for t in traces if t['attributes'].get('batch_id')})
+    batch = st.selectbox("Batch", ["All batches"] + batches)
+    if batch != "All batches":
+        traces = [t for t in traces if t['attributes'].get('batch_id') == batch]
+    limit = st.slider("Show", min_value=5, max_value=50, value=10)
+    slowest = traces[:limit]
+
+    st.table([
+        {
+            "Student": t['attributes'].get('student_id', '--'),
+            "Submission": t['attributes'].get('submission_id', '--'),
+            "Total": f"{t['duration_ms'] / 1000:.1f} s",
+            "Slowest step": max((s for s in t['spans'] if s['depth'] == 1), default=t['spans'][0],
+                                key=lambda s: s['duration_ms'])['name'],
+            "Failed": "❌" if t['error'] else ""
+        }
+        for t in slowest
+    ])
+
+    chosen = st.selectbox(
+        "Waterfall",
+        options=range(len(slowest)),
+        format_func=lambda i: f"{slowest[i]['attributes'].get('student_id', slowest[i]['trace_id'][:8])} "
+                              f"({slowest[i]['duration_ms'] / 1000:.1f} s)"
+    )
+    render_waterfall(slowest[chosen])
+else:
+    st.info("No submission traces yet")
+
+# Raw export, same text as the scrape endpoint
+exposition = render_prometheus()
+with st.expander("Prometheus export"):
+    if settings.metrics_port:
+        st.caption(f"Scrape endpoint: http://{settings.metrics_host}:{settings.metrics_port}/metrics")
+    else:
+        st.caption("Set METRICS_PORT to serve these metrics for Prometheus.")
+    st.code(exposition, language="text")
+    st.download_button("Download", exposition, file_name="metrics.prom", mime="text/plain")
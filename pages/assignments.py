@@ -1,10 +1,16 @@
 import streamlit as st
 import json
+from services.auth import streamlit_auth
 from services.storage import StorageService
 from models.assignment import Assignment, RubricRequirement, RubricStructure, RubricMetadata
+from services.regrade import RegradeEngine
+from pages.components.crop_template import crop_template_editor
+from pages.components.profiler import profile_rerun
+
+profile_rerun("assignments")
 
 # Initialize storage service
-storage = StorageService()
+storage = StorageService(streamlit_auth())
 
 # Main page render
 st.header("Assignment Management")
@@ -42,6 +48,9 @@ with tab1:
                         st.rerun()
                 total_points += req['points']
             
+            st.subheader("Answer Area")
+            crop_template = crop_template_editor("new_crop")
+            
             # Assignment Details Section
             with st.form("assignment_form"):
                 name = st.text_input("Assignment Name")
@@ -127,7 +136,8 @@ with tab1:
                             name=name,
                             question_text=question,
                             points_possible=total_points,
-                            rubric_structure=rubric_structure
+                            rubric_structure=rubric_structure,
+                            crop_template=crop_template
                         )
                         
                         storage.create_assignment(assignment)
@@ -166,6 +176,88 @@ with tab1:
                             st.write(f"{i}. {example}")
 
 with tab2:
+    def render_edit_form(storage: StorageService, assignment_data: dict):
+        """Edit an assignment's question and rubric, then re-grade its submissions"""
+        old = Assignment.from_dict(dict(assignment_data))
+        
+        st.write("**Answer Area**")
+        crop_template = crop_template_editor(f"edit_crop_{assignment_data['id']}", old.crop_template)
+        
+        with st.form(f"edit_form_{assignment_data['id']}"):
+            name = st.text_input("Assignment Name", value=old.name)
+            question = st.text_area("Question Text", value=old.question_text, height=150)
+            
+            st.write("**Rubric Requirements**")
+            rows = st.data_editor(
+                [{"text": req.text, "points": req.points} for req in old.rubric_structure.requirements],
+                num_rows="dynamic",
+                use_container_width=True,
+                key=f"edit_requirements_{assignment_data['id']}"
+            )
+            notes = st.text_area("Grading Notes", value=old.rubric_structure.metadata.notes)
+            regrade = st.checkbox(
+                "Re-grade existing submissions",
+                value=True,
+                help="Reuses stored transcripts and only evaluates new or edited rubric points"
+            )
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                save = st.form_submit_button("Save Changes", type="primary")
+            with col2:
+                cancel = st.form_submit_button("Cancel")
+        
+        if cancel:
+            st.session_state.editing_assignment = None
+            st.rerun()
+        
+        if save:
+            requirements = [
+                RubricRequirement(text=row['text'].strip(), points=int(row.get('points') or 1))
+                for row in rows
+                if row.get('text') and row['text'].strip()
+            ]
+            if not requirements:
+                st.error("Please keep at least one requirement")
+                return
+            
+            new = old.model_copy(update={
+                "name": name,
+                "question_text": question,
+                "points_possible": sum(req.points for req in requirements),
+                "crop_template": crop_template,
+                "rubric_structure": RubricStructure(
+                    requirements=requirements,
+                    metadata=old.rubric_structure.metadata.model_copy(update={
+                        "notes": notes,
+                        "version": old.rubric_structure.metadata.version + 1
+                    })
+                )
+            })
+            
+            try:
+                progress = st.progress(0.0, text="Saving assignment...")
+                summary = RegradeEngine(storage_service=storage).apply_edit(
+                    old,
+                    new,
+                    regrade=regrade,
+                    on_progress=lambda done, total: progress.progress(
+                        done / total, text=f"Re-grading {done}/{total} submissions..."
+                    )
+                )
+                progress.empty()
+                st.session_state.editing_assignment = None
+                if regrade and summary['submissions']:
+                    st.success(
+                        f"Saved. Re-graded {summary['regraded']} of {summary['submissions']} submissions "
+                        f"({summary['feedback_regenerated']} with new feedback"
+                        f"{', ' + str(summary['failed']) + ' failed' if summary['failed'] else ''})."
+                    )
+                else:
+                    st.success("Assignment saved.")
+            except Exception as e:
+                st.error(f"Error saving assignment: {str(e)}")
+    
     def render_assignments_list(storage: StorageService):
         st.subheader("Your Assignments")
         
@@ -205,12 +297,11 @@ with tab2:
                                     st.write(f"{i}. {example}")
                     
                     with cols[1]:
-                        st.button(
-                            "Edit",
-                            key=f"edit_{assignment['id']}",
-                            disabled=True,
-                            help="Coming soon!"
-                        )
+                        if st.button("Edit", key=f"edit_{assignment['id']}"):
+                            st.session_state.editing_assignment = assignment['id']
+                    
+                    if st.session_state.get('editing_assignment') == assignment['id']:
+                        render_edit_form(storage, assignment)
                         
         except Exception as e:
             st.error(f"Error loading assignments: {str(e)}")
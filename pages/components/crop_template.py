@@ -0,0 +1,81 @@
+# pages/components/crop_template.py
+import streamlit as st
+from typing import Optional
+
+from models.assignment import CropRegion, CropTemplate
+from services.cropping import draw_regions, reference_fiducials
+
+ALIGN_OPTIONS = {
+    "none": "Whole photo (scans and fixed camera setups)",
+    "page": "Detected sheet of paper",
+    "fiducials": "Corner marks on the worksheet",
+}
+
+def crop_template_editor(key: str, current: Optional[CropTemplate] = None) -> Optional[CropTemplate]:
+    """
+    Answer regions for an assignment, drawn against a reference worksheet.
+    Returns the template to save, or None to send whole pages.
+    """
+    enabled = st.checkbox(
+        "Only send the answer area for transcription",
+        value=bool(current and current.regions),
+        key=f"{key}_enabled",
+        help="For worksheets with a fixed answer box: skips the printed question and margins, "
+             "which makes OCR cheaper and faster. Full photos are still stored."
+    )
+    if not enabled:
+        return None
+
+    align = st.selectbox(
+        "Line regions up with",
+        options=list(ALIGN_OPTIONS),
+        index=list(ALIGN_OPTIONS).index(current.align) if current else 1,
+        format_func=ALIGN_OPTIONS.get,
+        key=f"{key}_align"
+    )
+    reference = st.file_uploader(
+        "Reference worksheet (a blank or filled-in copy)",
+        type=["jpg", "jpeg", "png"],
+        key=f"{key}_reference"
+    )
+    st.caption("Regions are percentages of the page: left, top, width and height.")
+    rows = st.data_editor(
+        [
+            {"label": r.label, "left %": round(r.x * 100, 1), "top %": round(r.y * 100, 1),
+             "width %": round(r.width * 100, 1), "height %": round(r.height * 100, 1)}
+            for r in (current.regions if current else [])
+        ] or [{"label": "Answer", "left %": 5.0, "top %": 30.0, "width %": 90.0, "height %": 60.0}],
+        num_rows="dynamic",
+        use_container_width=True,
+        key=f"{key}_regions"
+    )
+
+    regions = []
+    for row in rows:
+        try:
+            left, top = float(row["left %"]) / 100, float(row["top %"]) / 100
+            width = min(float(row["width %"]) / 100, 1 - left)
+            height = min(float(row["height %"]) / 100, 1 - top)
+            regions.append(CropRegion(x=left, y=top, width=width, height=height, label=row.get("label") or ""))
+        except (TypeError, ValueError, KeyError):
+            st.warning(f"Skipping an incomplete region: {row}")
+    if not regions:
+        st.warning("Add at least one region, or untick the box to send whole pages.")
+        return None
+
+    fiducials = list(current.fiducials) if current and current.align == "fiducials" else []
+    if reference is not None:
+        data = reference.getvalue()
+        if align == "fiducials":
+            marks = reference_fiducials(data)
+            if sum(mark is not None for mark in marks) < 3:
+                st.error("Couldn't find at least three corner marks on the reference worksheet.")
+                return None
+            # Mark positions on the reference are what photos are aligned to
+            fiducials = [(float(mark[0]), float(mark[1])) if mark else None for mark in marks]
+        template = CropTemplate(regions=regions, align=align, fiducials=fiducials)
+        st.image(draw_regions(data, template), caption="Regions as they will be cut from this page")
+    elif align == "fiducials" and not fiducials:
+        st.info("Upload the reference worksheet so its corner marks can be located.")
+        return None
+    return CropTemplate(regions=regions, align=align, fiducials=fiducials)
@@ -0,0 +1,77 @@
+# pages/components/direct_upload.py
+import streamlit as st
+import streamlit.components.v1 as components
+from pathlib import Path
+from typing import Dict, List
+
+from services.storage import StorageService
+
+_direct_upload = components.declare_component(
+    "direct_upload",
+    path=str(Path(__file__).parent / "direct_upload_frontend")
+)
+
+def render_direct_upload(storage: StorageService,
+                         assignment_id: str,
+                         compress: bool = True,
+                         max_dimension: int = 2000,
+                         quality: float = 0.85,
+                         concurrency: int = 4,
+                         key: str = "direct_upload") -> List[Dict]:
+    """
+    Browser-side uploader that sends images straight to the storage bucket.
+
+    The browser reports the chosen files, we answer with signed upload URLs,
+    and the browser uploads (optionally downscaled) images itself. Returns
+    the uploaded files as {name, path, type} once done.
+
+    Only what the server issued is trusted: the browser reports which target
+    it uploaded to, and the path comes from the issued target. The bytes are
+    not fetched here; the pipeline downloads each image once, when it reads it.
+    """
+    targets_key = f"{key}_targets"
+    targets = st.session_state.get(targets_key)
+
+    value = _direct_upload(
+        targets=targets,
+        compress=compress,
+        max_dimension=max_dimension,
+        quality=quality,
+        concurrency=concurrency,
+        key=key,
+        default=None
+    )
+
+    if not value:
+        return []
+
+    if value.get('stage') == 'request':
+        # New selection: issue one signed upload URL per file and re-render
+        if not targets or targets['request_id'] != value['request_id']:
+            st.session_state[targets_key] = {
+                'request_id': value['request_id'],
+                'files': storage.create_upload_targets(assignment_id, value['files'])
+            }
+            st.rerun()
+        return []
+
+    if value.get('stage') == 'error':
+        st.error(f"Upload failed: {value.get('error')}")
+        return []
+
+    if not targets or value.get('request_id') != targets['request_id']:
+        return []
+    return _verified_files(targets['files'], value.get('files', []))
+
+def _verified_files(issued: List[Dict], reported: List[Dict]) -> List[Dict]:
+    """The issued targets the browser reports as uploaded"""
+    files, seen = [], set()
+    for file in reported:
+        index = file.get('index') if isinstance(file, dict) else None
+        if not isinstance(index, int) or not 0 <= index < len(issued) or index in seen:
+            continue
+        seen.add(index)
+        target = issued[index]
+        content_type = file.get('type') if file.get('type') in ("image/jpeg", "image/png") else None
+        files.append((index, {'name': target['name'], 'path': target['path'], 'type': content_type}))
+    return [file for _, file in sorted(files, key=lambda entry: entry[0])]
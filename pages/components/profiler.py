@@ -0,0 +1,27 @@
+# pages/components/profiler.py
+import sys
+import streamlit as st
+from config.settings import get_settings
+from services.profiling import Profiler
+
+def profile_rerun(page: str):
+    """
+    Sidebar button (DEBUG only) that profiles this session's next rerun of
+    the page. Call at the top of the page script; sampling stops when the
+    script finishes.
+    """
+    if not get_settings().debug:
+        return
+
+    if st.session_state.pop(f"profile_next_{page}", False):
+        script = sys._getframe(1).f_code.co_filename
+        Profiler(
+            f"rerun {page}",
+            f"rerun:{page}",
+            until=lambda stack: all(file != script for _, file, _ in stack)
+        ).start()
+
+    if st.sidebar.button("Profile next rerun", key=f"profile_button_{page}",
+                         help="Record a flame graph and allocation snapshot of the next interaction on this page"):
+        st.session_state[f"profile_next_{page}"] = True
+        st.sidebar.caption("The next rerun will be profiled; see the profiles page.")
@@ -0,0 +1,100 @@
+# pages/components/upload_preview.py
+import math
+import streamlit as st
+from typing import Dict, List
+
+from services.images import ImagePreview, build_previews, content_hash, find_duplicates
+
+PAGE_SIZE = 12
+GRID_COLUMNS = 4
+PREVIEW_WORKERS = 4
+
+def _file_hashes(uploaded_files) -> Dict[str, str]:
+    """Hash each upload once; Streamlit keeps file_id stable across reruns"""
+    known = st.session_state.setdefault('upload_hashes', {})
+    hashes = {}
+    for file in uploaded_files:
+        if file.file_id not in known:
+            known[file.file_id] = content_hash(file.getbuffer())
+        hashes[file.file_id] = known[file.file_id]
+
+    # Forget files that were removed from the uploader
+    for file_id in list(known):
+        if file_id not in hashes:
+            del known[file_id]
+    return hashes
+
+def _get_previews(uploaded_files, hashes: Dict[str, str]) -> Dict[str, ImagePreview]:
+    """Return cached previews, decoding only new images in a thread pool"""
+    cache = st.session_state.setdefault('preview_cache', {})
+    missing = {}
+    for file in uploaded_files:
+        file_hash = hashes[file.file_id]
+        if file_hash not in cache and file_hash not in missing:
+            missing[file_hash] = bytes(file.getbuffer())
+
+    if missing:
+        with st.spinner(f"Generating {len(missing)} preview(s)..."):
+            cache.update(build_previews(missing, max_workers=PREVIEW_WORKERS))
+
+    # Keep the cache bounded to the current selection
+    current = set(hashes.values())
+    for file_hash in list(cache):
+        if file_hash not in current:
+            del cache[file_hash]
+    return cache
+
+def render_upload_preview(uploaded_files: List) -> Dict[str, List[str]]:
+    """
+    Render a paged thumbnail grid of the selected files.
+    Returns filename -> list of warnings for files that look problematic.
+    """
+    hashes = _file_hashes(uploaded_files)
+    previews = _get_previews(uploaded_files, hashes)
+
+    # Collect warnings per file, including duplicates within the selection
+    warnings: Dict[str, List[str]] = {}
+    named = [(file.name, previews[hashes[file.file_id]]) for file in uploaded_files]
+    duplicates = find_duplicates(named)
+    for name, preview in named:
+        file_warnings = list(preview.flags)
+        if name in duplicates:
+            other, identical = duplicates[name]
+            file_warnings.append(f"Duplicate of {other}" if identical else f"Looks like {other}")
+        if file_warnings:
+            warnings[name] = file_warnings
+
+    if warnings:
+        with st.expander(f"⚠️ {len(warnings)} file(s) may need attention", expanded=True):
+            for name, file_warnings in warnings.items():
+                st.write(f"- **{name}**: {', '.join(file_warnings)}")
+
+    # Paging controls
+    total_pages = max(1, math.ceil(len(uploaded_files) / PAGE_SIZE))
+    page = min(st.session_state.get('preview_page', 1), total_pages)
+    if total_pages > 1:
+        prev_col, label_col, next_col = st.columns([1, 2, 1])
+        with prev_col:
+            if st.button("◀ Previous", disabled=page <= 1, key="preview_prev"):
+                page -= 1
+        with next_col:
+            if st.button("Next ▶", disabled=page >= total_pages, key="preview_next"):
+                page += 1
+        with label_col:
+            st.caption(f"Page {page} of {total_pages}")
+    st.session_state.preview_page = page
+
+    # Thumbnail grid
+    page_files = uploaded_files[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+    for row_start in range(0, len(page_files), GRID_COLUMNS):
+        cols = st.columns(GRID_COLUMNS)
+        for col, file in zip(cols, page_files[row_start:row_start + GRID_COLUMNS]):
+            with col:
+                preview = previews[hashes[file.file_id]]
+                caption = f"⚠️ {file.name}" if file.name in warnings else file.name
+                if preview.thumbnail:
+                    st.image(preview.thumbnail, caption=caption)
+                else:
+                    st.error(caption)
+
+    return warnings
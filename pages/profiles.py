@@ -0,0 +1,81 @@
+import streamlit as st
+from pathlib import Path
+from config.settings import get_settings
+from services.profiling import hottest_functions, list_profiles, pending_requests, request_profile
+
+settings = get_settings()
+
+st.header("Profiles")
+
+if not settings.debug:
+    st.info("Profiling is available when DEBUG is on.")
+    st.stop()
+
+st.caption(
+    f"Flame graphs and allocation snapshots saved in `{settings.profile_dir}`. Use **Profile next rerun** "
+    "in a page's sidebar to profile one interaction, or profile the next submission processed below."
+)
+
+col1, col2 = st.columns([1, 2])
+with col1:
+    if st.button("Profile next submission"):
+        request_profile("submission")
+with col2:
+    pending = pending_requests().get("submission", 0)
+    if pending:
+        st.info(f"Waiting to profile {pending} submission(s)")
+
+profiles = list_profiles()
+if not profiles:
+    st.info("No profiles yet")
+    st.stop()
+
+st.table([
+    {
+        "Profiled": p['name'],
+        "When": p['started_at'][:19].replace("T", " "),
+        "Duration": f"{p['duration_s']:.2f} s",
+        "Samples": p['samples'],
+        "Peak traced": f"{p['peak_traced_mb']:.1f} MB"
+    }
+    for p in profiles[:20]
+])
+
+chosen = st.selectbox(
+    "Profile",
+    options=range(len(profiles)),
+    format_func=lambda i: f"{profiles[i]['name']} at {profiles[i]['started_at'][:19].replace('T', ' ')}"
+)
+selected = profiles[chosen]
+path = Path(selected['path'])
+
+st.subheader("Hottest functions")
+hot = hottest_functions(selected['path'])
+if hot:
+    st.table(hot)
+else:
+    st.info("No samples; the run finished within one sampling interval")
+
+st.subheader("Allocations still held at the end")
+if selected['allocations']:
+    st.table([
+        {"Where": f"{Path(a['file']).name}:{a['line']}", "Size (KiB)": a['size_kb'], "Blocks": a['count']}
+        for a in selected['allocations']
+    ])
+else:
+    st.info("No allocations recorded")
+
+col1, col2 = st.columns(2)
+col1.download_button(
+    "Flame graph (speedscope)",
+    (path / "profile.speedscope.json").read_bytes(),
+    file_name=f"{path.name}.speedscope.json",
+    mime="application/json",
+    help="Open at https://www.speedscope.app"
+)
+col2.download_button(
+    "Collapsed stacks",
+    (path / "profile.collapsed.txt").read_bytes(),
+    file_name=f"{path.name}.collapsed.txt",
+    mime="text/plain"
+)
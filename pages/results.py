@@ -1,8 +1,34 @@
 import streamlit as st
+from services.auth import streamlit_auth
 from services.storage import StorageService
+from services.pipeline import ProcessingPipeline, incomplete_submissions
+from services.ocr_service import detail_summary
+from services.batch import BatchProcessor
+from config.settings import get_settings
+from pages.components.profiler import profile_rerun
+
+profile_rerun("results")
 
 # Initialize storage service
-storage = StorageService()
+settings = get_settings()
+storage = StorageService(streamlit_auth())
+
+def resume_submissions(assignment_id: str, submissions: list):
+    """Restart failed or stalled submissions from their first incomplete stage"""
+    progress = st.progress(0.0, text="Resuming submissions...")
+    failed = []
+    done = 0
+    processor = BatchProcessor(ProcessingPipeline(storage))
+    for event in processor.resume(assignment_id, submissions):
+        if event['type'] != 'result':
+            continue
+        done += 1
+        if not event['result']:
+            failed.append(event['student_id'] or event['name'])
+        progress.progress(done / len(submissions), text=f"Resumed {done} of {len(submissions)}")
+    progress.empty()
+    if failed:
+        st.session_state.resume_failures = failed
 
 try:
     st.header("Grading Results")
@@ -26,12 +52,53 @@ try:
         if submissions:
             # Summary table view
             st.write(f"Total Submissions: {len(submissions)}")
+            ocr_summary = detail_summary(submissions)
+            if ocr_summary:
+                st.caption(
+                    f"OCR read {ocr_summary['by_detail']['low']} of {ocr_summary['submissions']} submissions "
+                    f"({ocr_summary['pages']} pages) at low detail; {ocr_summary['escalated']} escalated "
+                    f"({ocr_summary['escalated'] / ocr_summary['submissions']:.0%}). "
+                    f"Image tokens saved versus high detail: {ocr_summary['tokens_saved']:,}"
+                )
             
+            # Failed or stalled submissions pick up from their last checkpoint
+            incomplete = incomplete_submissions(submissions, settings.stale_submission_minutes)
+            if st.session_state.get('resume_failures'):
+                st.error(f"Still failing: {', '.join(st.session_state.pop('resume_failures'))}")
+            if incomplete:
+                st.warning(f"{len(incomplete)} submission(s) failed or stalled before finishing.")
+                if st.button(f"Resume {len(incomplete)} incomplete submission(s)", key="resume_incomplete"):
+                    resume_submissions(selected_assignment, incomplete)
+                    st.rerun()
+
+            # Images the quality gate held back from OCR
+            flagged = [s for s in submissions if s.get('status') == 'flagged']
+            if flagged:
+                st.warning(f"{len(flagged)} image(s) were not sent for grading:")
+                for submission in flagged:
+                    st.write(f"🚩 **{submission.get('student_id', 'Unknown')}**: "
+                             f"{submission.get('error_message') or 'image quality check failed'}")
+                if st.button(f"Grade {len(flagged)} flagged image(s) anyway", key="grade_flagged"):
+                    resume_submissions(selected_assignment,
+                                       [{**s, 'quality_override': True} for s in flagged])
+                    st.rerun()
+
+            # Graded, but a page resembles another student's (same worksheet, or copied work)
+            lookalikes = [s for s in submissions
+                          if s.get('status') != 'flagged' and (s.get('quality') or {}).get('warnings')]
+            if lookalikes:
+                with st.expander(f"👀 {len(lookalikes)} graded submission(s) look like another student's"):
+                    for submission in lookalikes:
+                        st.write(f"- **{submission.get('student_id', 'Unknown')}**: "
+                                 f"{', '.join(submission['quality']['warnings'])}")
+
             # Create table data
             table_data = []
             for submission in submissions:
                 score = submission.get('score')
-                status = "✅" if score and score.get('teacher_score') else "⏳"
+                status = "✅" if score and score.get('teacher_score') else \
+                    "❌" if submission.get('status') == 'error' else \
+                    "🚩" if submission.get('status') == 'flagged' else "⏳"
                 table_data.append({
                     "Student": submission.get('student_id', 'Unknown'),
                     "Score": score.get('teacher_score', '--') if score else '--',
@@ -53,7 +120,11 @@ try:
                     with img_col:
                         # Original image
                         st.subheader("Original Work")
-                        if submission.get('image_path'):
+                        pages = submission.get('image_paths') or []
+                        if len(pages) > 1:
+                            for number, page in enumerate(pages, 1):
+                                st.image(page, caption=f"Page {number}", use_container_width=True)
+                        elif submission.get('image_path'):
                             st.image(submission['image_path'], use_container_width=True)
                     
                     with response_col:
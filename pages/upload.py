@@ -1,16 +1,30 @@
 import streamlit as st
-import tempfile
-import os
+import hashlib
+import itertools
 import json
-from pathlib import Path
+import uuid
+from services.auth import streamlit_auth
 from services.storage import StorageService
 from services.pipeline import ProcessingPipeline
+from services.ingest import ImageSource
+from services.speculative import SpeculativeIngestor
+from services.batch import BatchProcessor, BatchItem
+from services.grouping import group_pages, student_and_page
+from services.images import check_image
+from services.pdf import expected_submissions, page_count, submissions_from_pdf
+from config.settings import get_settings
 from models.submission import Submission
 from pages.components.progress_tracker import render_progress_tracker, ProcessingStage
+from pages.components.upload_preview import render_upload_preview
+from pages.components.direct_upload import render_direct_upload
+from pages.components.profiler import profile_rerun
+
+profile_rerun("upload")
 
 # Initialize services
-storage = StorageService()
-pipeline = ProcessingPipeline()
+settings = get_settings()
+storage = StorageService(streamlit_auth())
+pipeline = ProcessingPipeline(storage)
 
 def show_no_assignments_warning():
     """Display warning when no assignments exist"""
@@ -39,110 +53,173 @@ def show_assignment_preview(assignment: dict):
             st.write("\n**Grading Notes:**")
             st.write(rubric['metadata']['notes'])
 
-def save_uploaded_file(uploaded_file) -> str:
-    """Save an uploaded file to a temporary directory"""
-    try:
-        # Create a temporary directory if it doesn't exist
-        temp_dir = Path("temp_uploads")
-        temp_dir.mkdir(exist_ok=True)
-        
-        # Create a unique filename
-        file_path = temp_dir / f"{uploaded_file.name}"
-        
-        # Save the file
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-            
-        return str(file_path)
-    except Exception as e:
-        st.error(f"Error saving file: {str(e)}")
-        return None
-
 def show_upload_preview(uploaded_files):
-    """Show preview of uploaded files"""
-    for file in uploaded_files:
-        st.image(file, caption=file.name, use_container_width=True)
+    """Show a paged thumbnail preview of uploaded files"""
+    return render_upload_preview(uploaded_files)
+
+def get_speculative_ingestor() -> SpeculativeIngestor:
+    """One background ingestor per browser session"""
+    if 'speculative_ingestor' not in st.session_state:
+        st.session_state.speculative_ingestor = SpeculativeIngestor(
+            pipeline,
+            max_workers=settings.speculative_workers
+        )
+    return st.session_state.speculative_ingestor
+
+def uploaded_images(uploaded_files) -> list:
+    """Wrap uploads as ImageSources, reusing hashes computed for the preview"""
+    hashes = st.session_state.get('upload_hashes', {})
+    return [
+        ImageSource.from_uploaded_file(file, hashes.get(file.file_id))
+        for file in uploaded_files
+    ]
+
+def stored_images(uploaded: list) -> list:
+    """ImageSources for files the browser uploaded straight to storage"""
+    return [
+        storage.stored_image(file['name'], file['path'], file.get('type'))
+        for file in uploaded
+    ]
+
+def page_grouping(file_names: list) -> list:
+    """
+    Editable table of which student and page each file is, prefilled from
+    the filenames (JaneDoe_p1.jpg, JaneDoe_p2.jpg). Returns (student_id, page)
+    per file, in upload order.
+    """
+    rows = []
+    for name in file_names:
+        student_id, page = student_and_page(name)
+        rows.append({"File": name, "Student": student_id, "Page": page})
+    signature = hashlib.sha256("\n".join(file_names).encode("utf-8")).hexdigest()[:16]
+    edited = st.data_editor(
+        rows,
+        disabled=["File"],
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Student": st.column_config.TextColumn("Student", required=True),
+            "Page": st.column_config.NumberColumn("Page", min_value=1, step=1,
+                                                  help="Order of the page within the student's answer")
+        },
+        key=f"page_grouping_{signature}"
+    )
+    return [
+        ((row["Student"] or "").strip() or student_and_page(row["File"])[0],
+         int(row["Page"]) if row["Page"] is not None else None)
+        for row in edited
+    ]
+
+def pdf_split_options(pdf: ImageSource) -> dict:
+    """How to split a class-set PDF into students, as arguments for `submissions_from_pdf`"""
+    pages = page_count(pdf)
+    key = pdf.content_hash[:16]
+    options = {}
+    with st.expander(f"📄 {pdf.name} ({pages} pages)", expanded=True):
+        split = st.radio(
+            "Split into students",
+            ["Every N pages", "At separator pages"],
+            horizontal=True,
+            key=f"pdf_split_{key}"
+        )
+        if split == "Every N pages":
+            options['pages_per_student'] = int(st.number_input(
+                "Pages per student", min_value=1, max_value=max(1, pages), value=1, key=f"pdf_pages_{key}"
+            ))
+            st.caption(f"{expected_submissions(pdf, options['pages_per_student'])} submission(s)")
+        else:
+            reference = st.file_uploader(
+                "Separator sheet (optional - otherwise blank pages separate students)",
+                type=['png', 'jpg', 'jpeg'],
+                key=f"pdf_separator_{key}"
+            )
+            if reference is not None:
+                options['separator_hash'] = check_image(reference).perceptual_hash
+        names = st.text_area(
+            "Student names in PDF order, one per line (optional)",
+            key=f"pdf_names_{key}",
+            help=f"Unnamed submissions are called {pdf.name.rsplit('.', 1)[0]}_01, _02, ..."
+        )
+        options['student_ids'] = [name.strip() for name in names.splitlines() if name.strip()]
+    return options
+
+def current_batch_id(assignment: dict, images: list) -> str:
+    """
+    Batch id for the current selection. It stays the same across reruns and
+    repeated clicks for the same files, so those attach to the work already
+    started instead of processing the files again.
+    """
+    selection = "\n".join([str(assignment['id'])] + sorted(
+        f"{image.name}:{image.identity}" for image in images
+    ))
+    signature = hashlib.sha256(selection.encode("utf-8")).hexdigest()
+    if st.session_state.get('batch_signature') != signature:
+        st.session_state.batch_signature = signature
+        st.session_state.batch_id = str(uuid.uuid4())
+    return st.session_state.batch_id
 
 def process_submissions(storage: StorageService, 
                        assignment: dict,
-                       uploaded_files: list):
-    """Process uploaded submissions"""
+                       groups: list,
+                       ingestor: SpeculativeIngestor = None,
+                       batch_id: str = None) -> int:
+    """Process uploaded submissions; returns how many there were"""
+    # Map API stages to ProcessingStage
+    stage_map = {
+        "UPLOAD": ProcessingStage.UPLOAD,
+        "OCR": ProcessingStage.OCR,
+        "GRADING": ProcessingStage.GRADING,
+        "FEEDBACK": ProcessingStage.FEEDBACK,
+        "COMPLETE": ProcessingStage.COMPLETE
+    }
+    
+    def batch_items():
+        """Yield submissions lazily so only in-flight images are held by the batch"""
+        for student_id, (image, *more_pages) in groups:
+            # Pick up upload + OCR already done in the background (one-page submissions only)
+            prefetched = ingestor.take(assignment['id'], image.identity) \
+                if ingestor and not more_pages else None
+            
+            yield BatchItem(student_id, image, prefetched, more_pages=tuple(more_pages))
+    
+    submitted = 0
     try:
-        # Process each file
-        for i, file in enumerate(uploaded_files):
-            try:
-                # Update progress
-                st.session_state.current_file = file.name
-                st.session_state.processed_files = i
-                st.session_state.current_stages[file.name] = ProcessingStage.UPLOAD
-                st.session_state.completed_stages[file.name] = []
-                
-                # Save file temporarily
-                temp_path = save_uploaded_file(file)
-                if not temp_path:
-                    continue
-                
-                # Mark upload complete
-                st.session_state.completed_stages[file.name].append(ProcessingStage.UPLOAD)
-                st.session_state.current_stages[file.name] = ProcessingStage.OCR
-                
-                # Define stage change callback
-                def on_stage_change(stage: str, message: str):
-                    # Map API stages to ProcessingStage
-                    stage_map = {
-                        "UPLOAD": ProcessingStage.UPLOAD,
-                        "OCR": ProcessingStage.OCR,
-                        "GRADING": ProcessingStage.GRADING,
-                        "FEEDBACK": ProcessingStage.FEEDBACK,
-                        "COMPLETE": ProcessingStage.COMPLETE
-                    }
-                    
-                    if stage in stage_map:
-                        # Mark previous stage as complete
-                        if st.session_state.current_stages[file.name] != ProcessingStage.COMPLETE:
-                            st.session_state.completed_stages[file.name].append(
-                                st.session_state.current_stages[file.name]
-                            )
-                        
-                        # Update current stage
-                        st.session_state.current_stages[file.name] = stage_map[stage]
-                
-                # Extract student ID from filename
-                student_id = Path(file.name).stem
+        processor = BatchProcessor(pipeline)
+        for event in processor.run(assignment['id'], batch_items(), batch_id=batch_id):
+            name = event['name']
+            
+            if event['type'] == 'stage' and event['stage'] in stage_map:
+                st.session_state.current_file = name
+                current = st.session_state.current_stages.get(name)
+                completed = st.session_state.completed_stages.setdefault(name, [])
                 
-                # Create and process submission
-                result = pipeline.process_submission(
-                    image_path=temp_path,
-                    assignment_id=assignment['id'],
-                    student_id=student_id,
-                    on_stage_change=on_stage_change
-                )
+                # Mark previous stage as complete
+                if current and current != ProcessingStage.COMPLETE:
+                    completed.append(current)
                 
-                # Update processed count
-                if result:
+                # Update current stage
+                st.session_state.current_stages[name] = stage_map[event['stage']]
+            
+            elif event['type'] == 'result':
+                if name is not None:
+                    submitted += 1
+                if event['result'] and event['result'].get('status') == 'flagged':
+                    st.warning(f"{name} was not sent for grading: {', '.join(event['result']['issues'])}. "
+                               "You can grade it anyway from the Results page.")
+                if event['result']:
                     st.session_state.processed_files += 1
-                
-                # Cleanup temp file
-                os.remove(temp_path)
-                
-            except Exception as e:
-                st.error(f"Error processing {file.name}: {str(e)}")
-                continue
-                
+                    # Keep per-file state only for files still in flight or failed
+                    st.session_state.current_stages.pop(name, None)
+                    st.session_state.completed_stages.pop(name, None)
+                else:
+                    st.error(f"Error processing {name or 'batch'}: {event['error'] or 'processing failed'}")
+        
         # Clear current file when done
         st.session_state.current_file = None
             
     except Exception as e:
         st.error(f"Error in processing pipeline: {str(e)}")
-    finally:
-        # Cleanup temp directory
-        temp_dir = Path("temp_uploads")
-        if temp_dir.exists():
-            for file in temp_dir.glob("*"):
-                try:
-                    file.unlink()
-                except:
-                    pass
+    return submitted
 
 # Main page render
 st.header("Upload & Grade")
@@ -183,33 +260,85 @@ try:
         # File upload section
         st.markdown("""
             ℹ️ Name files with student identifiers (e.g., JohnSmith.jpg).
-            The filename will be used as the student ID.
+            The filename will be used as the student ID. For answers on several
+            pages, add the page number (e.g., JohnSmith_p1.jpg, JohnSmith_p2.jpg).
         """)
         
         st.subheader("Upload Images")
         
-        # File upload section
-        uploaded_files = st.file_uploader(
-            "📷 Drop images here or click to choose",
-            accept_multiple_files=True,
-            type=['png', 'jpg', 'jpeg']
+        # Either straight to the bucket from the browser, or through the app
+        direct_upload = settings.direct_uploads and st.toggle(
+            "Upload directly to storage",
+            value=True,
+            help="Images go from your browser to storage without passing through the app server"
         )
         
-        if uploaded_files:
+        uploaded_files = []
+        pdf_files = []
+        direct_files = []
+        if direct_upload:
+            direct_files = render_direct_upload(
+                storage,
+                selected_assignment['id'],
+                compress=settings.client_image_max_dimension > 0,
+                max_dimension=settings.client_image_max_dimension
+            )
+            file_names = [file['name'] for file in direct_files]
+        else:
+            # File upload section
+            uploaded_files = st.file_uploader(
+                "📷 Drop images or class-set PDFs here or click to choose",
+                accept_multiple_files=True,
+                type=['png', 'jpg', 'jpeg', 'pdf']
+            ) or []
+            pdf_files = [file for file in uploaded_files if file.name.lower().endswith('.pdf')]
+            uploaded_files = [file for file in uploaded_files if not file.name.lower().endswith('.pdf')]
+            file_names = [file.name for file in uploaded_files]
+        
+        page_assignments = []
+        groups = []
+        if file_names:
             st.write("**Selected Files:**")
-            for file in uploaded_files:
-                student_id = Path(file.name).stem  # Get student ID from filename
-                st.write(f"- {file.name} (Student ID: {student_id})")
-            st.write(f"Total files: {len(uploaded_files)}")
+            page_assignments = page_grouping(file_names)
+            students = len({student_id for student_id, _ in page_assignments})
+            st.write(f"Total files: {len(file_names)} ({students} submission(s))")
+        
+        # Class-set PDFs are split into students as their pages render
+        pdfs = []
+        for file in pdf_files:
+            pdf = ImageSource.from_uploaded_file(file)
+            pdfs.append((pdf, pdf_split_options(pdf)))
+        expected_total = len({student_id for student_id, _ in page_assignments}) + sum(
+            expected_submissions(pdf, options.get('pages_per_student')) or 0 for pdf, options in pdfs
+        )
+        
+        speculative = st.toggle(
+            "Start uploading and OCR while I review",
+            value=settings.speculative_ingest,
+            help="Files are uploaded and transcribed in the background as soon as they are dropped"
+        )
         
-        if uploaded_files:
-            st.write("**Preview:**")
-            show_upload_preview(uploaded_files)
+        if file_names or pdfs:
+            if uploaded_files:
+                st.write("**Preview:**")
+                show_upload_preview(uploaded_files)
+                images = uploaded_images(uploaded_files)
+            else:
+                images = stored_images(direct_files)
+            groups = group_pages(images, page_assignments)
+            
+            # Kick off (or garbage-collect) background work for the current selection
+            if speculative and not st.session_state.processing:
+                ingestor = get_speculative_ingestor()
+                # Multi-page answers are read in one request once all pages are in
+                ingestor.sync(selected_assignment, [pages[0] for _, pages in groups if len(pages) == 1])
+                status = ingestor.status()
+                st.caption(f"⚡ Pre-processed {status['done']} of {status['done'] + status['pending']} file(s)")
             
             # Process button
             if st.button(
                 "Start Processing",
-                disabled=not uploaded_files or st.session_state.processing,
+                disabled=not (file_names or pdfs) or st.session_state.processing,
                 type="primary"
             ):
                 # Reset progress state
@@ -218,33 +347,45 @@ try:
                 st.session_state.current_stages = {}
                 st.session_state.completed_stages = {}
                 st.session_state.current_file = None
+                st.session_state.pop('submission_total', None)
                 
                 # Start processing
-                process_submissions(
+                st.session_state.submission_total = process_submissions(
                     storage,
                     selected_assignment,
-                    uploaded_files
+                    itertools.chain(groups, *(submissions_from_pdf(pdf, **options) for pdf, options in pdfs)),
+                    ingestor=get_speculative_ingestor() if speculative else None,
+                    batch_id=current_batch_id(selected_assignment, images + [pdf for pdf, _ in pdfs])
                 )
+                # Uploads the batch didn't claim (it stopped early) would otherwise stay in the bucket
+                if 'speculative_ingestor' in st.session_state:
+                    st.session_state.speculative_ingestor.clear()
                 
                 # Keep processing state until explicitly cleared
                 st.rerun()
     
+        # Nothing selected (or mode switched off): drop any speculative work and its workers
+        if (not file_names or not speculative) and 'speculative_ingestor' in st.session_state:
+            st.session_state.pop('speculative_ingestor').close()
+    
     with right_col:
         # Show progress tracker during processing
         if st.session_state.processing:
             render_progress_tracker(
                 current_file=st.session_state.current_file,
-                total_files=len(uploaded_files) if uploaded_files else 0,
+                total_files=st.session_state.get('submission_total') or expected_total,
                 processed_files=st.session_state.processed_files,
                 current_stages=st.session_state.current_stages,
                 completed_stages=st.session_state.completed_stages
             )
             
             # Add completion check
-            if st.session_state.processed_files == len(uploaded_files):
+            if st.session_state.processed_files == (st.session_state.get('submission_total') or expected_total):
                 st.success("✨ All files processed successfully!")
                 if st.button("View Results", type="primary"):
                     st.session_state.processing = False  # Clear processing state
+                    st.session_state.pop('batch_signature', None)  # Next upload is a new batch
+                    st.session_state.pop('submission_total', None)
                     st.switch_page("pages/results.py")
             
 except Exception as e:
@@ -0,0 +1,418 @@
+# services/api.py
+"""
+HTTP ingestion API for LMS integrations, served beside the Streamlit app.
+
+    python -m services.api                 # or: uvicorn services.api:app
+
+    POST /v1/assignments/{assignment_id}/jobs   multipart upload, returns 202 and a job id
+    GET  /v1/jobs/{job_id}                      job status, with an ETag for cheap polling
+    GET  /v1/jobs/{job_id}/results              stored submissions of the job
+    GET  /v1/health
+
+A job is one multipart request: any number of image and PDF file parts,
+plus optional fields. `manifest` is a JSON object mapping a filename to
+its student ID (or, for a PDF, a list of student IDs in page order);
+unmapped images are grouped into students by filename as on the upload
+page. `pages_per_student` splits PDFs every N pages instead of at blank
+separator pages, and `batch_id` makes retried requests attach to the
+submissions of the first one instead of grading them twice.
+
+The body is parsed as it streams in and file parts larger than 1 MB are
+spooled to temp files, so a class set never has to fit in memory. The
+request returns as soon as the body is read; jobs are processed by
+API_JOB_WORKERS background threads, each running a BatchProcessor. Job
+status lives in this process for API_JOB_TTL_HOURS after a job finishes;
+its submissions, like any others, are in the database. Requests need an
+`Authorization: Bearer <token>` header with one of API_TOKENS, and the
+service connects to Supabase with the service key.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from config.settings import get_settings
+from models.submission import Submission
+from services.auth import AuthContext
+from services.batch import BatchItem, BatchProcessor
+from services.grouping import group_pages, student_and_page
+from services.ingest import ImageSource
+from services.pdf import submissions_from_pdf
+from services.pipeline import ProcessingPipeline
+from services.storage import StorageService
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+PDF_SUFFIX = ".pdf"
+FINISHED = ("complete", "flagged", "error")
+
+def _closer(upload: UploadFile):
+    """Close an uploaded part's temp file once its ImageSource lets go of the bytes"""
+    def close():
+        try:
+            upload.file.close()
+        except BufferError:
+            pass  # An in-flight request still holds a view; the buffer is freed when it is dropped
+    return close
+
+class Job:
+    """One ingest request: its inputs until they are processed, and every submission's progress"""
+    def __init__(self, assignment_id: str, batch_id: Optional[str],
+                 groups: List[Tuple[str, List[ImageSource]]],
+                 pdfs: List[Tuple[ImageSource, List[str]]],
+                 pages_per_student: Optional[int] = None):
+        self.id = str(uuid.uuid4())
+        self.assignment_id = assignment_id
+        self.batch_id = batch_id or f"api-{self.id}"
+        self.groups = groups
+        self.pdfs = pdfs
+        self.pages_per_student = pages_per_student
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = self.updated_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        self.pdfs_pending = len(pdfs)
+        self.version = 0
+        self.submissions: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        for student_id, pages in groups:
+            self._add(student_id, [page.name for page in pages])
+
+    def _add(self, student_id: str, files: List[str]) -> str:
+        source = str(len(self.submissions))
+        self.submissions[source] = {
+            'student_id': student_id, 'files': files, 'status': "queued", 'stage': None,
+            'submission_id': None, 'error': None
+        }
+        return source
+
+    def update(self, source: Optional[str] = None, **changes) -> None:
+        """Change the job (or one of its submissions) and bump the version behind its ETag"""
+        with self._lock:
+            if source is not None:
+                self.submissions[source].update(changes)
+            else:
+                for name, value in changes.items():
+                    setattr(self, name, value)
+            self.version += 1
+            self.updated_at = datetime.utcnow()
+
+    def items(self) -> Iterator[BatchItem]:
+        """BatchItems for every submission; PDFs are rendered and split as they are reached"""
+        groups, self.groups = self.groups, []
+        for source, (student_id, pages) in enumerate(groups):
+            yield BatchItem(student_id, pages[0], more_pages=tuple(pages[1:]), source=str(source))
+        pdfs, self.pdfs = self.pdfs, []
+        for pdf, student_ids in pdfs:
+            try:
+                for student_id, pages in submissions_from_pdf(pdf, pages_per_student=self.pages_per_student,
+                                                              student_ids=student_ids):
+                    with self._lock:
+                        source = self._add(student_id, [page.name for page in pages])
+                    self.update()
+                    yield BatchItem(student_id, pages[0], more_pages=tuple(pages[1:]), source=source)
+            except Exception as e:
+                logger.error(f"Splitting {pdf.name} failed: {str(e)}")
+                self.update(error=f"{pdf.name}: {str(e)}")
+            finally:
+                pdf.release()
+                self.update(pdfs_pending=self.pdfs_pending - 1)
+
+    def discard(self) -> None:
+        """Drop inputs that will never be processed"""
+        for _, pages in self.groups:
+            for page in pages:
+                page.release()
+        for pdf, _ in self.pdfs:
+            pdf.release()
+        self.groups, self.pdfs = [], []
+
+    def snapshot(self) -> Tuple[int, Dict]:
+        """(version, JSON body) read under the lock, so the ETag matches the body"""
+        with self._lock:
+            submissions = [dict(entry) for entry in self.submissions.values()]
+            counts = {status: 0 for status in ("queued", "processing", "complete", "flagged", "error")}
+            for entry in submissions:
+                counts[entry['status']] = counts.get(entry['status'], 0) + 1
+            return self.version, {
+                'id': self.id,
+                'assignment_id': self.assignment_id,
+                'batch_id': self.batch_id,
+                'status': self.status,
+                'error': self.error,
+                'created_at': self.created_at.isoformat(),
+                'updated_at': self.updated_at.isoformat(),
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+                'pdfs_pending': self.pdfs_pending,
+                'total': len(submissions),
+                'counts': counts,
+                'submissions': submissions,
+                'links': {'self': f"/v1/jobs/{self.id}", 'results': f"/v1/jobs/{self.id}/results"}
+            }
+
+class JobQueue:
+    """Runs jobs on background threads and keeps their status until they expire"""
+    def __init__(self, pipeline: Optional[ProcessingPipeline] = None,
+                 max_jobs: Optional[int] = None):
+        self.settings = get_settings()
+        self.pipeline = pipeline or ProcessingPipeline(StorageService(AuthContext.service()))
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs or self.settings.api_job_workers,
+                                           thread_name_prefix="api-job")
+        self.jobs: Dict[str, Job] = {}
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+    @property
+    def storage(self) -> StorageService:
+        return self.pipeline.storage_service
+
+    def submit(self, job: Job) -> None:
+        self._expire()
+        with self._lock:
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def shutdown(self) -> None:
+        """Stop taking jobs; queued ones are dropped, running ones finish their submissions"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            for job in self.jobs.values():
+                if job.status == "queued":
+                    job.discard()
+
+    def _expire(self) -> None:
+        cutoff = datetime.utcnow() - timedelta(hours=self.settings.api_job_ttl_hours)
+        with self._lock:
+            for job_id in [job_id for job_id, job in self.jobs.items()
+                           if job.finished_at and job.finished_at < cutoff]:
+                del self.jobs[job_id]
+
+    def _run(self, job: Job) -> None:
+        job.update(status="running")
+        try:
+            processor = BatchProcessor(self.pipeline)
+            for event in processor.run(job.assignment_id, job.items(), batch_id=job.batch_id):
+                source = event.get('source')
+                if source is None:
+                    if event['type'] == 'result':
+                        job.update(error=event['error'])
+                    continue
+                if event['type'] == 'stage':
+                    job.update(source, status="processing", stage=event['stage'])
+                    continue
+                result = event['result'] or {}
+                job.update(source, status=result.get('status') or "error", stage=None,
+                           submission_id=result.get('submission_id'),
+                           error=event['error'] or (None if result else "Processing failed"))
+            job.update(status="failed" if job.error else "complete", finished_at=datetime.utcnow())
+        except Exception as e:
+            self.logger.error(f"Job {job.id} failed: {str(e)}")
+            job.discard()
+            job.update(status="failed", error=str(e), finished_at=datetime.utcnow())
+
+# HTTP layer
+
+def _error(status_code: int, message: str) -> JSONResponse:
+    return JSONResponse({'error': message}, status_code=status_code)
+
+def _authorized(request: Request) -> bool:
+    tokens = [token.strip() for token in get_settings().api_tokens.split(",") if token.strip()]
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not credentials:
+        return False
+    return any(hmac.compare_digest(credentials.encode(), token.encode()) for token in tokens)
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 when the client already has this version"""
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': "no-cache"})
+    return None
+
+def _tagged(body: Dict, etag: str) -> JSONResponse:
+    return JSONResponse(body, headers={'ETag': etag, 'Cache-Control': "no-cache"})
+
+def _manifest(form) -> Dict:
+    manifest = form.get("manifest")
+    if not manifest:
+        return {}
+    try:
+        manifest = json.loads(manifest)
+    except ValueError:
+        raise HTTPException(400, "manifest must be a JSON object")
+    if not isinstance(manifest, dict):
+        raise HTTPException(400, "manifest must be a JSON object")
+    return manifest
+
+def _pages_per_student(form) -> Optional[int]:
+    value = form.get("pages_per_student")
+    if not value:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise HTTPException(400, "pages_per_student must be a whole number")
+    if value < 1:
+        raise HTTPException(400, "pages_per_student must be at least 1")
+    return value
+
+def _job_from_form(assignment_id: str, form) -> Job:
+    """A job from a parsed multipart form; images are grouped into students right away"""
+    manifest = _manifest(form)
+    pages_per_student = _pages_per_student(form)
+    # Check every part before wrapping any, so a rejected request holds no views of the parts
+    uploads = [value for _, value in form.multi_items() if isinstance(value, UploadFile)]
+    for upload in uploads:
+        if Path(upload.filename or "").suffix.lower() not in IMAGE_SUFFIXES | {PDF_SUFFIX}:
+            raise HTTPException(415, f"Unsupported file {upload.filename!r}: send JPEG, PNG or PDF")
+        if not upload.size:
+            raise HTTPException(400, f"{upload.filename} is empty")
+    if not uploads:
+        raise HTTPException(400, "No image or PDF files in the request")
+
+    images: List[ImageSource] = []
+    pdfs: List[Tuple[ImageSource, List[str]]] = []
+    try:
+        for upload in uploads:
+            source = ImageSource.from_file(upload.file, upload.filename, upload.content_type)
+            source.on_release(_closer(upload))
+            if Path(upload.filename).suffix.lower() == PDF_SUFFIX:
+                student_ids = manifest.get(upload.filename) or []
+                pdfs.append((source, [student_ids] if isinstance(student_ids, str) else list(student_ids)))
+            else:
+                images.append(source)
+    except Exception:
+        # Their closers close the parts the form can no longer close itself
+        for source in images + [pdf for pdf, _ in pdfs]:
+            source.release()
+        raise
+
+    assignments = []
+    for image in images:
+        student_id, page = student_and_page(image.name)
+        mapped = manifest.get(image.name)
+        assignments.append((str(mapped) if isinstance(mapped, (str, int)) else student_id, page))
+    return Job(assignment_id, form.get("batch_id") or None, group_pages(images, assignments),
+               pdfs, pages_per_student)
+
+async def create_job(request: Request) -> Response:
+    if not _authorized(request):
+        return _error(401, "Missing or invalid bearer token")
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        return _error(415, "Send submissions as multipart/form-data")
+    queue: JobQueue = request.app.state.jobs
+    assignment_id = request.path_params['assignment_id']
+    # Check the assignment before reading what may be a very large body
+    if not await run_in_threadpool(queue.storage.get_assignment, assignment_id):
+        return _error(404, f"Assignment {assignment_id} not found")
+
+    settings = get_settings()
+    try:
+        form = await request.form(max_files=settings.api_max_files, max_fields=settings.api_max_files)
+    except HTTPException as e:
+        return _error(e.status_code, e.detail)  # Malformed body, or too many parts
+    try:
+        job = _job_from_form(assignment_id, form)
+    except HTTPException as e:
+        try:
+            await form.close()
+        except BufferError:
+            pass  # A part is still shared with an ImageSource; it is freed when that is dropped
+        return _error(e.status_code, e.detail)
+    logger.info(f"Job {job.id}: {len(job.groups)} image submission(s), {len(job.pdfs)} PDF(s)")
+    version, body = job.snapshot()
+    queue.submit(job)
+    return JSONResponse(body, status_code=202,
+                        headers={'ETag': f'"{job.id}.{version}"', 'Location': body['links']['self']})
+
+async def job_status(request: Request) -> Response:
+    if not _authorized(request):
+        return _error(401, "Missing or invalid bearer token")
+    job = request.app.state.jobs.get(request.path_params['job_id'])
+    if job is None:
+        return _error(404, "Job not found")
+    version, body = job.snapshot()
+    etag = f'"{job.id}.{version}"'
+    return _not_modified(request, etag) or _tagged(body, etag)
+
+async def job_results(request: Request) -> Response:
+    if not _authorized(request):
+        return _error(401, "Missing or invalid bearer token")
+    queue: JobQueue = request.app.state.jobs
+    job = queue.get(request.path_params['job_id'])
+    if job is None:
+        return _error(404, "Job not found")
+    _, status = job.snapshot()
+    ids = {entry['submission_id'] for entry in status['submissions'] if entry['status'] in FINISHED}
+    rows = await run_in_threadpool(queue.storage.get_submissions_by_batch, job.batch_id, False)
+    rows = [row for row in rows if row['id'] in ids]
+    # Rows can change after a job (a teacher's review), so the tag follows their content.
+    # Image URLs are signed afresh on every read and are left out of it.
+    digest = hashlib.sha256(json.dumps([status['status'], rows], sort_keys=True, default=str).encode())
+    etag = f'"{digest.hexdigest()[:32]}"'
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    rows = await run_in_threadpool(queue.storage.refresh_image_urls, rows)
+    results = [Submission(**row).to_dict() for row in rows]
+    return _tagged({'job_id': job.id, 'status': status['status'], 'total': status['total'],
+                    'results': results}, etag)
+
+async def health(request: Request) -> Response:
+    return JSONResponse({'status': "ok"})
+
+def create_app(queue: Optional[JobQueue] = None) -> Starlette:
+    @asynccontextmanager
+    async def lifespan(app: Starlette):
+        app.state.jobs = queue or JobQueue()
+        try:
+            yield
+        finally:
+            app.state.jobs.shutdown()
+
+    return Starlette(
+        routes=[
+            Route("/v1/assignments/{assignment_id}/jobs", create_job, methods=["POST"]),
+            Route("/v1/jobs/{job_id}", job_status, methods=["GET"]),
+            Route("/v1/jobs/{job_id}/results", job_results, methods=["GET"]),
+            Route("/v1/health", health, methods=["GET"]),
+        ],
+        lifespan=lifespan
+    )
+
+app = create_app()
+
+def main():
+    import uvicorn
+
+    settings = get_settings()
+    parser = argparse.ArgumentParser(prog="python -m services.api", description="HTTP ingestion API for LMS integrations")
+    parser.add_argument("--host", default=settings.api_host)
+    parser.add_argument("--port", type=int, default=settings.api_port)
+    args = parser.parse_args()
+    if not settings.api_tokens.strip():
+        parser.error("Set API_TOKENS to the bearer token(s) clients will use")
+    uvicorn.run(app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# services/auth.py
+"""
+Who a service is acting for.
+
+Services take an AuthContext instead of reading Streamlit's session, so the
+pipeline runs the same in a page script, a worker thread, a CLI or another
+process. `streamlit_auth()` is the adapter for the app's pages; headless
+entry points use `AuthContext.service()`.
+"""
+from typing import NamedTuple, Optional
+
+class AuthContext(NamedTuple):
+    """A signed-in teacher's session, or the service role"""
+    access_token: Optional[str] = None
+    refresh_token: Optional[str] = None
+    auth_id: Optional[str] = None       # Supabase auth user id
+    teacher_id: Optional[str] = None    # teachers.id, when already known
+    service_role: bool = False          # Connect with the service key, bypassing row-level security
+
+    @classmethod
+    def service(cls, teacher_id: Optional[str] = None) -> "AuthContext":
+        """Headless workers: the service key, acting for `teacher_id` where a teacher is needed"""
+        return cls(teacher_id=teacher_id, service_role=True)
+
+    @property
+    def has_session(self) -> bool:
+        return bool(self.access_token and self.refresh_token)
+
+def streamlit_auth() -> AuthContext:
+    """The current Streamlit session's teacher; anonymous before login"""
+    import streamlit as st  # Only the app's pages depend on Streamlit
+
+    user = st.session_state.get('user')
+    return AuthContext(
+        access_token=st.session_state.get('access_token'),
+        refresh_token=st.session_state.get('refresh_token'),
+        auth_id=user.id if user is not None else None
+    )
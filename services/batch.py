@@ -0,0 +1,182 @@
+# services/batch.py
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from services.ingest import ImageSource
+from services.pipeline import resume_stage
+from services.tracing import propagate
+from config.settings import get_settings
+
+class BatchItem(NamedTuple):
+    """One submission to process in a batch"""
+    student_id: str
+    image: ImageSource  # the first page
+    prefetched: Optional[Dict] = None
+    submission: Optional[Dict] = None  # stored row to resume instead of a new upload
+    more_pages: Tuple[ImageSource, ...] = ()  # the rest of a multi-page answer, in order
+    assignment_id: Optional[str] = None  # overrides the batch's assignment
+    batch_id: Optional[str] = None       # overrides the batch's batch id
+    source: Optional[str] = None         # where the item came from; echoed in its result event
+
+    @property
+    def pages(self) -> List[ImageSource]:
+        return [self.image, *self.more_pages]
+
+    @property
+    def name(self) -> str:
+        """What progress events call the submission"""
+        if not self.more_pages:
+            return self.image.name
+        return f"{self.student_id} ({len(self.pages)} pages)"
+
+class ByteBudget:
+    """Blocks producers while more than `limit` image bytes are in flight"""
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size: int) -> None:
+        with self._condition:
+            # An oversized image may still run on its own rather than deadlock
+            while self.in_flight and self.in_flight + size > self.limit:
+                self._condition.wait()
+            self.in_flight += size
+            self.peak = max(self.peak, self.in_flight)
+
+    def release(self, size: int) -> None:
+        with self._condition:
+            self.in_flight -= size
+            self._condition.notify_all()
+
+class BatchProcessor:
+    """
+    Runs ProcessingPipeline over a stream of submissions with bounded memory.
+
+    Items are pulled from the iterable only when a worker is free and the
+    image bytes in flight stay under `max_inflight_bytes`. An image's share
+    of the budget is returned as soon as the pipeline releases its buffers
+    (right after OCR), so grading and feedback don't hold image memory.
+    """
+    def __init__(self, pipeline,
+                 max_workers: Optional[int] = None,
+                 max_inflight_bytes: Optional[int] = None):
+        settings = get_settings()
+        self.pipeline = pipeline
+        self.max_workers = max_workers or settings.pipeline_workers
+        self.max_inflight_bytes = max_inflight_bytes or settings.max_inflight_mb * 1024 * 1024
+        self.default_image_bytes = settings.default_image_mb * 1024 * 1024
+        self.logger = logging.getLogger(__name__)
+
+    def run(self, assignment_id: Optional[str], items: Iterable[BatchItem],
+            batch_id: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Process items concurrently, yielding events on the calling thread:
+          {'type': 'stage', 'name', 'source', 'stage', 'message'} as submissions move through stages
+          {'type': 'result', 'name', 'student_id', 'source', 'result', 'error'} when one finishes
+        Items may name their own assignment and batch. `items` may be endless
+        (a watched folder); events keep coming until it is exhausted.
+        """
+        events: queue.Queue = queue.Queue()
+        budget = ByteBudget(self.max_inflight_bytes)
+        slots = threading.Semaphore(self.max_workers)
+
+        def work(item: BatchItem):
+            name = item.name
+            pages = item.pages
+            try:
+                def on_stage_change(stage: str, message: str):
+                    events.put({'type': 'stage', 'name': name, 'source': item.source,
+                                'stage': stage, 'message': message})
+
+                if item.submission:
+                    result = self.pipeline.resume_submission(
+                        item.submission,
+                        image=pages,
+                        on_stage_change=on_stage_change
+                    )
+                else:
+                    result = self.pipeline.process_submission(
+                        image=pages if item.more_pages else item.image,
+                        assignment_id=item.assignment_id or assignment_id,
+                        student_id=item.student_id,
+                        on_stage_change=on_stage_change,
+                        prefetched=item.prefetched,
+                        batch_id=item.batch_id or batch_id
+                    )
+                events.put({'type': 'result', 'name': name, 'student_id': item.student_id,
+                            'source': item.source, 'result': result, 'error': None})
+            except Exception as e:
+                self.logger.error(f"Batch item {name} failed: {str(e)}")
+                events.put({'type': 'result', 'name': name, 'student_id': item.student_id,
+                            'source': item.source, 'result': None, 'error': str(e)})
+            finally:
+                for page in pages:
+                    page.release()
+                slots.release()
+
+        # Spans opened by workers nest under whatever span the caller has open
+        traced_work = propagate(work)
+
+        def feed(executor: ThreadPoolExecutor):
+            submitted = 0
+            try:
+                for item in items:
+                    costs = self._costs(item)
+                    slots.acquire()
+                    budget.acquire(sum(costs))
+                    # Each page returns its share as soon as its buffers are dropped
+                    for page, cost in zip(item.pages, costs):
+                        page.on_release(lambda cost=cost: budget.release(cost))
+                    executor.submit(traced_work, item)
+                    submitted += 1
+            except Exception as e:
+                self.logger.error(f"Batch input failed: {str(e)}")
+                events.put({'type': 'result', 'name': None, 'student_id': None, 'source': None,
+                            'result': None, 'error': str(e)})
+            finally:
+                events.put({'type': 'fed', 'count': submitted})
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch") as executor:
+            feeder = threading.Thread(target=feed, args=(executor,), daemon=True)
+            feeder.start()
+
+            submitted = None
+            finished = 0
+            while submitted is None or finished < submitted:
+                event = events.get()
+                if event['type'] == 'fed':
+                    submitted = event['count']
+                    continue
+                if event['type'] == 'result' and event['name'] is not None:
+                    finished += 1
+                yield event
+            feeder.join()
+
+        self.logger.info(f"Batch complete, peak image bytes in flight: {budget.peak}")
+
+    def resume(self, assignment_id: str, submissions: Iterable[Dict]) -> Iterator[Dict]:
+        """Like `run`, but restarts stored submissions from their first incomplete stage"""
+        storage = self.pipeline.storage_service
+
+        def items():
+            for submission in submissions:
+                first, *rest = storage.pages_for_submission(submission)
+                yield BatchItem(
+                    submission['student_id'],
+                    first,
+                    submission=submission,
+                    more_pages=tuple(rest)
+                )
+
+        return self.run(assignment_id, items())
+
+    def _costs(self, item: BatchItem) -> List[int]:
+        """Image bytes each page of an item will hold; resumed items past OCR never load theirs"""
+        if item.submission and resume_stage(item.submission) != "OCR":
+            return [0] * len(item.pages)
+        return [page.size or self.default_image_bytes for page in item.pages]
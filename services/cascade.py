@@ -0,0 +1,120 @@
+# services/cascade.py
+"""
+Confidence-gated model cascades for grading and feedback.
+
+The models configured for a stage answer in turn, smallest first. Each
+answer is scored from the token log probabilities that come back with it,
+and the next model is only asked while the score is below the stage's
+threshold. The most confident answer is used if no model reaches it.
+
+Grading is scored on the rubric verdicts: the lowest probability of any
+`true`/`false` the model chose. A split decision on a single point is what
+makes a submission borderline. Feedback is scored on the average token
+probability of the text.
+"""
+import bisect
+import json
+import logging
+import math
+import re
+import time
+from typing import Callable, List, Optional
+
+from pydantic import BaseModel
+
+from services.metrics import CASCADE_ATTEMPTS, CASCADE_SECONDS
+from services.tracing import set_attribute
+
+logger = logging.getLogger(__name__)
+
+_VERDICT = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:\s*(true|false)')
+
+class CascadeResult(BaseModel):
+    content: str
+    model: str
+    confidence: float
+    attempts: List[dict]
+
+def parse_models(value: str) -> List[str]:
+    """Models in cascade order from a comma-separated setting"""
+    return [model.strip() for model in value.split(",") if model.strip()]
+
+def _token_logprobs(choice) -> Optional[list]:
+    logprobs = getattr(choice, 'logprobs', None)
+    return getattr(logprobs, 'content', None) or None
+
+def verdict_confidence(choice, requirements: List[str]) -> float:
+    """
+    Lowest probability among the rubric verdict tokens of a grading answer.
+    0 when the answer isn't JSON or leaves a rubric point out.
+    """
+    content = choice.message.content or ""
+    try:
+        evaluation = json.loads(content.replace('```json\n', '').replace('\n```', '').strip())
+        points = evaluation['rubric_points']
+    except (ValueError, KeyError, TypeError):
+        return 0.0
+    if not isinstance(points, dict) or any(req not in points for req in requirements):
+        return 0.0
+
+    tokens = _token_logprobs(choice)
+    if not tokens:
+        # Without log probabilities a complete answer is all there is to go on
+        return 1.0
+    offsets, position = [], 0
+    for token in tokens:
+        offsets.append(position)
+        position += len(token.token)
+
+    confidence = 1.0
+    for match in _VERDICT.finditer(content):
+        start = match.start(2)
+        index = max(0, bisect.bisect_right(offsets, start) - 1)
+        confidence = min(confidence, math.exp(tokens[index].logprob))
+    return round(confidence, 4)
+
+def text_confidence(choice) -> float:
+    """Average per-token probability of a free-text answer (geometric mean)"""
+    content = (choice.message.content or "").strip()
+    if not content:
+        return 0.0
+    tokens = _token_logprobs(choice)
+    if not tokens:
+        return 1.0
+    return round(math.exp(sum(token.logprob for token in tokens) / len(tokens)), 4)
+
+def run_cascade(stage: str, models: List[str], threshold: float,
+                call: Callable[[str], object],
+                confidence: Callable[[object], float]) -> CascadeResult:
+    """
+    Ask each model in turn. `call(model)` returns a chat completion choice,
+    and `confidence(choice)` scores it. Stops at the first answer at or over
+    `threshold`.
+    """
+    if not models:
+        raise ValueError(f"No models configured for the {stage} cascade")
+    best: Optional[CascadeResult] = None
+    attempts = []
+    for i, model in enumerate(models):
+        started = time.perf_counter()
+        choice = call(model)
+        elapsed = time.perf_counter() - started
+        score = confidence(choice)
+        last = i == len(models) - 1
+        accepted = score >= threshold or last
+        outcome = "accepted" if accepted else "escalated"
+        CASCADE_ATTEMPTS.inc(stage=stage, model=model, outcome=outcome)
+        CASCADE_SECONDS.observe(elapsed, stage=stage, model=model)
+        attempts.append({'model': model, 'confidence': score, 'seconds': round(elapsed, 3)})
+        if best is None or score > best.confidence:
+            best = CascadeResult(content=choice.message.content or "", model=model,
+                                 confidence=score, attempts=attempts)
+        if accepted:
+            break
+        logger.info(f"{stage} confidence {score} from {model} is below {threshold}; escalating")
+
+    best.attempts = attempts
+    set_attribute(f"{stage}.model", best.model)
+    set_attribute(f"{stage}.confidence", best.confidence)
+    set_attribute(f"{stage}.escalations", len(attempts) - 1)
+    return best
@@ -0,0 +1,256 @@
+# services/cassette.py
+"""
+Record and replay of the app's OpenAI and Supabase HTTP traffic.
+
+With CASSETTE_MODE=record every request the SDKs send is passed through and
+appended to CASSETTE_PATH (JSONL) together with its response and latency.
+API keys, JWTs and signed-URL tokens are scrubbed, and image bytes are never
+written: request bodies are kept only as a hash, and image responses as a
+hash and size.
+
+With CASSETTE_MODE=replay nothing goes over the network. Each request is
+answered from the cassette, after sleeping for the recorded latency times
+CASSETTE_SPEED (1.0 keeps the original timing, 0 doesn't wait). A request
+is matched on its exact content first (minus timestamps and other volatile
+fields), then on its shape: method, path and the parameters that tell the
+app's calls apart. That way a different set of images still replays
+realistically, and shape matches cycle so a short recording can drive a
+large batch.
+
+The patch is applied at the transport level of both httpx packages in use
+(the openai SDK ships its own), so services keep their real clients.
+"""
+import base64
+import hashlib
+import importlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from config.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# httpx packages whose sync transport gets patched, when installed
+TRANSPORT_MODULES = ("httpx", "httpx2")
+
+_SECRETS = [
+    (re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]+"), "<jwt>"),
+    (re.compile(r"sk-[\w-]{16,}"), "<openai-key>"),
+]
+_STORAGE_TIMESTAMP = re.compile(r"(?<=/)\d{10}_")
+_DATA_URL = re.compile(r"data:image/[\w.+-]+;base64,[A-Za-z0-9+/=]+")
+# Request fields that differ from run to run without changing the answer
+VOLATILE_FIELDS = {'created_at', 'updated_at', 'processed_at', 'batch_id', 'idempotency_key'}
+# Response headers that describe the original transfer rather than the content
+DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection',
+                   'set-cookie', 'date', 'keep-alive'}
+# Scalar request parameters that distinguish otherwise similar calls
+SHAPE_PARAMS = ('model', 'temperature', 'max_tokens', 'response_format')
+
+class CassetteMiss(RuntimeError):
+    """A replayed request has nothing recorded to answer it"""
+
+def scrub(text: str) -> str:
+    for pattern, replacement in _SECRETS:
+        text = pattern.sub(replacement, text)
+    return text
+
+def _hash_data_url(match) -> str:
+    return f"image-sha256:{hashlib.sha256(match.group(0).encode('ascii')).hexdigest()}"
+
+def _normalize_json(value):
+    if isinstance(value, dict):
+        return {k: _normalize_json(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_normalize_json(v) for v in value]
+    if isinstance(value, str):
+        return _STORAGE_TIMESTAMP.sub("<ts>_", scrub(_DATA_URL.sub(_hash_data_url, value)))
+    return value
+
+def _normalize_path(path: str) -> str:
+    return _STORAGE_TIMESTAMP.sub("<ts>_", path)
+
+def _normalize_query(query: str, values: bool = True) -> str:
+    params = sorted((k, v) for k, v in parse_qsl(query, keep_blank_values=True) if k != "token")
+    return urlencode(params if values else [(k, "") for k, _ in params])
+
+def request_keys(method: str, path: str, query: str, body: bytes) -> Tuple[str, str]:
+    """(exact key, shape key) used to find a recorded response for a request"""
+    try:
+        payload = json.loads(body) if body else None
+    except ValueError:
+        payload = None
+
+    if payload is not None:
+        normalized = json.dumps(_normalize_json(payload), sort_keys=True)
+    else:
+        normalized = hashlib.sha256(body).hexdigest()
+    exact = hashlib.sha256(
+        f"{method} {_normalize_path(path)}?{_normalize_query(query)}\n{normalized}".encode("utf-8")
+    ).hexdigest()
+
+    segments = path.split("/")
+    bucket = get_settings().storage_bucket
+    if "/storage/v1/object/" in path and bucket in segments:
+        # Object paths name individual files; the operation and bucket are the shape
+        path = "/".join(segments[:segments.index(bucket) + 1])
+    shape = [method, _normalize_path(path), _normalize_query(query, values=False)]
+    rows = payload if isinstance(payload, list) else [payload]
+    if rows and isinstance(rows[0], dict):
+        shape.append(",".join(sorted(k for k in rows[0] if k not in VOLATILE_FIELDS)))
+        shape.extend(f"{k}={json.dumps(rows[0][k], sort_keys=True)}" for k in SHAPE_PARAMS if k in rows[0])
+        details = [part['image_url'].get('detail', "auto") for message in rows[0].get('messages') or []
+                   if isinstance(message.get('content'), list)
+                   for part in message['content'] if part.get('type') == "image_url"]
+        if details:
+            shape.append(f"images={','.join(details)}")
+    return exact, hashlib.sha256(" ".join(shape).encode("utf-8")).hexdigest()
+
+class Cassette:
+    def __init__(self, path: str, mode: str, speed: float = 1.0):
+        self.path = Path(path)
+        self.mode = mode
+        self.speed = speed
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+        self._exact: Dict[str, List[Dict]] = {}
+        self._shape: Dict[str, List[Dict]] = {}
+        self._cursor: Counter = Counter()
+        self._started = time.monotonic()
+        if mode == "replay":
+            self._load()
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _load(self) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # partially written last line
+                self._exact.setdefault(entry['request']['key'], []).append(entry)
+                self._shape.setdefault(entry['request']['shape'], []).append(entry)
+        logger.info(f"Loaded {sum(len(v) for v in self._exact.values())} interactions from {self.path}")
+
+    def record(self, request, response, started: float, elapsed: float) -> None:
+        body = request.read()
+        key, shape = request_keys(request.method, request.url.path, request.url.query.decode("ascii"), body)
+        content = response.content
+        content_type = response.headers.get('content-type', '')
+        entry = {
+            'request': {
+                'method': request.method,
+                'url': scrub(_normalize_path(str(request.url.copy_with(query=None)))),
+                'key': key,
+                'shape': shape,
+                'body_sha256': hashlib.sha256(body).hexdigest()
+            },
+            'response': {
+                'status': response.status_code,
+                'headers': {k: scrub(v) for k, v in response.headers.items() if k.lower() not in DROPPED_HEADERS}
+            },
+            'offset': round(started - self._started, 4),
+            'elapsed': round(elapsed, 4)
+        }
+        if content_type.startswith('image/'):
+            entry['response']['body_sha256'] = hashlib.sha256(content).hexdigest()
+            entry['response']['body_size'] = len(content)
+        else:
+            try:
+                entry['response']['text'] = scrub(content.decode("utf-8"))
+            except UnicodeDecodeError:
+                entry['response']['base64'] = base64.b64encode(content).decode("ascii")
+
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self.stats['recorded'] += 1
+
+    def _find(self, key: str, shape: str) -> Optional[Dict]:
+        with self._lock:
+            exact = self._exact.get(key, [])
+            if self._cursor[key] < len(exact):
+                self._cursor[key] += 1
+                self.stats['exact'] += 1
+                return exact[self._cursor[key] - 1]
+            similar = self._shape.get(shape, [])
+            if similar:
+                entry = similar[self._cursor[shape] % len(similar)]
+                self._cursor[shape] += 1
+                self.stats['shape'] += 1
+                return entry
+            self.stats['miss'] += 1
+            return None
+
+    def replay(self, request, response_class):
+        body = request.read()
+        key, shape = request_keys(request.method, request.url.path, request.url.query.decode("ascii"), body)
+        entry = self._find(key, shape)
+        if entry is None:
+            raise CassetteMiss(f"No recorded interaction for {request.method} {request.url.path}")
+
+        if self.speed:
+            time.sleep(entry['elapsed'] * self.speed)
+        recorded = entry['response']
+        if 'text' in recorded:
+            content = recorded['text'].encode("utf-8")
+        elif 'base64' in recorded:
+            content = base64.b64decode(recorded['base64'])
+        else:
+            # Image bytes weren't kept; stand in with the same number of bytes
+            content = bytes(recorded.get('body_size', 0))
+        return response_class(recorded['status'], headers=recorded['headers'], content=content, request=request)
+
+_installed: Optional[Cassette] = None
+_install_lock = threading.Lock()
+
+def _patch(module) -> None:
+    transport = module.HTTPTransport
+    original = transport.handle_request
+
+    def handle_request(self, request):
+        cassette = _installed
+        if cassette.mode == "replay":
+            return cassette.replay(request, module.Response)
+        started = time.monotonic()
+        response = original(self, request)
+        response.read()
+        try:
+            cassette.record(request, response, started, time.monotonic() - started)
+        except Exception as e:
+            logger.error(f"Cassette recording failed: {str(e)}")
+        return response
+
+    transport.handle_request = handle_request
+
+def install_cassette() -> Optional[Cassette]:
+    """Start recording or replaying if CASSETTE_MODE asks for it; safe to call repeatedly"""
+    global _installed
+    settings = get_settings()
+    if settings.cassette_mode not in ("record", "replay"):
+        return None
+    with _install_lock:
+        if _installed is None:
+            try:
+                cassette = Cassette(settings.cassette_path, settings.cassette_mode, settings.cassette_speed)
+            except Exception as e:
+                logger.error(f"Cassette unavailable: {str(e)}")
+                raise
+            for name in TRANSPORT_MODULES:
+                try:
+                    module = importlib.import_module(name)
+                except ImportError:
+                    continue
+                _patch(module)
+            _installed = cassette
+            logger.info(f"Cassette {settings.cassette_mode} mode: {settings.cassette_path}")
+    return _installed
@@ -0,0 +1,248 @@
+# services/cli.py
+"""
+Command-line bulk grading, without a browser session.
+
+    python -m services.cli grade --assignment <id> scans/ "more/*.jpg" class3b.pdf
+    python -m services.cli grade --assignment <id> scans/ --dry-run
+    python -m services.cli grade --assignment <id> scans/ --report run.jsonl --resume
+
+Directories contribute their images and PDFs; globs are expanded here too,
+for shells that don't. Images named `Name_p1.jpg`, `Name_p2.jpg` are one
+multi-page submission, and PDFs are split at separator pages or every
+`--pages-per-student` pages. Submissions run through ProcessingPipeline
+`--workers` at a time while a throughput line is kept up to date on stderr.
+
+Each finished submission is appended to the JSONL report as soon as it
+finishes. `--resume` reads the report back, skips submissions it already
+has as complete or flagged, and reruns the rest in the same batch, so work
+a crashed run had checkpointed is picked up rather than repeated.
+
+Connects with the Supabase service key, not a teacher's session.
+"""
+import argparse
+import glob
+import json
+import logging
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from services.auth import AuthContext
+from services.batch import BatchItem, BatchProcessor
+from services.grouping import group_pages
+from services.ingest import ImageSource
+from services.pdf import expected_submissions, page_count, pdf_submissions
+from services.pipeline import ProcessingPipeline
+from services.storage import StorageService
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+PDF_SUFFIX = ".pdf"
+FINISHED = ("complete", "flagged")
+
+def collect_files(inputs: List[str], recursive: bool = False) -> Tuple[List[Path], List[Path]]:
+    """Images and PDFs named by files, directories and glob patterns, without duplicates"""
+    found: Dict[Path, None] = {}
+    for item in inputs:
+        paths = [Path(p) for p in sorted(glob.glob(item, recursive=recursive))] or [Path(item)]
+        for path in paths:
+            if path.is_dir():
+                children = path.rglob("*") if recursive else path.iterdir()
+                found.update((child, None) for child in sorted(children) if child.is_file())
+            elif path.is_file():
+                found[path] = None
+            else:
+                raise FileNotFoundError(f"No such file or directory: {item}")
+    supported = [p for p in found if p.suffix.lower() in IMAGE_SUFFIXES | {PDF_SUFFIX}
+                 and not p.name.startswith(".")]
+    return ([p for p in supported if p.suffix.lower() in IMAGE_SUFFIXES],
+            [p for p in supported if p.suffix.lower() == PDF_SUFFIX])
+
+def read_report(path: Path) -> Tuple[Optional[str], Dict[str, Dict]]:
+    """Batch id and the last line per student from an earlier report"""
+    batch_id, submissions = None, {}
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if entry.get('type') == 'run':
+                batch_id = entry.get('batch_id') or batch_id
+            elif entry.get('type') == 'submission':
+                submissions[entry['student_id']] = entry
+    return batch_id, submissions
+
+class Throughput:
+    """One status line on stderr, rewritten in place on a terminal"""
+    def __init__(self, total: Optional[int], skipped: int = 0):
+        self.total = total
+        self.skipped = skipped
+        self.done = self.failed = self.flagged = 0
+        self.started = time.perf_counter()
+        self.tty = sys.stderr.isatty()
+
+    def update(self, status: str) -> None:
+        self.done += 1
+        self.failed += status == "error"
+        self.flagged += status == "flagged"
+        if self.tty or self.done % 10 == 0:
+            self.show()
+
+    def show(self, final: bool = False) -> None:
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed * 60 if elapsed else 0.0
+        total = f"/{self.total}" if self.total is not None else ""
+        line = (f"{self.done}{total} done, {self.failed} failed, {self.flagged} flagged"
+                f"{f', {self.skipped} skipped' if self.skipped else ''} | {rate:.1f}/min | "
+                f"{int(elapsed // 60)}:{int(elapsed % 60):02d} elapsed")
+        if self.tty and not final:
+            sys.stderr.write(f"\r{line}\x1b[K")
+        else:
+            sys.stderr.write(f"{line}\n")
+        sys.stderr.flush()
+
+def image_groups(images: List[Path]) -> List[Tuple[str, List[Path]]]:
+    """Images grouped into submissions by filename, without reading them"""
+    placeholders = [ImageSource(path.name, None) for path in images]
+    paths = {id(source): path for source, path in zip(placeholders, images)}
+    return [(student_id, [paths[id(page)] for page in pages]) for student_id, pages in group_pages(placeholders)]
+
+def submissions(images: List[Path], pdfs: List[Path], pages_per_student: Optional[int],
+                skip: Set[str]) -> Iterator[Tuple[str, List[ImageSource], List[str]]]:
+    """(student_id, pages, source files) for every submission not in `skip`, read lazily"""
+    for student_id, paths in image_groups(images):
+        if student_id not in skip:
+            yield student_id, [ImageSource.from_path(path) for path in paths], [str(path) for path in paths]
+    for pdf in pdfs:
+        for student_id, pages in pdf_submissions(str(pdf), pdf.name, pages_per_student=pages_per_student):
+            if student_id in skip:
+                for page in pages:
+                    page.release()
+                continue
+            yield student_id, pages, [f"{pdf}#{page.name}" for page in pages]
+
+def grade(args) -> int:
+    images, pdfs = collect_files(args.inputs, args.recursive)
+    if not images and not pdfs:
+        print("No images or PDFs found", file=sys.stderr)
+        return 2
+
+    if args.dry_run:
+        groups = image_groups(images)
+        for student_id, paths in groups:
+            print(f"{student_id}: {', '.join(path.name for path in paths)}")
+        total = len(groups)
+        for pdf in pdfs:
+            expected = expected_submissions(str(pdf), args.pages_per_student)
+            split = f"{expected} submission(s)" if expected is not None else "split at separator pages"
+            print(f"{pdf.name}: {page_count(str(pdf))} pages, {split}")
+            total += expected or 0
+        print(f"{len(images)} image(s), {len(pdfs)} PDF(s), at least {total} submission(s). Nothing was sent.",
+              file=sys.stderr)
+        return 0
+
+    storage = StorageService(AuthContext.service())
+    assignment = storage.get_assignment(args.assignment)
+    if not assignment:
+        print(f"Assignment {args.assignment} not found", file=sys.stderr)
+        return 2
+
+    report_path = Path(args.report or f"grade-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl")
+    batch_id, previous = None, {}
+    if args.resume:
+        if not report_path.exists():
+            print(f"--resume needs an existing --report; {report_path} not found", file=sys.stderr)
+            return 2
+        batch_id, previous = read_report(report_path)
+    batch_id = batch_id or f"cli-{uuid.uuid4()}"
+    finished = {student_id for student_id, entry in previous.items() if entry.get('status') in FINISHED}
+
+    pipeline = ProcessingPipeline(storage)
+    processor = BatchProcessor(pipeline, max_workers=args.workers)
+    expected = [1] * len(image_groups(images)) + [expected_submissions(str(pdf), args.pages_per_student) for pdf in pdfs]
+    total = sum(expected) - len(finished) if None not in expected else None
+    progress = Throughput(total, skipped=len(finished))
+    sources: Dict[str, Dict] = {}
+
+    def items() -> Iterator[BatchItem]:
+        for student_id, pages, files in submissions(images, pdfs, args.pages_per_student, finished):
+            if args.resume:
+                # Submissions in flight when the last run stopped never reached the report;
+                # release any row it left behind so this run takes it over from its checkpoints
+                pipeline.release_interrupted(args.assignment, student_id, pages, batch_id)
+            source = str(len(sources))
+            sources[source] = {'student_id': student_id, 'files': files, 'started': time.perf_counter()}
+            yield BatchItem(student_id, pages[0], more_pages=tuple(pages[1:]), source=source)
+
+    failed = 0
+    with open(report_path, "a+") as report:
+        report.seek(0, 2)
+        if report.tell():
+            report.seek(report.tell() - 1)
+            if report.read(1) != "\n":
+                report.write("\n")  # don't run on from a line cut short by a crash
+        report.write(json.dumps({'type': 'run', 'batch_id': batch_id, 'assignment_id': args.assignment,
+                                 'started_at': datetime.now().isoformat(), 'resume': bool(args.resume),
+                                 'workers': processor.max_workers}) + "\n")
+        for event in processor.run(args.assignment, items(), batch_id=batch_id):
+            if event['type'] != 'result':
+                continue
+            if event['name'] is None:
+                # Reading the inputs failed; submissions already queued still finish
+                logger.error(f"Stopped reading inputs: {event['error']}")
+                report.write(json.dumps({'type': 'error', 'error': event['error']}) + "\n")
+                failed += 1
+                continue
+            result = event['result'] or {}
+            status = result.get('status') or "error"
+            failed += status == "error"
+            source = sources.get(event.get('source'), {})
+            report.write(json.dumps({
+                'type': 'submission',
+                'student_id': event['student_id'],
+                'files': source.get('files', []),
+                'status': status,
+                'submission_id': result.get('submission_id'),
+                'score': (result.get('score') or {}).get('teacher_score'),
+                'issues': result.get('issues'),
+                'duplicate': result.get('duplicate', False),
+                'error': event['error'],
+                'seconds': round(time.perf_counter() - source['started'], 3) if source else None
+            }) + "\n")
+            report.flush()
+            progress.update(status)
+    progress.show(final=True)
+    print(f"Report: {report_path}", file=sys.stderr)
+    return 1 if failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m services.cli", description="Headless grading tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    grade_parser = commands.add_parser("grade", help="Grade a folder, glob or list of scans")
+    grade_parser.add_argument("--assignment", required=True, help="Assignment ID")
+    grade_parser.add_argument("inputs", nargs="+", metavar="PATH", help="Files, directories or glob patterns")
+    grade_parser.add_argument("--workers", type=int, default=None, help="Concurrent submissions; defaults to PIPELINE_WORKERS")
+    grade_parser.add_argument("--recursive", action="store_true", help="Include subdirectories (and ** in globs)")
+    grade_parser.add_argument("--pages-per-student", type=int, default=None,
+                              help="Split PDFs every N pages instead of at separator pages")
+    grade_parser.add_argument("--dry-run", action="store_true", help="List the submissions without grading anything")
+    grade_parser.add_argument("--report", help="JSONL report to write (default grade-<timestamp>.jsonl)")
+    grade_parser.add_argument("--resume", action="store_true",
+                              help="Continue the run recorded in --report, skipping finished submissions")
+    grade_parser.add_argument("--verbose", action="store_true", help="Log every request, not just problems")
+    args = parser.parse_args()
+
+    # Keep stderr for the progress line and anything that goes wrong
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    if args.command == "grade":
+        sys.exit(grade(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# services/cropping.py
+"""
+Answer-region cropping for fixed worksheets.
+
+An assignment's crop template lists the answer boxes as fractions of the
+page. Before OCR the boxes are located on each photo, cut out at full
+resolution and stacked into one image, so the vision model doesn't read
+(and bill for) the printed question and margins. Photos are rarely framed
+like the reference worksheet, so boxes can be placed relative to the
+detected sheet of paper, or mapped through the worksheet's corner marks.
+When alignment fails the whole page is sent, as without a template.
+"""
+import io
+import json
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from models.assignment import CropTemplate
+from services.ingest import ImageSource
+
+logger = logging.getLogger(__name__)
+
+Box = Tuple[float, float, float, float]   # x0, y0, x1, y1 as fractions of the photo
+
+DETECTION_SIZE = (1024, 1024)  # Alignment runs on a downscaled copy
+CORNER_WINDOW = 0.15           # Share of each side searched for a corner mark
+MIN_MARK_SIDE = 0.012          # Smallest corner mark, as a share of the shorter side; thicker than pen strokes
+MIN_MARK_FILL = 0.9            # Dark share of a square for it to count as part of a mark
+REGION_PADDING = 0.01          # Added around each box to allow for small alignment errors
+STACK_GAP = 16                 # Pixels of white between stacked regions
+
+def _gray(image: Image.Image) -> np.ndarray:
+    small = image.convert("L")
+    small.thumbnail(DETECTION_SIZE)
+    return np.asarray(small, dtype=np.float32)
+
+def _solid_square(dark: np.ndarray, corner: Tuple[int, int], min_side: int) -> Optional[Tuple[float, float]]:
+    """
+    Centre of the largest solid dark square in a window, the one closest to
+    `corner` if there are several. Pen strokes and printed text are too thin to count.
+    """
+    integral = np.pad(dark.astype(np.int32).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    side = min(dark.shape) // 2
+    while side >= min_side:
+        sums = (integral[side:, side:] - integral[:-side, side:]
+                - integral[side:, :-side] + integral[:-side, :-side])
+        ys, xs = np.nonzero(sums >= MIN_MARK_FILL * side * side)
+        if len(ys):
+            nearest = np.argmin((ys - corner[0]) ** 2 + (xs - corner[1]) ** 2)
+            top, left = ys[nearest], xs[nearest]
+            # Refine to the centroid of the dark pixels around the square
+            pad = side // 2
+            y0, x0 = max(0, top - pad), max(0, left - pad)
+            mark_ys, mark_xs = np.nonzero(dark[y0:top + side + pad, x0:left + side + pad])
+            return x0 + mark_xs.mean() + 0.5, y0 + mark_ys.mean() + 0.5
+        side = int(side * 0.8)
+    return None
+
+def detect_fiducials(gray: np.ndarray) -> List[Optional[Tuple[float, float]]]:
+    """
+    Centres of solid dark marks in the four corners (top-left, top-right,
+    bottom-left, bottom-right) as fractions of the image; None where no mark is found.
+    """
+    height, width = gray.shape
+    # Only look on the paper, so a dark desk around it can't pass for a mark
+    x0, y0, x1, y1 = page_bounds(gray)
+    page_left, page_top = int(x0 * width), int(y0 * height)
+    page = gray[page_top:int(y1 * height), page_left:int(x1 * width)]
+    page_h, page_w = page.shape
+    dark = page < np.percentile(page, 90) * 0.5
+    window_h, window_w = int(page_h * CORNER_WINDOW), int(page_w * CORNER_WINDOW)
+    min_side = max(3, int(min(page_h, page_w) * MIN_MARK_SIDE))
+    marks = []
+    for top, left in ((0, 0), (0, page_w - window_w), (page_h - window_h, 0), (page_h - window_h, page_w - window_w)):
+        window = dark[top:top + window_h, left:left + window_w]
+        corner = (0 if top == 0 else window_h, 0 if left == 0 else window_w)
+        found = _solid_square(window, corner, min_side)
+        marks.append(None if found is None else ((page_left + left + found[0]) / width,
+                                                 (page_top + top + found[1]) / height))
+    return marks
+
+def page_bounds(gray: np.ndarray) -> Box:
+    """The sheet of paper in a photo: rows and columns that are mostly paper-bright"""
+    paper = gray > np.percentile(gray, 75) * 0.75
+    rows = np.nonzero(paper.mean(axis=1) > 0.5)[0]
+    cols = np.nonzero(paper.mean(axis=0) > 0.5)[0]
+    height, width = gray.shape
+    if not len(rows) or not len(cols):
+        return 0.0, 0.0, 1.0, 1.0
+    return cols[0] / width, rows[0] / height, (cols[-1] + 1) / width, (rows[-1] + 1) / height
+
+def _fit_affine(source: List[Tuple[float, float]], target: List[Tuple[float, float]]) -> np.ndarray:
+    """Least-squares 2x3 affine transform taking source points to target points"""
+    a = np.array([[x, y, 1.0] for x, y in source])
+    b = np.array(target)
+    solution, *_ = np.linalg.lstsq(a, b, rcond=None)
+    return solution.T
+
+def region_boxes(template: CropTemplate, gray: np.ndarray) -> Optional[List[Box]]:
+    """Each template region located on this photo, or None if the page couldn't be aligned"""
+    corners = lambda r: [(r.x, r.y), (r.x + r.width, r.y), (r.x, r.y + r.height), (r.x + r.width, r.y + r.height)]
+
+    if template.align == "fiducials":
+        found = detect_fiducials(gray)
+        pairs = [(ref, hit) for ref, hit in zip(template.fiducials, found) if ref is not None and hit is not None]
+        if len(pairs) < 3:
+            return None
+        transform = _fit_affine([tuple(ref) for ref, _ in pairs], [hit for _, hit in pairs])
+        place = lambda points: [tuple(transform @ np.array([x, y, 1.0])) for x, y in points]
+    elif template.align == "page":
+        x0, y0, x1, y1 = page_bounds(gray)
+        place = lambda points: [(x0 + x * (x1 - x0), y0 + y * (y1 - y0)) for x, y in points]
+    else:
+        place = lambda points: points
+
+    boxes = []
+    for region in template.regions:
+        points = place(corners(region))
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        box = (max(0.0, min(xs) - REGION_PADDING), max(0.0, min(ys) - REGION_PADDING),
+               min(1.0, max(xs) + REGION_PADDING), min(1.0, max(ys) + REGION_PADDING))
+        if box[2] - box[0] <= 0 or box[3] - box[1] <= 0:
+            return None
+        boxes.append(box)
+    return boxes
+
+def template_for(assignment_data: dict) -> Optional[CropTemplate]:
+    """The crop template stored on an assignment row, if it has one"""
+    template = assignment_data.get('crop_template')
+    if not template:
+        return None
+    return CropTemplate.model_validate(json.loads(template) if isinstance(template, str) else template)
+
+def crop_answers(image: ImageSource, template: Optional[CropTemplate]) -> ImageSource:
+    """
+    The answer regions of a page stacked top to bottom in one JPEG, or the
+    page itself when there is no template or it can't be aligned.
+    """
+    if not template or not template.regions:
+        return image
+    page = Image.open(image.open())
+    page.load()
+    boxes = region_boxes(template, _gray(page))
+    if boxes is None:
+        logger.warning(f"Could not align {image.name} to the crop template; sending the whole page")
+        return image
+
+    width, height = page.size
+    crops = [page.crop((round(x0 * width), round(y0 * height), round(x1 * width), round(y1 * height)))
+             for x0, y0, x1, y1 in boxes]
+    stacked = Image.new("RGB", (max(c.width for c in crops),
+                                sum(c.height for c in crops) + STACK_GAP * (len(crops) - 1)), "white")
+    top = 0
+    for crop in crops:
+        stacked.paste(crop.convert("RGB"), (0, top))
+        top += crop.height + STACK_GAP
+    buffer = io.BytesIO()
+    stacked.save(buffer, format="JPEG", quality=90)
+    return ImageSource(image.name, buffer.getvalue(), "image/jpeg")
+
+def reference_fiducials(data: bytes) -> List[Optional[Tuple[float, float]]]:
+    """Corner marks on a reference worksheet, for a "fiducials" template"""
+    return detect_fiducials(_gray(Image.open(io.BytesIO(data))))
+
+def draw_regions(data: bytes, template: CropTemplate, size: Tuple[int, int] = (600, 800)) -> bytes:
+    """Preview of a worksheet photo with the template's boxes (as located on it) outlined"""
+    page = Image.open(io.BytesIO(data)).convert("RGB")
+    page.thumbnail(size)
+    boxes = region_boxes(template, _gray(page)) or []
+    draw = ImageDraw.Draw(page)
+    for x0, y0, x1, y1 in boxes:
+        draw.rectangle([x0 * page.width, y0 * page.height, x1 * page.width, y1 * page.height],
+                       outline=(220, 40, 40), width=3)
+    if template.align == "fiducials":
+        for mark in detect_fiducials(_gray(page)):
+            if mark:
+                x, y = mark[0] * page.width, mark[1] * page.height
+                draw.ellipse([x - 6, y - 6, x + 6, y + 6], outline=(40, 120, 220), width=3)
+    buffer = io.BytesIO()
+    page.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
@@ -2,17 +2,25 @@
 from typing import Dict, Optional
 import json
 import logging
-from openai import OpenAI
+from services.openai_client import create_openai_client
 from models.assessment import AssessmentResult
 from models.assignment import Assignment
 from config.settings import get_settings
+from services.cascade import parse_models, run_cascade, text_confidence
+from services.llm_cache import LLMCache, get_llm_cache
+from services.tracing import traced
+
+# Bump when a prompt changes so cached completions are not reused
+VALIDATION_PROMPT_VERSION = "feedback-validation-v1"
 
 class FeedbackService:
     def __init__(self):
         self.settings = get_settings()
-        self.client = OpenAI(api_key=self.settings.openai_api_key)
+        self.client = create_openai_client("feedback")
+        self.cache = get_llm_cache()
         self.logger = logging.getLogger(__name__)
 
+    @traced("feedback.generate_feedback")
     def generate_feedback(self,
                          assessment: AssessmentResult,
                          assignment: Assignment,
@@ -50,20 +58,26 @@ Example feedback style:
 OUTPUT FORMAT
 - Feedback text only"""
 
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=500
-            )
-
-            feedback = response.choices[0].message.content.strip()
+            # Sampled at temperature 0.7, so not cached: a cache hit would replay one sample forever
+            feedback = run_cascade(
+                "feedback", parse_models(self.settings.feedback_models),
+                self.settings.feedback_confidence_threshold,
+                lambda model: self.client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.7,
+                    max_tokens=500,
+                    logprobs=True
+                ).choices[0],
+                text_confidence
+            ).content.strip()
             return feedback
 
         except Exception as e:
             self.logger.error(f"Feedback generation failed: {str(e)}")
             raise
 
+    @traced("feedback.validate_feedback")
     def validate_feedback(self,
                          feedback: str,
                          assessment: AssessmentResult,
@@ -96,14 +110,20 @@ Return only a JSON object:
     "score": 0-100
 }}"""
 
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-                max_tokens=500
+            model = self.settings.validation_model
+            rubric_hash = assignment.rubric_hash()
+            validation = self.cache.get_or_create(
+                LLMCache.make_key(f"{feedback}\n{assessment.model_dump_json()}", rubric_hash,
+                                  model, VALIDATION_PROMPT_VERSION, 0),
+                lambda: self.client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0,
+                    max_tokens=500
+                ).choices[0].message.content,
+                assignment_id=assignment.id,
+                rubric_hash=rubric_hash
             )
-
-            validation = response.choices[0].message.content
             return json.loads(validation)  # Convert string to dict safely
 
         except Exception as e:
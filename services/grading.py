@@ -1,35 +1,105 @@
 # services/grading.py
+import hashlib
 import json
 import logging
-from openai import OpenAI
+from typing import Dict, List
+from services.openai_client import create_openai_client
 from models.assessment import GPTEvaluation, AssessmentResult
 from models.submission import Submission
 from models.assignment import Assignment
 from config.settings import get_settings
+from services.cascade import parse_models, run_cascade, verdict_confidence
+from services.llm_cache import LLMCache, get_llm_cache
+from services.tracing import traced
+
+# Bump when the grading prompt changes so cached completions are not reused
+PROMPT_VERSION = "grading-v1"
 
 class GradingService:
     def __init__(self):
         self.settings = get_settings()
-        self.client = OpenAI(api_key=self.settings.openai_api_key)
+        self.client = create_openai_client("grading")
+        self.cache = get_llm_cache()
         self.logger = logging.getLogger(__name__)
 
+    @traced("grading.grade_submission")
     def grade_submission(self, submission: Submission, assignment: Assignment) -> AssessmentResult:
         """Grade a submission using standardized criteria"""
         try:
             if not submission.ocr_text:
                 raise ValueError("Submission text not available")
-                
-            # Store current submission text for _parse_response
-            self.current_submission_text = submission.ocr_text
 
             # Get rubric requirements
             requirements = [req.text for req in assignment.rubric_structure.requirements]
             
-            # Prepare evaluation prompt
-            prompt = f"""
+            # Evaluate against every rubric point
+            gpt_eval = self.evaluate_points(submission.ocr_text, assignment, requirements)
+
+            # Map GPT's evaluation to rubric points
+            result = self._map_to_rubric(gpt_eval, assignment)
+
+            return result
+
+        except Exception as e:
+            self.logger.error(f"Grading failed: {str(e)}")
+            raise
+
+    @traced("grading.regrade")
+    def regrade(self, student_response: str, assignment: Assignment, previous: Dict) -> AssessmentResult:
+        """
+        Re-grade against an edited rubric, reusing stored per-point results.
+        Only rubric points without a stored result in `previous` (a stored
+        AssessmentResult dict) are sent for evaluation.
+        """
+        try:
+            requirements = [req.text for req in assignment.rubric_structure.requirements]
+            previous_points = previous.get('rubric_points_evaluation') or {}
+            removed = [point for point in previous_points if point not in requirements]
+            pending = [text for text in requirements if text not in previous_points]
+
+            rubric_points = {text: previous_points[text] for text in requirements if text in previous_points}
+            points_earned = [p for p in previous.get('rubric_points_earned', []) if p not in removed]
+            misconceptions = list(previous.get('misconceptions', []))
+            explanation = previous.get('feedback', '')
+
+            if pending:
+                self.logger.info(f"Re-evaluating {len(pending)} rubric point(s), reusing {len(rubric_points)}")
+                new_eval = self.evaluate_points(student_response, assignment, pending)
+                rubric_points.update({text: bool(new_eval.rubric_points.get(text, False)) for text in pending})
+                points_earned += [p for p in new_eval.points_earned if p not in points_earned]
+                misconceptions += [m for m in new_eval.misconceptions if m not in misconceptions]
+                explanation = f"{explanation}\n\n{new_eval.explanation}".strip()
+
+            confidence = previous.get('confidence')
+            model = previous.get('model')
+            if pending and new_eval.confidence is not None:
+                # A regrade is only as sure as its least sure part
+                confidence = new_eval.confidence if confidence is None else min(confidence, new_eval.confidence)
+                model = new_eval.model or model
+            merged = GPTEvaluation(
+                student_response=student_response,
+                rubric_points=rubric_points,
+                points_earned=points_earned,
+                misconceptions=misconceptions,
+                explanation=explanation,
+                model=model,
+                confidence=confidence
+            )
+            return self._map_to_rubric(merged, assignment)
+
+        except Exception as e:
+            self.logger.error(f"Re-grading failed: {str(e)}")
+            raise
+
+    @traced("grading.evaluate_points")
+    def evaluate_points(self, student_response: str, assignment: Assignment,
+                        requirements: List[str]) -> GPTEvaluation:
+        """Evaluate a response against the given rubric points"""
+        # Prepare evaluation prompt
+        prompt = f"""
             Question: {assignment.question_text}
             
-            Student Response: {submission.ocr_text}
+            Student Response: {student_response}
 
             Evaluate this response against each of these specific rubric points:
             {json.dumps(requirements, indent=2)}
@@ -46,31 +116,46 @@ class GradingService:
             }}
             """
 
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0
-            )
+        models = parse_models(self.settings.grading_models)
+        threshold = self.settings.grading_confidence_threshold
 
-            # Parse GPT's evaluation
-            gpt_eval = GPTEvaluation(**self._parse_response(response))
+        def cascade() -> str:
+            result = run_cascade(
+                "grading", models, threshold,
+                lambda model: self.client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0,
+                    logprobs=True
+                ).choices[0],
+                lambda choice: verdict_confidence(choice, requirements)
+            )
+            evaluation = json.loads(self._strip_fences(result.content))
+            evaluation.update(model=result.model, confidence=result.confidence)
+            return json.dumps(evaluation)
 
-            # Map GPT's evaluation to rubric points
-            result = self._map_to_rubric(gpt_eval, assignment)
+        rubric_hash = assignment.rubric_hash()
+        # Partial evaluations are keyed on the exact points asked about
+        points_hash = hashlib.sha256(json.dumps(requirements).encode("utf-8")).hexdigest()
+        content = self.cache.get_or_create(
+            LLMCache.make_key(student_response, f"{rubric_hash}:{points_hash}",
+                              f"{'>'.join(models)}@{threshold}", PROMPT_VERSION, 0),
+            cascade,
+            assignment_id=assignment.id,
+            rubric_hash=rubric_hash
+        )
 
-            return result
+        # Parse GPT's evaluation
+        return GPTEvaluation(**self._parse_response(content, student_response))
 
-        except Exception as e:
-            self.logger.error(f"Grading failed: {str(e)}")
-            raise
+    def _strip_fences(self, content: str) -> str:
+        return content.replace('```json\n', '').replace('\n```', '').strip()
 
-    def _parse_response(self, response) -> dict:
+    def _parse_response(self, content: str, student_response: str) -> dict:
         """Parse and validate GPT's response"""
-        content = response.choices[0].message.content
-        content = content.replace('```json\n', '').replace('\n```', '').strip()
-        gpt_response = json.loads(content)
+        gpt_response = json.loads(self._strip_fences(content))
         # Add student_response from the original prompt context
-        gpt_response['student_response'] = self.current_submission_text
+        gpt_response['student_response'] = student_response
         return gpt_response
 
     def _map_to_rubric(self, eval: GPTEvaluation, assignment: Assignment) -> AssessmentResult:
@@ -90,7 +175,8 @@ class GradingService:
             rubric_points_earned=eval.points_earned,
             misconceptions=eval.misconceptions,
             feedback=eval.explanation,
-            confidence=0.95
+            confidence=eval.confidence if eval.confidence is not None else 1.0,
+            model=eval.model
         )
 
     def _calculate_weighted_score(self, eval: GPTEvaluation, assignment: Assignment) -> float:
@@ -0,0 +1,50 @@
+# services/grouping.py
+"""
+Grouping uploaded images into multi-page submissions.
+
+A submission owns an ordered list of pages. By default pages are grouped
+by filename: `JaneDoe_p1.jpg`, `JaneDoe_p2.jpg` (also `-page2`, ` p2`...)
+are pages 1 and 2 of JaneDoe's answer, and a file without a page suffix
+is a one-page submission. The upload page lets the teacher correct the
+student and page of each file before processing.
+"""
+import hashlib
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from services.ingest import ImageSource
+
+PAGE_SUFFIX = re.compile(r"^(?P<student>.+?)[\s_-]+p(?:age|g)?[\s_-]?(?P<page>\d{1,3})$", re.IGNORECASE)
+
+def student_and_page(name: str) -> Tuple[str, Optional[int]]:
+    """Student ID and page number from a filename; the page is None without a suffix"""
+    stem = Path(name).stem
+    match = PAGE_SUFFIX.match(stem)
+    if not match:
+        return stem, None
+    return match.group('student'), int(match.group('page'))
+
+def group_pages(images: List[ImageSource],
+                assignments: Optional[List[Tuple[str, Optional[int]]]] = None) -> List[Tuple[str, List[ImageSource]]]:
+    """
+    Submissions as (student_id, pages in order). `assignments` gives the
+    student and page for each image, in the same order; by default both
+    come from the filenames. Groups keep the order students first appear in.
+    """
+    assignments = assignments or [student_and_page(image.name) for image in images]
+    groups: Dict[str, List[Tuple[int, int, ImageSource]]] = {}
+    for position, (image, (student_id, page)) in enumerate(zip(images, assignments)):
+        # Unnumbered pages follow numbered ones in upload order
+        groups.setdefault(student_id, []).append((page if page is not None else 10 ** 6, position, image))
+    return [
+        (student_id, [image for _, _, image in sorted(pages, key=lambda p: p[:2])])
+        for student_id, pages in groups.items()
+    ]
+
+def pages_hash(pages: List[ImageSource]) -> str:
+    """Identity of a submission: the image's identity, or a hash of the ordered page identities"""
+    if len(pages) == 1:
+        return pages[0].identity
+    joined = ":".join(page.identity for page in pages)
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
@@ -0,0 +1,386 @@
+# services/hotfolder.py
+"""
+Hot-folder ingestion for scanner workflows.
+
+    python -m services.hotfolder --watch /srv/scans/bio-lab3=<assignment id> [--watch ...]
+
+Each watched folder belongs to one assignment. Images and PDFs that appear
+in it are picked up once their size and modification time have stopped
+changing for HOT_FOLDER_SETTLE_SECONDS, run through ProcessingPipeline
+with bounded concurrency, and moved to `done/` or `failed/` beside them.
+Images named `Name_p1.jpg`, `Name_p2.jpg` are one multi-page submission;
+PDFs are split at separator pages, or every `--pages-per-student` pages.
+
+On Linux, inotify wakes the scanner as soon as a folder changes. Folders
+are also rescanned every HOT_FOLDER_POLL_SECONDS, which is all there is
+elsewhere and catches writes that network shares never report.
+
+Every file is recorded by content hash in `.grader-ledger.jsonl` in its
+folder before it is processed and again when it finishes. After a restart,
+finished files still in the folder are only moved, and interrupted ones
+resume from their last checkpoint instead of being graded again.
+
+Runs with the Supabase service key, outside any Streamlit session.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import signal
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from config.settings import get_settings
+from services.auth import AuthContext
+from services.batch import BatchItem, BatchProcessor
+from services.grouping import group_pages, student_and_page
+from services.ingest import ImageSource
+from services.pdf import pdf_submissions
+from services.pipeline import ProcessingPipeline
+from services.storage import StorageService
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+PDF_SUFFIX = ".pdf"
+LEDGER_NAME = ".grader-ledger.jsonl"
+OUTCOME_FOLDERS = ("done", "failed")
+
+# inotify(7) events that mean a file appeared or changed
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+class WatchedFolder(NamedTuple):
+    path: Path
+    assignment_id: str
+
+def parse_folders(specs: List[str]) -> List[WatchedFolder]:
+    """Folders from "path=assignment_id" entries (comma-separated entries are split too)"""
+    folders = []
+    for spec in specs:
+        for entry in filter(None, (part.strip() for part in spec.split(","))):
+            path, separator, assignment_id = entry.rpartition("=")
+            if not separator or not path or not assignment_id:
+                raise ValueError(f"Expected path=assignment_id, got {entry!r}")
+            folders.append(WatchedFolder(Path(path).expanduser().resolve(), assignment_id.strip()))
+    return folders
+
+class PollingWatcher:
+    """Wakes the scanner every poll interval"""
+    def __init__(self, interval: float):
+        self.interval = interval
+
+    def wait(self, stop: threading.Event) -> None:
+        stop.wait(self.interval)
+
+    def close(self) -> None:
+        pass
+
+class InotifyWatcher(PollingWatcher):
+    """Also wakes the scanner as soon as a watched folder changes (Linux, through libc)"""
+    def __init__(self, folders: List[Path], interval: float):
+        super().__init__(interval)
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        for folder in folders:
+            if libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK) < 0:
+                error = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(error, f"inotify_add_watch failed for {folder}")
+
+    def wait(self, stop: threading.Event) -> None:
+        deadline = time.monotonic() + self.interval
+        # Short slices so a stop request isn't held up by a quiet folder
+        while not stop.is_set() and time.monotonic() < deadline:
+            ready, _, _ = select.select([self.fd], [], [], min(1.0, max(0.0, deadline - time.monotonic())))
+            if ready:
+                self._drain()
+                return
+
+    def _drain(self) -> None:
+        # Which file changed doesn't matter: the folder is rescanned
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+def open_watcher(folders: List[Path], interval: float, polling: bool = False) -> PollingWatcher:
+    """inotify where it's available, polling otherwise"""
+    if not polling:
+        try:
+            return InotifyWatcher(folders, interval)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable, polling every {interval}s: {str(e)}")
+    return PollingWatcher(interval)
+
+class Ledger:
+    """Append-only record of the files a folder has seen, keyed by content hash"""
+    def __init__(self, folder: Path):
+        self.path = folder / LEDGER_NAME
+        self.entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry['hash']] = entry
+                    except (ValueError, KeyError):
+                        continue  # a line cut short by a crash
+
+    def get(self, file_hash: str) -> Optional[Dict]:
+        with self._lock:
+            return self.entries.get(file_hash)
+
+    def record(self, file_hash: str, file: str, status: str, **details) -> None:
+        entry = {'hash': file_hash, 'file': file, 'status': status,
+                 'at': datetime.now().isoformat(), **details}
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[file_hash] = entry
+
+class _Job:
+    """Files processed together (one image group, or one PDF) and their outstanding submissions"""
+    def __init__(self, folder: WatchedFolder, paths: List[Path], hashes: List[str], batch_id: str):
+        self.id = str(paths[0])
+        self.folder = folder
+        self.paths = paths
+        self.hashes = hashes
+        self.batch_id = batch_id
+        self.outstanding = 0
+        self.fed_all = False
+        self.finalized = False
+        self.submissions: List[str] = []
+        self.errors: List[str] = []
+
+class HotFolderDaemon:
+    """Feeds files from watched folders into a BatchProcessor until stopped"""
+    def __init__(self, folders: List[WatchedFolder],
+                 pipeline: Optional[ProcessingPipeline] = None,
+                 max_workers: Optional[int] = None,
+                 pages_per_student: Optional[int] = None,
+                 polling: bool = False):
+        self.settings = get_settings()
+        self.folders = folders
+        self.pipeline = pipeline or ProcessingPipeline(StorageService(AuthContext.service()))
+        self.processor = BatchProcessor(self.pipeline, max_workers=max_workers)
+        self.pages_per_student = pages_per_student
+        self.polling = polling
+        self.ledgers = {folder.path: Ledger(folder.path) for folder in folders}
+        self.jobs: Dict[str, _Job] = {}
+        self.stop_event = threading.Event()
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._in_flight: set = set()
+        self._observed: Dict[Path, Tuple[Tuple[int, int], float]] = {}
+
+    def run(self) -> None:
+        """Process files as they arrive; returns after `stop()` once in-flight work is done"""
+        for folder in self.folders:
+            for outcome in OUTCOME_FOLDERS:
+                (folder.path / outcome).mkdir(parents=True, exist_ok=True)
+        watcher = open_watcher([folder.path for folder in self.folders],
+                               self.settings.hot_folder_poll_seconds, self.polling)
+        self.logger.info(f"Watching {', '.join(str(folder.path) for folder in self.folders)}")
+        try:
+            for event in self.processor.run(None, self._items(watcher)):
+                if event['type'] == 'result' and event.get('source'):
+                    self._finish_item(event)
+        finally:
+            watcher.close()
+        self.logger.info("Hot folder stopped")
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def _items(self, watcher: PollingWatcher) -> Iterator[BatchItem]:
+        while not self.stop_event.is_set():
+            for folder in self.folders:
+                if self.stop_event.is_set():
+                    break
+                try:
+                    yield from self._scan(folder)
+                except Exception as e:
+                    self.logger.error(f"Scanning {folder.path} failed: {str(e)}")
+            watcher.wait(self.stop_event)
+
+    def _scan(self, folder: WatchedFolder) -> Iterator[BatchItem]:
+        with self._lock:
+            in_flight = set(self._in_flight)
+        candidates = [
+            path for path in sorted(folder.path.iterdir())
+            if path.is_file() and not path.name.startswith(".") and str(path) not in in_flight
+            and path.suffix.lower() in IMAGE_SUFFIXES | {PDF_SUFFIX}
+        ]
+        stable = {path for path in candidates if self._stable(path)}
+        # Forget files that were moved away or deleted
+        for path in [p for p in self._observed if p.parent == folder.path and p not in candidates]:
+            del self._observed[path]
+
+        # Pages of one student wait until every page has finished writing
+        students = defaultdict(list)
+        for path in candidates:
+            if path.suffix.lower() in IMAGE_SUFFIXES:
+                students[student_and_page(path.name)[0]].append(path)
+        for paths in students.values():
+            if all(path in stable for path in paths):
+                yield from self._start_job(folder, paths)
+        for path in candidates:
+            if path.suffix.lower() == PDF_SUFFIX and path in stable:
+                yield from self._start_job(folder, [path])
+
+    def _stable(self, path: Path) -> bool:
+        """True once a file's size and mtime have stayed the same for the settle time"""
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return False
+        signature = (stat.st_size, stat.st_mtime_ns)
+        now = time.monotonic()
+        observed = self._observed.get(path)
+        if observed is None or observed[0] != signature:
+            self._observed[path] = (signature, now)
+            return False
+        return stat.st_size > 0 and now - observed[1] >= self.settings.hot_folder_settle_seconds
+
+    def _start_job(self, folder: WatchedFolder, paths: List[Path]) -> Iterator[BatchItem]:
+        """Record the files as started and yield their submissions"""
+        ledger = self.ledgers[folder.path]
+        sources = [ImageSource.from_path(path) for path in paths]
+        hashes = [source.content_hash for source in sources]
+        entries = [ledger.get(file_hash) for file_hash in hashes]
+
+        # Finished before a restart, but never moved
+        if all(entry and entry['status'] in OUTCOME_FOLDERS for entry in entries):
+            for source in sources:
+                source.release()
+            for path, entry in zip(paths, entries):
+                self.logger.info(f"{path.name} was already processed; moving it to {entry['status']}/")
+                self._move(path, entry['status'])
+            return
+
+        resumed = next((entry for entry in entries if entry and entry['status'] == 'started'), None)
+        batch_id = resumed['batch_id'] if resumed else \
+            f"hotfolder-{folder.assignment_id}-{date.today().isoformat()}"
+        job = _Job(folder, paths, hashes, batch_id)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._in_flight.update(str(path) for path in paths)
+        for path, file_hash, entry in zip(paths, hashes, entries):
+            if not entry or entry['status'] != 'started':
+                ledger.record(file_hash, path.name, 'started', batch_id=batch_id)
+        self.logger.info(f"{'Resuming' if resumed else 'Picked up'} {', '.join(path.name for path in paths)}")
+
+        try:
+            if paths[0].suffix.lower() == PDF_SUFFIX:
+                sources[0].release()  # The render workers read the file themselves
+                groups = pdf_submissions(str(paths[0]), paths[0].name,
+                                         pages_per_student=self.pages_per_student)
+            else:
+                groups = group_pages(sources)
+            for student_id, pages in groups:
+                if resumed:
+                    # A crash may have left these running; take them over
+                    self.pipeline.release_interrupted(folder.assignment_id, student_id, pages, batch_id)
+                with self._lock:
+                    job.outstanding += 1
+                yield BatchItem(student_id, pages[0], more_pages=tuple(pages[1:]),
+                                assignment_id=folder.assignment_id, batch_id=batch_id, source=job.id)
+        except Exception as e:
+            self.logger.error(f"Reading {paths[0].name} failed: {str(e)}")
+            with self._lock:
+                job.errors.append(str(e))
+        with self._lock:
+            job.fed_all = True
+            done = job.outstanding == 0
+        if done:
+            self._finalize(job)
+
+    def _finish_item(self, event: Dict) -> None:
+        with self._lock:
+            job = self.jobs.get(event['source'])
+            if job is None:
+                return
+            job.outstanding -= 1
+            if event['error'] or not event['result']:
+                job.errors.append(f"{event['student_id']}: {event['error'] or 'processing failed'}")
+            else:
+                job.submissions.append(event['result']['submission_id'])
+            done = job.fed_all and job.outstanding == 0
+        if done:
+            self._finalize(job)
+
+    def _finalize(self, job: _Job) -> None:
+        """Record the outcome, then move the files to done/ or failed/"""
+        with self._lock:
+            if job.finalized:
+                return
+            job.finalized = True
+        outcome = "failed" if job.errors else "done"
+        ledger = self.ledgers[job.folder.path]
+        for path, file_hash in zip(job.paths, job.hashes):
+            ledger.record(file_hash, path.name, outcome, batch_id=job.batch_id,
+                          submissions=job.submissions, errors=job.errors)
+            self._move(path, outcome)
+        with self._lock:
+            self.jobs.pop(job.id, None)
+            self._in_flight.difference_update(str(path) for path in job.paths)
+        self.logger.info(f"{', '.join(path.name for path in job.paths)}: {outcome} "
+                         f"({len(job.submissions)} submission(s), {len(job.errors)} error(s))")
+
+    def _move(self, path: Path, outcome: str) -> None:
+        target = path.parent / outcome / path.name
+        if target.exists():
+            target = target.with_name(f"{path.stem}_{datetime.now().strftime('%Y%m%d-%H%M%S')}{path.suffix}")
+        try:
+            os.replace(path, target)
+        except OSError as e:
+            # The ledger already has the outcome; the next scan moves it instead
+            self.logger.error(f"Could not move {path.name} to {outcome}/: {str(e)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Grade scans dropped into watched folders")
+    parser.add_argument("--watch", action="append", default=[], metavar="PATH=ASSIGNMENT_ID",
+                        help="Folder to watch and the assignment its files belong to (repeatable; "
+                             "defaults to HOT_FOLDERS)")
+    parser.add_argument("--workers", type=int, default=None, help="Defaults to PIPELINE_WORKERS")
+    parser.add_argument("--pages-per-student", type=int, default=None,
+                        help="Split PDFs every N pages instead of at separator pages")
+    parser.add_argument("--poll", action="store_true", help="Don't use inotify, only rescan periodically")
+    args = parser.parse_args()
+
+    settings = get_settings()
+    folders = parse_folders(args.watch or [settings.hot_folders])
+    if not folders:
+        parser.error("No folders to watch: pass --watch or set HOT_FOLDERS")
+    for folder in folders:
+        if not folder.path.is_dir():
+            parser.error(f"{folder.path} is not a directory")
+
+    daemon = HotFolderDaemon(folders, max_workers=args.workers,
+                             pages_per_student=args.pages_per_student, polling=args.poll)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: daemon.stop())
+    daemon.run()
+
+if __name__ == "__main__":
+    main()
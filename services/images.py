@@ -0,0 +1,256 @@
+# services/images.py
+import hashlib
+import io
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+from pydantic import BaseModel, Field
+
+from config.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (240, 240)
+ANALYSIS_SIZE = (512, 512)        # Quality metrics are computed at this size so thresholds don't depend on resolution
+LINE_PROFILE_RATIO = 2.0          # Ink rows vs columns contrast that marks the direction of text lines
+MARGIN_RATIO = 1.3                # Ink imbalance that says which way up a page is
+
+class QualityReport(BaseModel):
+    """Local checks on a page photo, run before it is sent to the vision model"""
+    blur_score: float = 0.0       # Variance of the Laplacian; low means blurry
+    ink_coverage: float = 0.0     # Fraction of the page that is darker than the paper
+    rotation: int = 0             # Degrees (counter-clockwise) that turn the page upright
+    perceptual_hash: Optional[str] = None
+    exif_orientation: int = 1     # Camera orientation tag; anything but 1 needs applying before OCR
+    issues: List[str] = Field(default_factory=list)   # Reasons the image shouldn't reach OCR
+    warnings: List[str] = Field(default_factory=list) # Worth a look, but the image still goes to OCR
+
+class ImagePreview(BaseModel):
+    """Small decoded preview of an uploaded image plus pre-processing warnings"""
+    file_hash: str
+    thumbnail: bytes
+    width: int = 0
+    height: int = 0
+    quality: Optional[QualityReport] = None
+    flags: List[str] = Field(default_factory=list)
+
+def content_hash(data) -> str:
+    """SHA-256 of the raw file bytes, used as the cache/identity key for an image"""
+    return hashlib.sha256(data).hexdigest()
+
+def laplacian_variance(gray: np.ndarray) -> float:
+    """Focus measure: sharp strokes give strong second derivatives, blur flattens them"""
+    laplacian = (gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1]
+                 - 4 * gray[1:-1, 1:-1])
+    return float(laplacian.var())
+
+def ink_mask(gray: np.ndarray) -> np.ndarray:
+    """Pixels clearly darker than the paper, judged against the page's own brightness"""
+    paper = np.percentile(gray, 90)
+    return gray < paper * 0.6
+
+def detect_rotation(mask: np.ndarray) -> int:
+    """
+    Degrees to rotate a page (counter-clockwise) so its text runs left to right.
+    Handwritten lines make the row profile of the ink far more uneven than the
+    column profile; lines all start at the left margin, so that side holds more ink.
+    """
+    if not mask.any():
+        return 0
+    rows = mask.sum(axis=1).astype(np.float64)
+    cols = mask.sum(axis=0).astype(np.float64)
+    spread = lambda profile: profile.var() / max(profile.mean(), 1e-6) ** 2
+    height, width = mask.shape
+    top, bottom = mask[:height // 2].sum(), mask[height // 2:].sum()
+    left, right = mask[:, :width // 2].sum(), mask[:, width // 2:].sum()
+
+    if spread(cols) > spread(rows) * LINE_PROFILE_RATIO:
+        # Lines run vertically; the margin side is where they start
+        return 90 if top > bottom else -90
+    if spread(rows) > spread(cols) * LINE_PROFILE_RATIO and \
+            right > left * MARGIN_RATIO and bottom > top * MARGIN_RATIO:
+        return 180
+    return 0
+
+def perceptual_hash(gray: np.ndarray, hash_size: int = 8) -> str:
+    """64-bit DCT hash: survives re-encoding, resizing and lighting changes"""
+    size = hash_size * 4
+    small = np.asarray(
+        Image.fromarray(gray.astype(np.uint8)).resize((size, size), Image.Resampling.LANCZOS),
+        dtype=np.float64
+    )
+    k = np.arange(size)
+    basis = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * size))
+    low = (basis @ small @ basis.T)[:hash_size, :hash_size].flatten()
+    bits = low > np.median(low[1:])
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):0{hash_size * hash_size // 4}x}"
+
+def hash_distance(a: str, b: str) -> int:
+    """Number of differing bits between two hex hashes"""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def assess_quality(image: Image.Image) -> QualityReport:
+    """Blur, ink coverage, orientation and perceptual hash of an (EXIF-upright) image"""
+    settings = get_settings()
+    analysis = image.convert("L")
+    analysis.thumbnail(ANALYSIS_SIZE)
+    gray = np.asarray(analysis, dtype=np.float32)
+    mask = ink_mask(gray)
+
+    report = QualityReport(
+        blur_score=round(laplacian_variance(gray), 1),
+        ink_coverage=round(float(mask.mean()), 4),
+        rotation=detect_rotation(mask),
+        perceptual_hash=perceptual_hash(gray)
+    )
+    if report.ink_coverage < settings.min_ink_coverage:
+        report.issues.append("Looks blank")
+    elif report.blur_score < settings.blur_threshold:
+        report.issues.append("Too blurry to read")
+    return report
+
+def check_image(fileobj) -> QualityReport:
+    """Quality report for an encoded image, decoding only as much as the checks need"""
+    try:
+        image = Image.open(fileobj)
+        orientation = image.getexif().get(0x0112, 1)
+        image.draft("L", (ANALYSIS_SIZE[0] * 2, ANALYSIS_SIZE[1] * 2))
+        report = assess_quality(ImageOps.exif_transpose(image))
+        report.exif_orientation = orientation or 1
+        return report
+    except Exception as e:
+        logger.error(f"Image check failed: {str(e)}")
+        return QualityReport(issues=["Could not decode image"])
+
+def upright_jpeg(fileobj, rotation: int) -> bytes:
+    """Full-size JPEG with the orientation tag applied and the page turned upright"""
+    image = ImageOps.exif_transpose(Image.open(fileobj)).convert("RGB")
+    if rotation:
+        image = image.rotate(rotation, expand=True)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+class BatchHashes:
+    """
+    Pages seen per batch, to catch the same page submitted twice. Only an
+    identical file is certainly a duplicate: on a printed worksheet the
+    perceptual hash mostly encodes the template, so different students'
+    pages can hash within a few bits of each other.
+    """
+    def __init__(self, max_batches: int = 16):
+        self.max_batches = max_batches
+        self._batches: "OrderedDict[str, List[Tuple[str, Optional[str], str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, batch_id: Optional[str], file_hash: str, phash: Optional[str],
+              owner: str) -> Optional[Tuple[str, bool]]:
+        """
+        (earlier owner, identical) for a matching page in the batch, or None
+        (and remember this one). Identical means the same file bytes; otherwise
+        the perceptual hashes are within DUPLICATE_HASH_DISTANCE.
+        """
+        if not batch_id:
+            return None
+        max_distance = get_settings().duplicate_hash_distance
+        with self._lock:
+            seen = self._batches.setdefault(batch_id, [])
+            self._batches.move_to_end(batch_id)
+            while len(self._batches) > self.max_batches:
+                self._batches.popitem(last=False)
+            similar = None
+            for other_file_hash, other_phash, other_owner in seen:
+                if other_owner == owner:
+                    continue
+                if other_file_hash == file_hash:
+                    return other_owner, True
+                if similar is None and phash and other_phash and hash_distance(phash, other_phash) <= max_distance:
+                    similar = other_owner
+            seen.append((file_hash, phash, owner))
+            return (similar, False) if similar else None
+
+def build_preview(data, file_hash: Optional[str] = None,
+                  size: Tuple[int, int] = THUMBNAIL_SIZE) -> ImagePreview:
+    """Decode an image to a thumbnail and flag blank, blurry or rotated pages"""
+    file_hash = file_hash or content_hash(data)
+    flags = []
+    try:
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+
+        # Let the JPEG decoder downscale while decoding - much cheaper than a full decode
+        image.draft("RGB", (ANALYSIS_SIZE[0] * 2, ANALYSIS_SIZE[1] * 2))
+
+        orientation = image.getexif().get(0x0112, 1)
+        if orientation not in (1, None):
+            flags.append("Rotated (camera orientation tag)")
+            image = ImageOps.exif_transpose(image)
+            if orientation in (5, 6, 7, 8):
+                width, height = height, width
+
+        image = image.convert("RGB")
+        quality = assess_quality(image)
+        flags.extend(quality.issues)
+        if quality.rotation:
+            turned = "Upside down" if quality.rotation == 180 else "Sideways"
+            flags.append(f"{turned} - will be turned upright before OCR")
+            image = image.rotate(quality.rotation, expand=True)
+        image.thumbnail(size)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=80)
+        return ImagePreview(
+            file_hash=file_hash,
+            thumbnail=buffer.getvalue(),
+            width=width,
+            height=height,
+            quality=quality,
+            flags=flags
+        )
+    except Exception as e:
+        logger.error(f"Preview generation failed: {str(e)}")
+        return ImagePreview(
+            file_hash=file_hash,
+            thumbnail=b"",
+            flags=["Could not decode image"]
+        )
+
+def build_previews(images: Dict[str, bytes], max_workers: int = 4) -> Dict[str, ImagePreview]:
+    """Build previews for {file_hash: data} in a thread pool (PIL releases the GIL while decoding)"""
+    if not images:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            file_hash: executor.submit(build_preview, data, file_hash)
+            for file_hash, data in images.items()
+        }
+        return {file_hash: future.result() for file_hash, future in futures.items()}
+
+def find_duplicates(named_previews: List[Tuple[str, ImagePreview]]) -> Dict[str, Tuple[str, bool]]:
+    """
+    Map each file name that matches an earlier one to (earlier name, identical).
+    Identical files are certain duplicates; perceptually similar ones may just
+    be the same printed worksheet.
+    """
+    max_distance = get_settings().duplicate_hash_distance
+    duplicates = {}
+    seen: List[Tuple[str, ImagePreview]] = []
+    for name, preview in named_previews:
+        phash = preview.quality.perceptual_hash if preview.quality else None
+        identical = next((other_name for other_name, other in seen if other.file_hash == preview.file_hash), None)
+        if identical:
+            duplicates[name] = (identical, True)
+            continue
+        for other_name, other in seen:
+            other_hash = other.quality.perceptual_hash if other.quality else None
+            if phash and other_hash and "Looks blank" not in preview.flags and \
+                    hash_distance(phash, other_hash) <= max_distance:
+                duplicates[name] = (other_name, False)
+                break
+        seen.append((name, preview))
+    return duplicates
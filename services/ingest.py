@@ -0,0 +1,173 @@
+# services/ingest.py
+import binascii
+import io
+import mmap
+import mimetypes
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+
+from services.images import content_hash
+
+# Encode base64 in chunks that are a multiple of 3 bytes so they concatenate cleanly
+_B64_CHUNK = 3 * 256 * 1024
+
+class _MemoryReader(io.RawIOBase):
+    """Read-only raw stream over a memoryview, so uploads stream without copying the image"""
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        # Lets HTTP clients size the body up front instead of chunking it
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), len(self._view) - self._pos)
+        buffer[:size] = self._view[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+class ImageSource:
+    """
+    In-memory image for a single submission.
+
+    Wraps an existing buffer (an UploadedFile, bytes, or a memory-mapped
+    private temp file) so the same bytes flow through upload, preprocessing
+    and OCR without being written to a shared directory or copied.
+    """
+    def __init__(self, name: str, data: Union[bytes, bytearray, memoryview, mmap.mmap, None],
+                 content_type: Optional[str] = None,
+                 storage_path: Optional[str] = None,
+                 loader: Optional[Callable[[], bytes]] = None):
+        self.name = Path(name).name
+        self._data = data
+        self._view: Optional[memoryview] = memoryview(data) if data is not None else None
+        self._hash: Optional[str] = None
+        self._identity: Optional[str] = None
+        self._loader = loader
+        self._release_callbacks: List[Callable[[], None]] = []
+        self.storage_path = storage_path  # Set when the image is already in the bucket
+        self.content_type = content_type or mimetypes.guess_type(self.name)[0] or "image/jpeg"
+
+    @classmethod
+    def from_uploaded_file(cls, uploaded_file, file_hash: Optional[str] = None) -> "ImageSource":
+        """Wrap a Streamlit UploadedFile without copying its buffer"""
+        source = cls(uploaded_file.name, uploaded_file.getbuffer(), uploaded_file.type)
+        source._hash = file_hash
+        return source
+
+    @classmethod
+    def from_file(cls, fileobj, name: str, content_type: Optional[str] = None) -> "ImageSource":
+        """
+        Wrap a binary file object. BytesIO buffers are shared; real files
+        (including spooled temp files that rolled over to disk) are memory-mapped.
+        """
+        if isinstance(fileobj, io.BytesIO):
+            return cls(name, fileobj.getbuffer(), content_type)
+        rolled = getattr(fileobj, "_file", fileobj)
+        if isinstance(rolled, io.BytesIO):
+            return cls(name, rolled.getbuffer(), content_type)
+        fileobj.flush()
+        return cls(name, mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ), content_type)
+
+    @classmethod
+    def from_storage(cls, name: str, storage_path: str, loader: Callable[[], bytes],
+                     content_type: Optional[str] = None,
+                     file_hash: Optional[str] = None) -> "ImageSource":
+        """Image that was uploaded straight to the bucket; bytes are fetched on first use"""
+        source = cls(name, None, content_type, storage_path=storage_path, loader=loader)
+        source._hash = file_hash
+        if file_hash is None:
+            # Known without a download; the hash comes with the single fetch OCR makes
+            source._identity = f"storage:{storage_path}"
+        return source
+
+    @classmethod
+    def from_path(cls, path: Union[str, Path]) -> "ImageSource":
+        """Memory-map an image on disk"""
+        with open(path, "rb") as f:
+            return cls(str(path), mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def getbuffer(self) -> memoryview:
+        """Zero-copy view of the image bytes"""
+        if self._view is None and self._loader is not None:
+            self._data = self._loader()
+            self._view = memoryview(self._data)
+            self._loader = None
+        if self._view is None:
+            raise ValueError(f"Image buffer for {self.name} has been released")
+        return self._view
+
+    @property
+    def size(self) -> int:
+        return len(self._view) if self._view is not None else 0
+
+    @property
+    def content_hash(self) -> str:
+        if self._hash is None:
+            self._hash = content_hash(self.getbuffer())
+        return self._hash
+
+    @property
+    def identity(self) -> str:
+        """
+        Key for batch, idempotency and speculative lookups. The content hash,
+        except for bucket objects given without one, which are keyed on their
+        server-issued path so that nothing is downloaded just to name them.
+        """
+        return self._identity or self.content_hash
+
+    def open(self) -> io.BufferedReader:
+        """Binary stream over the image for HTTP uploads"""
+        return io.BufferedReader(_MemoryReader(self.getbuffer()))
+
+    def on_release(self, callback: Callable[[], None]) -> None:
+        """Run `callback` once, when the image bytes are released"""
+        self._release_callbacks.append(callback)
+
+    def release(self) -> None:
+        """Drop this source's reference to the image bytes"""
+        if self._view is not None:
+            self.content_hash  # keep the identity after the bytes are gone
+            self._view.release()
+            self._view = None
+        self._loader = None
+        if isinstance(self._data, mmap.mmap):
+            try:
+                self._data.close()
+            except BufferError:
+                pass  # An in-flight upload still holds a view; the map closes when it is dropped
+        self._data = None
+        callbacks, self._release_callbacks = self._release_callbacks, []
+        for callback in callbacks:
+            callback()
+
+def encode_data_url(source: ImageSource) -> str:
+    """
+    Build a base64 data URL for a vision request.
+    Encodes straight into one preallocated buffer instead of making a
+    base64 copy and then an f-string copy of it.
+    """
+    view = source.getbuffer()
+    prefix = f"data:{source.content_type};base64,".encode("ascii")
+    encoded_size = 4 * ((len(view) + 2) // 3)
+
+    out = bytearray(len(prefix) + encoded_size)
+    out[:len(prefix)] = prefix
+    pos = len(prefix)
+    for start in range(0, len(view), _B64_CHUNK):
+        chunk = binascii.b2a_base64(view[start:start + _B64_CHUNK], newline=False)
+        out[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+    return out.decode("ascii")
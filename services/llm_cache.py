@@ -0,0 +1,303 @@
+# services/llm_cache.py
+import hashlib
+import importlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from config.settings import get_settings
+from services.metrics import REGISTRY, gauge
+from services.tracing import set_attribute
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different transcripts share an entry"""
+    return re.sub(r"\s+", " ", (text or "")).strip()
+
+class CacheBackend:
+    """Storage interface for cached completions; subclass to plug in another store"""
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str,
+            assignment_id: Optional[str] = None,
+            rubric_hash: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def invalidate(self, assignment_id: Optional[str] = None,
+                   rubric_hash: Optional[str] = None) -> int:
+        """Drop entries for an assignment and/or rubric; returns the number removed"""
+        raise NotImplementedError
+
+    def size(self) -> Dict[str, int]:
+        """{'entries': n, 'bytes': n}"""
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+class SQLiteCacheBackend(CacheBackend):
+    """On-disk cache with size-based LRU eviction"""
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                assignment_id TEXT,
+                rubric_hash TEXT,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_lru ON completions (last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_assignment ON completions (assignment_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_rubric ON completions (rubric_hash)")
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+            if row:
+                self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?",
+                                   (time.time(), key))
+            return row[0] if row else None
+
+    def set(self, key: str, value: str,
+            assignment_id: Optional[str] = None,
+            rubric_hash: Optional[str] = None) -> None:
+        size = len(value.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, value, size, assignment_id, rubric_hash, now, now)
+            )
+            self._total += size - (previous[0] if previous else 0)
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until under the size cap (lock held)"""
+        while self._total > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM completions ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._total -= size
+                if self._total <= self.max_bytes:
+                    break
+
+    def invalidate(self, assignment_id: Optional[str] = None,
+                   rubric_hash: Optional[str] = None) -> int:
+        clauses, params = [], []
+        if assignment_id:
+            clauses.append("assignment_id = ?")
+            params.append(str(assignment_id))
+        if rubric_hash:
+            clauses.append("rubric_hash = ?")
+            params.append(rubric_hash)
+        if not clauses:
+            return 0
+        where = " OR ".join(clauses)
+        with self._lock:
+            freed = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions WHERE {where}", params
+            ).fetchone()
+            self._conn.execute(f"DELETE FROM completions WHERE {where}", params)
+            self._total -= freed[1]
+            return freed[0]
+
+    def size(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            return {'entries': entries, 'bytes': self._total}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+            self._total = 0
+
+class MemoryCacheBackend(CacheBackend):
+    """Process-local LRU cache, for tests and benchmarks"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: str,
+            assignment_id: Optional[str] = None,
+            rubric_hash: Optional[str] = None) -> None:
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            if key in self._entries:
+                self._total -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size, str(assignment_id) if assignment_id else None, rubric_hash)
+            self._total += size
+            while self._total > self.max_bytes and self._entries:
+                self._total -= self._entries.popitem(last=False)[1][1]
+
+    def invalidate(self, assignment_id: Optional[str] = None,
+                   rubric_hash: Optional[str] = None) -> int:
+        with self._lock:
+            doomed = [
+                key for key, (_, _, entry_assignment, entry_rubric) in self._entries.items()
+                if (assignment_id and entry_assignment == str(assignment_id)) or
+                   (rubric_hash and entry_rubric == rubric_hash)
+            ]
+            for key in doomed:
+                self._total -= self._entries.pop(key)[1]
+            return len(doomed)
+
+    def size(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._total}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._total = 0
+
+class LLMCache:
+    """
+    Cache for completions whose output is fixed by their inputs.
+
+    Keys hash (normalized text, rubric hash, model, prompt template version,
+    temperature), so editing a rubric or bumping a prompt version misses
+    naturally; `invalidate` frees the stale entries.
+    """
+    def __init__(self, backend: Optional[CacheBackend] = None, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled and backend is not None
+        self.hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text: str, rubric_hash: str, model: str,
+                 prompt_version: str, temperature: float) -> str:
+        payload = json.dumps(
+            [normalize_text(text), rubric_hash, model, prompt_version, float(temperature)]
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_or_create(self, key: str, create: Callable[[], str],
+                      assignment_id: Optional[str] = None,
+                      rubric_hash: Optional[str] = None) -> str:
+        """Return the cached completion for `key`, calling `create` on a miss"""
+        if not self.enabled:
+            return create()
+
+        started = time.perf_counter()
+        try:
+            cached = self.backend.get(key)
+        except Exception as e:
+            logger.error(f"LLM cache read failed: {str(e)}")
+            cached = None
+
+        set_attribute("llm_cache.hit", cached is not None)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+                self.hit_seconds += time.perf_counter() - started
+            return cached
+
+        with self._lock:
+            self.misses += 1
+        value = create()
+        try:
+            self.backend.set(key, value,
+                             assignment_id=str(assignment_id) if assignment_id else None,
+                             rubric_hash=rubric_hash)
+        except Exception as e:
+            logger.error(f"LLM cache write failed: {str(e)}")
+        return value
+
+    def invalidate(self, assignment_id: Optional[str] = None,
+                   rubric_hash: Optional[str] = None) -> int:
+        """Forget completions for an assignment whose rubric changed"""
+        if not self.enabled:
+            return 0
+        removed = self.backend.invalidate(assignment_id=assignment_id, rubric_hash=rubric_hash)
+        logger.info(f"Invalidated {removed} cached completions")
+        return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'avg_hit_ms': 1000 * self.hit_seconds / self.hits if self.hits else 0.0
+            }
+        if self.enabled:
+            stats.update(self.backend.size())
+        return stats
+
+def _load_backend(name: str, path: str, max_bytes: int) -> CacheBackend:
+    """Resolve LLM_CACHE_BACKEND: 'sqlite', 'memory' or 'package.module:ClassName'"""
+    if name == "sqlite":
+        return SQLiteCacheBackend(path, max_bytes)
+    if name == "memory":
+        return MemoryCacheBackend(max_bytes)
+    module_name, _, class_name = name.partition(":")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class(path=path, max_bytes=max_bytes)
+
+def _publish_metrics(cache: LLMCache) -> None:
+    """Report the cache's stats alongside the pipeline metrics"""
+    lookups = gauge("grader_llm_cache_lookups", "LLM cache lookups since start", ["result"])
+    held = gauge("grader_llm_cache_size", "Completions held by the LLM cache", ["unit"])
+
+    def collect():
+        stats = cache.stats()
+        lookups.set(stats['hits'], result="hit")
+        lookups.set(stats['misses'], result="miss")
+        held.set(stats.get('entries', 0), unit="entries")
+        held.set(stats.get('bytes', 0), unit="bytes")
+
+    REGISTRY.on_collect(collect)
+
+@lru_cache()
+def get_llm_cache() -> LLMCache:
+    """Process-wide completion cache configured from settings"""
+    settings = get_settings()
+    cache = LLMCache(enabled=False)
+    if settings.llm_cache_enabled:
+        try:
+            backend = _load_backend(
+                settings.llm_cache_backend,
+                settings.llm_cache_path,
+                settings.llm_cache_max_mb * 1024 * 1024
+            )
+            cache = LLMCache(backend)
+        except Exception as e:
+            logger.error(f"LLM cache unavailable, continuing without it: {str(e)}")
+    _publish_metrics(cache)
+    return cache
@@ -0,0 +1,363 @@
+# services/metrics.py
+"""
+Process-wide pipeline metrics with Prometheus text export.
+
+Counters and histograms are kept in memory per process; `render_prometheus`
+produces the text exposition format, served by `start_metrics_server` and
+shown on the admin page.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# USD per million tokens: (input, cached input, output). Matched by model prefix.
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        unknown = set(labels) - set(self.labelnames)
+        if unknown:
+            raise ValueError(f"Unknown labels for {self.name}: {sorted(unknown)}")
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _matches(self, key: Tuple[str, ...], labels: Dict) -> bool:
+        """True if a series has every label in `labels` (others are aggregated over)"""
+        return all(key[self.labelnames.index(name)] == str(value) for name, value in labels.items())
+
+    def _keys(self) -> List[Tuple[str, ...]]:
+        raise NotImplementedError
+
+    def label_values(self, labelname: str, **labels) -> List[str]:
+        """Distinct values of one label among series matching `labels`"""
+        index = self.labelnames.index(labelname)
+        with self._lock:
+            keys = self._keys()
+        return sorted({key[index] for key in keys if self._matches(key, labels)})
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _keys(self):
+        return list(self._values)
+
+    def value(self, **labels) -> float:
+        """Sum over every series matching the given labels"""
+        with self._lock:
+            return sum(v for key, v in self._values.items() if self._matches(key, labels))
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value)
+                    for key, value in sorted(self._values.items())]
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block, labelled outcome=ok|error"""
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            self.observe(time.perf_counter() - started, outcome=outcome, **labels)
+
+    def _keys(self):
+        return list(self._series)
+
+    def _merged(self, labels: Dict) -> List[float]:
+        merged = [0.0] * (len(self.buckets) + 2)
+        with self._lock:
+            for key, series in self._series.items():
+                if self._matches(key, labels):
+                    merged = [a + b for a, b in zip(merged, series)]
+        return merged
+
+    def count(self, **labels) -> int:
+        return int(sum(self._merged(labels)[:-1]))
+
+    def sum(self, **labels) -> float:
+        return self._merged(labels)[-1]
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Estimate a quantile by interpolating inside buckets, as histogram_quantile does"""
+        merged = self._merged(labels)
+        total = sum(merged[:-1])
+        if not total:
+            return None
+        rank = q * total
+        seen = 0.0
+        for i, bucket_count in enumerate(merged[:-1]):
+            if seen + bucket_count >= rank and bucket_count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]  # beyond the largest bucket
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0.0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append((f"{self.name}_bucket", {**labels, 'le': le}, cumulative))
+            samples.append((f"{self.name}_sum", labels, series[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def on_collect(self, callback: Callable[[], None]) -> None:
+        """Run `callback` before each export, e.g. to refresh gauges from another object"""
+        with self._lock:
+            self._collectors.append(callback)
+
+    def collect(self) -> List[_Metric]:
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics.values())
+        for callback in collectors:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {str(e)}")
+        return metrics
+
+REGISTRY = MetricsRegistry()
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+# Pipeline
+STAGE_SECONDS = histogram(
+    "grader_stage_duration_seconds", "Time spent in each pipeline stage",
+    ["stage", "outcome"]
+)
+SUBMISSIONS = counter(
+    "grader_submissions_total", "Submissions finished by the pipeline",
+    ["outcome"]
+)
+
+# OpenAI - one observation per HTTP attempt, so retries show up separately
+LLM_REQUEST_SECONDS = histogram(
+    "grader_llm_request_duration_seconds", "OpenAI request latency per attempt",
+    ["service", "model", "status"]
+)
+LLM_RETRIES = counter(
+    "grader_llm_retries_total", "OpenAI requests that were retries of an earlier attempt",
+    ["service"]
+)
+LLM_ERRORS = counter(
+    "grader_llm_errors_total", "OpenAI requests that failed without a response",
+    ["service"]
+)
+LLM_TOKENS = counter(
+    "grader_llm_tokens_total", "Tokens reported by response.usage; kind is input, cached or output",
+    ["service", "model", "kind"]
+)
+LLM_COST = counter(
+    "grader_llm_cost_usd_total", "Estimated OpenAI spend from token usage and MODEL_PRICES",
+    ["service", "model"]
+)
+
+# Adaptive OCR detail - per assignment, since handwriting quality varies by class
+OCR_ATTEMPTS = counter(
+    "grader_ocr_attempts_total", "OCR requests per detail level; outcome is accepted or escalated",
+    ["assignment_id", "detail", "outcome"]
+)
+OCR_IMAGE_TOKENS = counter(
+    "grader_ocr_image_tokens_total",
+    "Image input tokens; kind is spent, or baseline for reading every page once at high detail",
+    ["assignment_id", "kind"]
+)
+
+# Model cascades - one observation per model asked
+CASCADE_ATTEMPTS = counter(
+    "grader_cascade_attempts_total", "Answers per stage and model; outcome is accepted or escalated",
+    ["stage", "model", "outcome"]
+)
+CASCADE_SECONDS = histogram(
+    "grader_cascade_answer_seconds", "Time for one model in a cascade to answer, retries included",
+    ["stage", "model"]
+)
+
+# Supabase - one observation per round trip
+DB_SECONDS = histogram(
+    "grader_db_request_duration_seconds", "Supabase round trip latency",
+    ["target", "operation", "outcome"]
+)
+
+def track_db(target: str, operation: str):
+    """Time one Supabase round trip: `target` is a table name or 'storage'"""
+    return DB_SECONDS.time(target=target, operation=operation)
+
+def model_price(model: str) -> Optional[Tuple[float, float, float]]:
+    """Price row for a model name like 'gpt-4o-2024-08-06' (longest prefix wins)"""
+    for prefix in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(prefix):
+            return MODEL_PRICES[prefix]
+    return None
+
+def record_usage(service: str, model: str, usage: Dict) -> None:
+    """Count tokens and cost from a chat completion's `usage` object"""
+    input_tokens = usage.get('prompt_tokens') or 0
+    output_tokens = usage.get('completion_tokens') or 0
+    cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+
+    LLM_TOKENS.inc(input_tokens, service=service, model=model, kind="input")
+    LLM_TOKENS.inc(cached_tokens, service=service, model=model, kind="cached")
+    LLM_TOKENS.inc(output_tokens, service=service, model=model, kind="output")
+
+    price = model_price(model)
+    if price:
+        input_price, cached_price, output_price = price
+        cost = ((input_tokens - cached_tokens) * input_price
+                + cached_tokens * cached_price
+                + output_tokens * output_price) / 1_000_000
+        LLM_COST.inc(cost, service=service, model=model)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def render_prometheus(metrics: Optional[Iterable[_Metric]] = None) -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for metric in (metrics if metrics is not None else REGISTRY.collect()):
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value!r}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(host: Optional[str] = None, port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve /metrics on a background thread. Safe to call repeatedly; only the
+    first call starts a server. Does nothing when METRICS_PORT is 0.
+    """
+    global _server
+    settings = get_settings()
+    host = host or settings.metrics_host
+    port = settings.metrics_port if port is None else port
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                # Usually another app process already serves metrics on this port
+                logger.error(f"Metrics endpoint not started on {host}:{port}: {str(e)}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+            logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return _server
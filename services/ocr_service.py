@@ -1,29 +1,205 @@
 # services/ocr_service.py
+import io
 import logging
 import json
-import base64
-from openai import OpenAI
+import math
+import re
+import statistics
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Union
+from PIL import Image
+from services.openai_client import create_openai_client
 from config.settings import get_settings
+from services.ingest import ImageSource, encode_data_url
+from services.metrics import OCR_ATTEMPTS, OCR_IMAGE_TOKENS
+from services.tracing import set_attribute, traced
+
+# Escalation order for adaptive detail; "tiles" is the page plus full-resolution strips
+DETAIL_LEVELS = ("low", "high", "tiles")
+
+UNCLEAR_MARKER = re.compile(r"\[unclear[^\]]*\]", re.IGNORECASE)
+# Confidence lost per unit share of [unclear] words: 5% unclear costs 0.2
+UNCLEAR_PENALTY = 4.0
+# Transcripts kept per assignment to learn how long a typical answer is
+LENGTH_HISTORY = 50
+MIN_LENGTH_SAMPLES = 5
+STRIP_OVERLAP = 0.15
+
+def image_tokens(width: int, height: int, detail: str) -> int:
+    """Input tokens the vision API bills for one image at a detail level"""
+    if detail == "low":
+        return 85
+    # High detail: fit in 2048x2048, shortest side down to 768, then 170 per 512px tile
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 170 * math.ceil(width / 512) * math.ceil(height / 512) + 85
+
+def transcript_confidence(result: Optional[Dict], expected_chars: Optional[float] = None) -> float:
+    """
+    0-1 score for an OCR result: valid JSON with a transcript, few [unclear]
+    markers, and not much shorter than answers to the same assignment usually are.
+    """
+    if not isinstance(result, dict) or not isinstance(result.get('student_response'), str):
+        return 0.0
+    text = result['student_response'].strip()
+    if not text:
+        return 0.0
+    words = max(1, len(UNCLEAR_MARKER.sub(" x ", text).split()))
+    confidence = max(0.0, 1.0 - UNCLEAR_PENALTY * len(UNCLEAR_MARKER.findall(text)) / words)
+    if expected_chars and len(text) < expected_chars:
+        confidence *= len(text) / expected_chars
+    if not isinstance(result.get('rubric_points'), dict):
+        confidence *= 0.5
+    return round(confidence, 3)
+
+def strip_boxes(height: int, count: int) -> List[Tuple[int, int]]:
+    """Top and bottom rows of `count` overlapping horizontal strips of a page"""
+    step = height / count
+    overlap = int(step * STRIP_OVERLAP)
+    return [(max(0, int(i * step) - overlap), min(height, int((i + 1) * step) + overlap))
+            for i in range(count)]
+
+def page_strips(image: ImageSource, count: int) -> List[ImageSource]:
+    """Overlapping horizontal strips of a page, top to bottom"""
+    page = Image.open(image.open())
+    width, height = page.size
+    strips = []
+    for i, (top, bottom) in enumerate(strip_boxes(height, count)):
+        buffer = io.BytesIO()
+        page.crop((0, top, width, bottom)).convert("RGB").save(buffer, format="JPEG", quality=90)
+        strips.append(ImageSource(f"{image.name}#strip{i + 1}", buffer.getvalue(), "image/jpeg"))
+    return strips
+
+def level_tokens(sizes: List[Tuple[int, int]], level: str, strips: int) -> int:
+    """Image tokens one request at a detail level spends on pages of these sizes"""
+    if level == "tiles":
+        return sum(
+            image_tokens(width, height, "low") +
+            sum(image_tokens(width, bottom - top, "high") for top, bottom in strip_boxes(height, strips))
+            for width, height in sizes
+        )
+    return sum(image_tokens(width, height, "high" if level == "auto" else level) for width, height in sizes)
+
+def detail_summary(submissions: List[Dict]) -> Optional[Dict]:
+    """Escalation rate and image tokens saved across stored submissions, from their OCR results"""
+    details = [(s.get('ocr_result') or {}).get('ocr_detail') for s in submissions]
+    details = [d for d in details if d]
+    if not details:
+        return None
+    spent = sum(d['image_tokens'] for d in details)
+    baseline = sum(d['baseline_image_tokens'] for d in details)
+    return {
+        'submissions': len(details),
+        'pages': sum(d.get('pages', 1) for d in details),
+        'escalated': sum(1 for d in details if len(d['attempts']) > 1),
+        'by_detail': {level: sum(1 for d in details if d['detail'] == level) for level in DETAIL_LEVELS},
+        'image_tokens': spent,
+        'tokens_saved': baseline - spent
+    }
 
 class OCRService:
     def __init__(self):
         self.settings = get_settings()
-        self.client = OpenAI(api_key=self.settings.openai_api_key)
+        self.client = create_openai_client("ocr")
         self.logger = logging.getLogger(__name__)
-    
-    def process_image(self, image_path: str, assignment_data: dict) -> dict:
-        """Process image using GPT-4o"""
+        self._lengths: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    @traced("ocr.process_image")
+    def process_image(self, image: Union[ImageSource, List[ImageSource]], assignment_data: dict) -> dict:
+        """
+        Process a page, or all pages of a submission in one request, using GPT-4o.
+        Detail escalates while the transcript looks unreliable, skipping levels
+        that would spend more than the image token budget.
+        """
         try:
-            # Read and encode image
-            with open(image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            # Get rubric requirements from assignment data
-            rubric_structure = json.loads(assignment_data.get('rubric_structure', '{}'))
-            requirements = [req['text'] for req in rubric_structure.get('requirements', [])]
-            
-            # Create prompt matching production format
-            prompt = f"""
+            pages = image if isinstance(image, list) else [image]
+            prompt = self._prompt(assignment_data)
+            assignment_id = str(assignment_data.get('id', ''))
+            threshold = self.settings.ocr_confidence_threshold
+            expected_chars = self._expected_chars(assignment_id)
+            # Only the header is read for the size
+            sizes = [Image.open(page.open()).size for page in pages]
+            levels, over_budget = self._levels(sizes)
+            set_attribute("ocr.pages", len(pages))
+
+            best, best_confidence, best_level = None, -1.0, None
+            attempts = []
+            spent = 0
+            for level in levels:
+                result, tokens = self._attempt(pages, sizes, prompt, level)
+                spent += tokens
+                confidence = transcript_confidence(result, expected_chars)
+                attempts.append({'detail': level, 'confidence': confidence, 'image_tokens': tokens})
+                if confidence > best_confidence:
+                    best, best_confidence, best_level = result, confidence, level
+                accepted = confidence >= threshold or level == levels[-1]
+                OCR_ATTEMPTS.inc(assignment_id=assignment_id, detail=level,
+                                 outcome="accepted" if accepted else "escalated")
+                if accepted:
+                    break
+                self.logger.info(f"OCR confidence {confidence} at {level} detail; escalating")
+
+            # What one high-detail request per page would have spent
+            baseline = level_tokens(sizes, "high", self.settings.ocr_tile_strips)
+            OCR_IMAGE_TOKENS.inc(spent, assignment_id=assignment_id, kind="spent")
+            OCR_IMAGE_TOKENS.inc(baseline, assignment_id=assignment_id, kind="baseline")
+            # The level whose transcript is used, which isn't the last one when that read worse
+            set_attribute("ocr.detail", best_level)
+            set_attribute("ocr.confidence", best_confidence)
+            if best is None:
+                raise ValueError("No attempt returned a valid JSON transcript")
+
+            best['ocr_detail'] = {
+                'detail': best_level,
+                'confidence': best_confidence,
+                'attempts': attempts,
+                'pages': len(pages),
+                'image_tokens': spent,
+                'baseline_image_tokens': baseline
+            }
+            if over_budget:
+                best['ocr_detail']['over_budget'] = over_budget
+            if best_confidence >= threshold:
+                self._remember_length(assignment_id, best['student_response'])
+            self.logger.info("Successfully processed image")
+            return best
+
+        except Exception as e:
+            self.logger.error(f"Image processing failed: {str(e)}")
+            set_attribute("ocr.failed", True)
+            # Return error JSON in same format
+            return {
+                "student_response": "[OCR Error: Processing failed]",
+                "teacher_score": f"0/{assignment_data['points_possible']}",
+                "rubric_points": {},
+                "misconceptions": ["OCR processing failed"],
+                "points_earned": []
+            }
+
+    def _levels(self, sizes: List[Tuple[int, int]]) -> Tuple[Tuple[str, ...], List[str]]:
+        """Detail levels to try in order, and those left out for costing more than the budget"""
+        levels = DETAIL_LEVELS if self.settings.ocr_adaptive_detail else ("auto",)
+        budget = self.settings.ocr_image_token_budget
+        if budget <= 0:
+            return levels, []
+        # The cheapest level always runs, whatever it costs
+        within = levels[:1] + tuple(
+            level for level in levels[1:]
+            if level_tokens(sizes, level, self.settings.ocr_tile_strips) <= budget
+        )
+        return within, [level for level in levels if level not in within]
+
+    def _prompt(self, assignment_data: dict) -> str:
+        # Get rubric requirements from assignment data
+        rubric_structure = json.loads(assignment_data.get('rubric_structure', '{}'))
+        requirements = [req['text'] for req in rubric_structure.get('requirements', [])]
+
+        # Create prompt matching production format
+        return f"""
 Question: {assignment_data.get('question_text', '')}
 
 First, accurately transcribe the handwritten response from the image.
@@ -47,43 +223,66 @@ IMPORTANT:
 2. For unclear text in transcription, include [unclear]
 3. Return ONLY valid JSON with proper commas
 4. Evaluate against EACH rubric point"""
-            
-            # Make request with JSON mode
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                response_format={ "type": "json_object" },
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=1500
-            )
-            
-            # Parse response
-            result = json.loads(response.choices[0].message.content)
-            self.logger.info("Successfully processed image")
-            return result
-            
-        except Exception as e:
-            self.logger.error(f"Image processing failed: {str(e)}")
-            # Return error JSON in same format
-            return {
-                "student_response": "[OCR Error: Processing failed]",
-                "teacher_score": f"0/{assignment_data['points_possible']}",
-                "rubric_points": {},
-                "misconceptions": ["OCR processing failed"],
-                "points_earned": []
-            }
+
+    def _attempt(self, pages: List[ImageSource], sizes: List[Tuple[int, int]],
+                 prompt: str, level: str) -> Tuple[Optional[Dict], int]:
+        """One OCR request for all pages at a detail level: parsed result (None if not JSON) and image tokens"""
+        if len(pages) > 1:
+            prompt += (f"\n\nThe images are the {len(pages)} pages of one student's answer, in order. "
+                       "Transcribe them as one continuous response.")
+        if level == "tiles":
+            strips = self.settings.ocr_tile_strips
+            prompt += (f"\n\nEach page is sent whole, followed by {strips} overlapping strips of it, top "
+                       "to bottom, at full resolution. Use the strips to read small or faint writing, and "
+                       "don't repeat lines that appear in two strips.")
+        tokens = level_tokens(sizes, level, self.settings.ocr_tile_strips)
+
+        content = [{"type": "text", "text": prompt}]
+        made = []  # strips cut here; the pages belong to the caller
+        try:
+            images = []
+            for page in pages:
+                if level == "tiles":
+                    cut = page_strips(page, strips)
+                    made.extend(cut)
+                    images.append((page, "low"))
+                    images.extend((strip, "high") for strip in cut)
+                else:
+                    images.append((page, level))
+            for source, detail in images:
+                # Encode image straight from the in-memory buffer
+                content.append({
+                    "type": "image_url",
+                    "image_url": {"url": encode_data_url(source), "detail": detail}
+                })
+        finally:
+            # Encoded into the request; the strips' buffers aren't needed again
+            for strip in made:
+                strip.release()
+
+        # Make request with JSON mode
+        response = self.client.chat.completions.create(
+            model=self.settings.ocr_model,
+            response_format={ "type": "json_object" },
+            messages=[{"role": "user", "content": content}],
+            max_tokens=1500
+        )
+
+        # Parse response
+        try:
+            return json.loads(response.choices[0].message.content), tokens
+        except (TypeError, ValueError) as e:
+            self.logger.warning(f"OCR at {level} detail returned invalid JSON: {str(e)}")
+            return None, tokens
+
+    def _expected_chars(self, assignment_id: str) -> Optional[float]:
+        """Half the median transcript length seen for the assignment, once there are enough"""
+        with self._lock:
+            lengths = list(self._lengths.get(assignment_id, ()))
+        if len(lengths) < MIN_LENGTH_SAMPLES:
+            return None
+        return statistics.median(lengths) / 2
+
+    def _remember_length(self, assignment_id: str, transcript: str) -> None:
+        with self._lock:
+            self._lengths.setdefault(assignment_id, deque(maxlen=LENGTH_HISTORY)).append(len(transcript))
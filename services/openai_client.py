@@ -0,0 +1,77 @@
+# services/openai_client.py
+import json
+import logging
+import time
+
+from openai import OpenAI, DefaultHttpxClient
+
+from config.settings import get_settings
+from services.cassette import install_cassette
+from services.metrics import LLM_ERRORS, LLM_REQUEST_SECONDS, LLM_RETRIES, record_usage
+from services.tracing import set_attribute, span
+
+logger = logging.getLogger(__name__)
+
+class _InstrumentedHttpxClient(DefaultHttpxClient):
+    """
+    The openai SDK's own HTTP client, recording each attempt under a service
+    label. Request/response types come from whichever httpx the SDK uses.
+    """
+    def __init__(self, service: str, **kwargs):
+        self.service = service
+        super().__init__(event_hooks={
+            'request': [self._on_request],
+            'response': [self._on_response]
+        }, **kwargs)
+
+    def _on_request(self, request) -> None:
+        request.extensions['metrics_started'] = time.perf_counter()
+        if request.headers.get('x-stainless-retry-count', '0') != '0':
+            LLM_RETRIES.inc(service=self.service)
+
+    def _on_response(self, response) -> None:
+        started = response.request.extensions.get('metrics_started', time.perf_counter())
+        model = "unknown"
+        if 'application/json' in response.headers.get('content-type', ''):
+            try:
+                response.read()
+                body = json.loads(response.content)
+                model = body.get('model') or model
+                if body.get('usage'):
+                    record_usage(self.service, model, body['usage'])
+                    set_attribute('gen_ai.usage.input_tokens', body['usage'].get('prompt_tokens'))
+                    set_attribute('gen_ai.usage.output_tokens', body['usage'].get('completion_tokens'))
+            except Exception as e:
+                logger.error(f"Could not read usage from OpenAI response: {str(e)}")
+        set_attribute('gen_ai.response.model', model)
+        set_attribute('http.response.status_code', response.status_code)
+        LLM_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            service=self.service,
+            model=model,
+            status=str(response.status_code)
+        )
+
+    def send(self, request, **kwargs):
+        retry = request.headers.get('x-stainless-retry-count', '0')
+        with span(f"openai {request.url.path}", **{'gen_ai.system': 'openai', 'service': self.service,
+                                                  'retry_count': int(retry) if retry.isdigit() else None}):
+            try:
+                return super().send(request, **kwargs)
+            except Exception:
+                # Timeouts and connection errors never reach the response hook
+                LLM_ERRORS.inc(service=self.service)
+                raise
+
+def create_openai_client(service: str) -> OpenAI:
+    """
+    OpenAI client whose HTTP traffic is recorded in the pipeline metrics:
+    latency and status per attempt, retries, and token usage from each
+    response's `usage`. `service` labels the metrics (ocr, grading, ...).
+    """
+    settings = get_settings()
+    install_cassette()
+    return OpenAI(
+        api_key=settings.openai_api_key,
+        http_client=_InstrumentedHttpxClient(service)
+    )
@@ -0,0 +1,204 @@
+# services/pdf.py
+"""
+PDF batch ingestion: one scanned class set in, per-student submissions out.
+
+Pages are rasterized locally with pdfium in a pool of worker processes, at
+PDF_RENDER_DPI, and come back as JPEGs in page order. Only a small window
+of pages is rendered ahead of the consumer, and the PDF itself is read from
+a temp file by each worker, so neither the document nor its rendered pages
+are ever held in memory at once. Pages are split into submissions either by
+a fixed number of pages per student or at separator pages (blank sheets,
+or copies of a reference sheet), and each submission is yielded as soon
+as its last page has rendered, so the pipeline starts while the copier's
+PDF is still being rasterized.
+"""
+import io
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+import pypdfium2 as pdfium
+
+from config.settings import get_settings
+from services.images import ANALYSIS_SIZE, hash_distance, ink_mask, perceptual_hash
+from services.ingest import ImageSource
+
+logger = logging.getLogger(__name__)
+
+PDF_POINTS_PER_INCH = 72
+RENDER_AHEAD = 2            # Pages rendered ahead of the consumer, per worker
+SEPARATOR_HASH_DISTANCE = 12  # Scans of the same separator sheet vary more than photos of one page
+
+class RenderedPage(NamedTuple):
+    """One rasterized PDF page, with the measurements separator detection needs"""
+    number: int             # 1-based page number in the PDF
+    image: ImageSource
+    ink_coverage: float
+    perceptual_hash: str
+
+# Worker side: each process keeps the last document it opened
+
+_document: Optional[Tuple[str, "pdfium.PdfDocument"]] = None
+
+def _open(path: str) -> "pdfium.PdfDocument":
+    global _document
+    if _document is None or _document[0] != path:
+        if _document is not None:
+            _document[1].close()
+        _document = (path, pdfium.PdfDocument(path))
+    return _document[1]
+
+def _render(path: str, index: int, dpi: int) -> Tuple[bytes, float, str]:
+    """JPEG of one page, plus its ink coverage and perceptual hash (runs in a worker)"""
+    page = _open(path)[index]
+    try:
+        image = page.render(scale=dpi / PDF_POINTS_PER_INCH).to_pil().convert("RGB")
+    finally:
+        page.close()
+    analysis = image.convert("L")
+    analysis.thumbnail(ANALYSIS_SIZE)
+    gray = np.asarray(analysis, dtype=np.float32)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue(), round(float(ink_mask(gray).mean()), 4), perceptual_hash(gray)
+
+# Caller side
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def render_workers() -> int:
+    return get_settings().pdf_render_workers or max(1, (os.cpu_count() or 2) // 2)
+
+def _render_pool() -> ProcessPoolExecutor:
+    """Shared process pool; spawned, so workers don't inherit the app's threads and locks"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=render_workers(),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def page_count(pdf: Union[str, ImageSource]) -> int:
+    """Pages in a PDF on disk or in memory; only the cross-reference table is read"""
+    document = pdfium.PdfDocument(pdf if isinstance(pdf, str) else pdf.open())
+    try:
+        return len(document)
+    finally:
+        document.close()
+
+def render_pages(path: str, name: str, dpi: Optional[int] = None) -> Iterator[RenderedPage]:
+    """Render every page of a PDF on disk, in order, a few pages ahead of the consumer"""
+    dpi = dpi or get_settings().pdf_render_dpi
+    pool = _render_pool()
+    total = page_count(path)
+    ahead = RENDER_AHEAD * render_workers()
+    stem = Path(name).stem
+    pending: Dict[int, Future] = {}
+    try:
+        for index in range(total):
+            for upcoming in range(index, min(total, index + ahead)):
+                if upcoming not in pending:
+                    pending[upcoming] = pool.submit(_render, path, upcoming, dpi)
+            data, ink_coverage, phash = pending.pop(index).result()
+            yield RenderedPage(index + 1, ImageSource(f"{stem}_page{index + 1:03d}.jpg", data, "image/jpeg"),
+                               ink_coverage, phash)
+    except BrokenProcessPool:
+        _reset_pool()
+        raise
+    finally:
+        for future in pending.values():
+            future.cancel()
+
+def split_submissions(pages: Iterator[RenderedPage],
+                      pages_per_student: Optional[int] = None,
+                      separator_hash: Optional[str] = None) -> Iterator[List[ImageSource]]:
+    """
+    Group rendered pages into submissions, each yielded once it is complete.
+    With `pages_per_student`, every N pages are one submission. Otherwise a
+    separator page ends a submission: a blank page, or one that looks like
+    the reference separator sheet when `separator_hash` is given. Separator
+    pages are dropped.
+    """
+    min_ink = get_settings().min_ink_coverage
+    current: List[ImageSource] = []
+    for page in pages:
+        if pages_per_student:
+            current.append(page.image)
+            if len(current) == pages_per_student:
+                yield current
+                current = []
+            continue
+
+        if separator_hash:
+            separator = hash_distance(page.perceptual_hash, separator_hash) <= SEPARATOR_HASH_DISTANCE
+        else:
+            separator = page.ink_coverage < min_ink
+        if not separator:
+            current.append(page.image)
+            continue
+        page.image.release()
+        if current:
+            yield current
+            current = []
+    if current:
+        if pages_per_student:
+            logger.warning(f"Last submission has {len(current)} of {pages_per_student} pages")
+        yield current
+
+def pdf_submissions(path: str, name: str,
+                    pages_per_student: Optional[int] = None,
+                    separator_hash: Optional[str] = None,
+                    student_ids: Optional[List[str]] = None) -> Iterator[Tuple[str, List[ImageSource]]]:
+    """
+    (student_id, pages) for each submission in a PDF, as they render.
+    Students are named from `student_ids` in order, then `<pdf name>_<n>`.
+    """
+    student_ids = student_ids or []
+    stem = Path(name).stem
+    submissions = split_submissions(render_pages(path, name), pages_per_student, separator_hash)
+    for number, pages in enumerate(submissions, 1):
+        student_id = student_ids[number - 1] if number <= len(student_ids) else f"{stem}_{number:02d}"
+        yield student_id, pages
+
+def expected_submissions(pdf: Union[str, ImageSource], pages_per_student: Optional[int]) -> Optional[int]:
+    """Submissions a fixed split will produce; None when splitting at separators"""
+    if not pages_per_student:
+        return None
+    return math.ceil(page_count(pdf) / pages_per_student)
+
+@contextmanager
+def spooled_pdf(source: ImageSource) -> Iterator[str]:
+    """The PDF written to a private temp file for the render workers, deleted afterwards"""
+    handle, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            shutil.copyfileobj(source.open(), f)
+        yield path
+    finally:
+        try:
+            os.unlink(path)
+        except OSError as e:
+            logger.error(f"Could not remove spooled PDF {path}: {str(e)}")
+
+def submissions_from_pdf(source: ImageSource, **options) -> Iterator[Tuple[str, List[ImageSource]]]:
+    """`pdf_submissions` for an uploaded PDF; the temp copy lives until the last page is read"""
+    with spooled_pdf(source) as path:
+        yield from pdf_submissions(path, source.name, **options)
@@ -1,149 +1,578 @@
 # services/pipeline.py
+import hashlib
 import logging
-from typing import Optional, Dict
-from pathlib import Path
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, List, Union
 
 from models.submission import Submission
 from models.assignment import Assignment
+from models.assessment import AssessmentResult
 from services.ocr_service import OCRService
 from services.grading import GradingService
 from services.feedback import FeedbackService
 from services.storage import StorageService
+from services.cropping import crop_answers, template_for
+from services.grouping import pages_hash
+from services.images import BatchHashes, QualityReport, check_image, upright_jpeg
+from services.ingest import ImageSource
+from services.metrics import STAGE_SECONDS, SUBMISSIONS, start_metrics_server
+from services.profiling import profiled
+from services.tracing import current_span, set_attribute, span, traced
 from config.settings import get_settings
 
+ATTACH_POLL_SECONDS = 1.0
+
+def idempotency_key(assignment_id: str, student_id: str, content_hash: str,
+                    batch_id: Optional[str]) -> Optional[str]:
+    """Key for one image of one student in one batch; None outside a batch"""
+    if not batch_id:
+        return None
+    payload = f"{assignment_id}:{student_id}:{content_hash}:{batch_id}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def resume_stage(submission: Dict) -> str:
+    """First stage a stored submission still needs, judged from its checkpoints"""
+    if not submission.get('image_path'):
+        return "UPLOAD"
+    ocr_text = submission.get('ocr_text') or ''
+    if not ocr_text or ocr_text.startswith('[OCR Error'):
+        return "OCR"
+    if not submission.get('score'):
+        return "GRADING"
+    if not submission.get('feedback_md'):
+        return "FEEDBACK"
+    return "COMPLETE"
+
+def incomplete_submissions(submissions: List[Dict], stale_minutes: int) -> List[Dict]:
+    """
+    Submissions that failed, or stopped making progress `stale_minutes` ago,
+    before reaching the last stage. Recently touched rows may still be running.
+    Flagged images wait for the teacher instead.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=stale_minutes)
+    incomplete = []
+    for submission in submissions:
+        if submission.get('status') == 'flagged':
+            continue
+        stage = resume_stage(submission)
+        # Nothing to resume from if the image never reached storage
+        if stage == "UPLOAD" or (submission.get('status') == 'complete' and stage == "COMPLETE"):
+            continue
+        if submission.get('status') != 'error':
+            touched = submission.get('updated_at') or submission.get('created_at')
+            if touched:
+                touched = datetime.fromisoformat(touched)
+                if touched.tzinfo is None:
+                    touched = touched.replace(tzinfo=timezone.utc)
+                if touched > cutoff:
+                    continue
+        incomplete.append(submission)
+    return incomplete
+
 class ProcessingPipeline:
-    def __init__(self):
+    def __init__(self, storage_service: Optional[StorageService] = None):
         self.settings = get_settings()
         self.ocr_service = OCRService()
         self.grading_service = GradingService()
         self.feedback_service = FeedbackService()
-        self.storage_service = StorageService()
+        self.storage_service = storage_service or StorageService()
+        self.batch_hashes = BatchHashes()
         self.logger = logging.getLogger(__name__)
-    
+        start_metrics_server()
+
+    @traced("submission.prefetch")
+    def prefetch(self, image: ImageSource, assignment_data: Dict) -> Dict:
+        """
+        Run the upload and OCR stages ahead of time, before a submission row exists.
+        Returns whatever completed so `process_submission` can pick it up,
+        including the quality report for the batch checks made once the row exists.
+        """
+        result = {'content_hash': image.content_hash}
+        result['image_url'] = self.storage_service.upload_image(image, assignment_data['id'])
+        # The caller owns `image`; pages made from it here are released here
+        ocr_input = image
+        try:
+            # Images the quality gate will flag aren't worth an OCR call
+            if self.settings.quality_gate:
+                report = check_image(image.open())
+                result['quality'] = report
+                if report.issues:
+                    return result
+                if report.rotation or report.exif_orientation != 1:
+                    ocr_input = ImageSource(image.name, upright_jpeg(image.open(), report.rotation), "image/jpeg")
+            ocr_input = self._crop_answers(ocr_input, assignment_data, release_input=ocr_input is not image)
+            ocr_result = self.ocr_service.process_image(ocr_input, assignment_data)
+            # OCRService reports failures as a placeholder transcript; let the real run retry those
+            if ocr_result and not ocr_result.get('student_response', '').startswith('[OCR Error'):
+                result['ocr_result'] = ocr_result
+        except Exception as e:
+            # The upload is still usable; the real run does the rest
+            self.logger.error(f"Prefetch after upload failed: {str(e)}")
+        finally:
+            if ocr_input is not image:
+                ocr_input.release()
+        return result
+
+    @profiled("submission")
+    @traced("submission")
     def process_submission(self,
-                         image_path: str,
+                         image: Union[ImageSource, str, List[ImageSource]],
                          assignment_id: str,
                          student_id: str,
-                         on_stage_change: callable = None) -> Optional[Dict]:
+                         on_stage_change: callable = None,
+                         prefetched: Optional[Dict] = None,
+                         batch_id: Optional[str] = None) -> Optional[Dict]:
         """
-        Process a single submission through the entire pipeline
+        Process a single submission through the entire pipeline.
+        `image` is the page, or the ordered pages of a multi-page answer.
+        `prefetched` is the result of `prefetch` for a one-page submission;
+        stages it already covers are skipped. Within a `batch_id`, the same
+        pages for the same student are only processed once: repeats attach
+        to the original submission.
         """
+        prefetched = prefetched or {}
+        if isinstance(image, str):
+            image = ImageSource.from_path(image)
+        pages = image if isinstance(image, list) else [image]
+        for key, value in {'assignment_id': assignment_id, 'student_id': student_id,
+                           'batch_id': batch_id, 'file.name': pages[0].name,
+                           'file.pages': len(pages)}.items():
+            set_attribute(key, value)
+        submission_id = None
         try:
             # 1. Get assignment details first
             assignment_data = self.storage_service.get_assignment(assignment_id)
             if not assignment_data:
                 raise ValueError(f"Assignment {assignment_id} not found")
-            
-            # 2. Upload image and create submission
-            try:
-                self.logger.info("Starting image upload...")
-                if on_stage_change:
-                    on_stage_change("UPLOAD", "Uploading image...")
-                
-                public_url = self.storage_service.upload_image(
-                    image_path, 
-                    assignment_id
-                )
-                self.logger.info(f"Image uploaded successfully: {public_url}")
-                
-                # Log the URL for debugging
-                self.logger.info(f"Creating submission with image URL: {public_url}")
-                
-                # Create submission instance with public URL
-                submission = Submission(
-                    assignment_id=assignment_id,
-                    student_id=student_id,
-                    image_path=public_url,
-                    status="pending"
-                )
-                
-                # Log submission data
-                self.logger.info(f"Submission data: {submission.to_dict()}")
-                
-                submission_id = self.storage_service.create_submission(submission)
-                
-            except Exception as upload_error:
-                self.logger.error(f"Failed to upload image or create submission: {str(upload_error)}")
-                raise ValueError(f"Submission creation failed: {str(upload_error)}")
-            
-            # 3. Process image with OCR and update submission
-            try:
-                self.logger.info("Starting OCR processing...")
-                if on_stage_change:
-                    on_stage_change("OCR", "Processing image with OCR...")
-                
-                ocr_result = self.ocr_service.process_image(image_path, assignment_data)
-                self.logger.info("OCR processing complete")
-                if not ocr_result or 'student_response' not in ocr_result:
-                    raise ValueError("OCR processing failed to extract student response")
-            except Exception as ocr_error:
-                self.logger.error(f"OCR processing failed: {str(ocr_error)}")
-                raise ValueError(f"OCR processing failed: {str(ocr_error)}")
-                
-            # Update submission with OCR text
+
+            # 2. Claim the submission row before any work is done
+            submission = Submission(
+                assignment_id=assignment_id,
+                student_id=student_id,
+                image_path="",
+                status="pending",
+                stage="created",
+                batch_id=batch_id,
+                idempotency_key=idempotency_key(assignment_id, student_id, pages_hash(pages), batch_id)
+            )
+            claimed_id = self.storage_service.claim_submission(submission)
+            if claimed_id:
+                row = {**submission.to_dict(), 'id': claimed_id}
+            else:
+                existing = self.storage_service.get_submission_by_key(submission.idempotency_key)
+                if not existing:
+                    raise ValueError("Duplicate submission could not be found")
+                row = self._take_over(existing)
+                if row is None:
+                    self._discard_prefetched(prefetched)
+                    return self._attach(existing['id'], on_stage_change)
+            submission_id = row['id']
+            set_attribute('submission_id', submission_id)
+
+            # 3. Upload image
+            if not row.get('image_path'):
+                self._upload(row, pages, prefetched, on_stage_change)
+            else:
+                self._discard_prefetched(prefetched)
+
+            if prefetched.get('ocr_result') and not row.get('ocr_result'):
+                row['ocr_result'] = prefetched['ocr_result']
+                return self._run_stages(row, assignment_data, pages, on_stage_change, prefetched)
+            return self._run_stages(row, assignment_data, pages, on_stage_change)
+
+        except Exception as e:
+            self.logger.error(f"Pipeline processing failed: {str(e)}")
+            self._mark_failed(submission_id, e)
+            return None
+        finally:
+            for page in pages:
+                page.release()
+
+    def _upload(self, row: Dict, pages: List[ImageSource], prefetched: Dict,
+                on_stage_change: callable = None) -> None:
+        """Upload the pages (unless prefetched) and checkpoint their locations on the row"""
+        try:
+            self.logger.info("Starting image upload...")
+            if on_stage_change:
+                on_stage_change("UPLOAD", "Uploading image..." if len(pages) == 1
+                                else f"Uploading {len(pages)} pages...")
+
+            urls = []
+            for page in pages:
+                # Speculative uploads only cover one-page submissions
+                public_url = prefetched.get('image_url') if len(pages) == 1 else None
+                if not public_url:
+                    with self._stage("upload"):
+                        public_url = self.storage_service.upload_image(page, row['assignment_id'])
+                urls.append(public_url)
+            self.logger.info(f"Image uploaded successfully: {urls[0]}")
+
+            row['image_path'] = urls[0]
+            row['storage_path'] = pages[0].storage_path or self.storage_service.storage_path_from_url(urls[0])
             updates = {
                 'status': 'processing',
-                'ocr_text': ocr_result['student_response']  # Extract student's response
+                'stage': 'uploaded',
+                'image_path': row['image_path'],
+                'storage_path': row['storage_path']
+            }
+            if len(pages) > 1:
+                row['image_paths'] = updates['image_paths'] = urls
+            self.storage_service.update_submission(row['id'], updates)
+
+        except Exception as upload_error:
+            self.logger.error(f"Failed to upload image or create submission: {str(upload_error)}")
+            raise ValueError(f"Submission creation failed: {str(upload_error)}")
+
+    def _take_over(self, existing: Dict) -> Optional[Dict]:
+        """Claim a failed duplicate so this run resumes it; None if it's running or done"""
+        if existing.get('status') != 'error':
+            return None
+        if not self.storage_service.claim_failed_submission(existing['id']):
+            return None
+        self.logger.info(f"Retrying failed submission {existing['id']}")
+        return {**existing, 'status': 'processing', 'error_message': None}
+
+    def _attach(self, submission_id: str, on_stage_change: callable = None) -> Optional[Dict]:
+        """Wait for the run that owns a duplicate submission and return its outcome"""
+        self.logger.info(f"Attaching to existing submission {submission_id}")
+        set_attribute('duplicate_of', submission_id)
+        deadline = time.monotonic() + self.settings.stale_submission_minutes * 60
+        while True:
+            existing = self.storage_service.get_submission(submission_id)
+            if existing and existing.get('status') == 'complete':
+                if on_stage_change:
+                    on_stage_change("COMPLETE", "Already processed")
+                SUBMISSIONS.inc(outcome="duplicate")
+                return {
+                    'submission_id': submission_id,
+                    'status': 'complete',
+                    'feedback': existing.get('feedback_md'),
+                    'score': existing.get('score'),
+                    'duplicate': True
+                }
+            if existing and existing.get('status') == 'flagged':
+                return {
+                    'submission_id': submission_id,
+                    'status': 'flagged',
+                    'issues': (existing.get('quality') or {}).get('issues', []),
+                    'duplicate': True
+                }
+            if existing and existing.get('status') == 'error':
+                raise ValueError(existing.get('error_message') or "Original submission failed")
+            if time.monotonic() > deadline:
+                raise ValueError(f"Timed out waiting for submission {submission_id}")
+            time.sleep(ATTACH_POLL_SECONDS)
+
+    def release_interrupted(self, assignment_id: str, student_id: str,
+                            pages: List[ImageSource], batch_id: str) -> None:
+        """
+        Mark a submission that a crashed run left pending or processing as
+        failed, so processing the same pages again takes it over and resumes
+        from its checkpoints instead of waiting for it.
+        """
+        key = idempotency_key(assignment_id, student_id, pages_hash(pages), batch_id)
+        existing = self.storage_service.get_submission_by_key(key) if key else None
+        if existing and existing.get('status') in ('pending', 'processing'):
+            self.logger.info(f"Releasing interrupted submission {existing['id']}")
+            self.storage_service.update_submission(existing['id'], {
+                'status': 'error',
+                'error_message': "Interrupted by a restart"
+            })
+
+    def _discard_prefetched(self, prefetched: Dict) -> None:
+        """Delete a speculative upload that a duplicate submission made unnecessary"""
+        if prefetched.get('image_url'):
+            self.storage_service.delete_image(prefetched['image_url'])
+
+    @traced("submission.resume")
+    def resume_submission(self,
+                          submission: Dict,
+                          image: Union[ImageSource, List[ImageSource], None] = None,
+                          on_stage_change: callable = None) -> Optional[Dict]:
+        """
+        Continue a stored submission from its first incomplete stage.
+        Checkpointed stage outputs are reused; the pages are only downloaded
+        again if OCR never finished.
+        """
+        set_attribute('submission_id', submission.get('id'))
+        set_attribute('student_id', submission.get('student_id'))
+        image = image or self.storage_service.pages_for_submission(submission)
+        pages = image if isinstance(image, list) else [image]
+        try:
+            assignment_data = self.storage_service.get_assignment(submission['assignment_id'])
+            if not assignment_data:
+                raise ValueError(f"Assignment {submission['assignment_id']} not found")
+
+            self.logger.info(f"Resuming submission {submission['id']} at {resume_stage(submission)}")
+            self.storage_service.update_submission(
+                submission['id'],
+                {
+                    'status': 'processing',
+                    'error_message': None,
+                    'retry_count': (submission.get('retry_count') or 0) + 1
+                }
+            )
+            return self._run_stages(dict(submission), assignment_data, pages, on_stage_change)
+
+        except Exception as e:
+            self.logger.error(f"Resuming submission {submission.get('id')} failed: {str(e)}")
+            self._mark_failed(submission.get('id'), e)
+            return None
+        finally:
+            for page in pages:
+                page.release()
+
+    def _run_stages(self,
+                    row: Dict,
+                    assignment_data: Dict,
+                    pages: List[ImageSource],
+                    on_stage_change: callable = None,
+                    prefetched: Optional[Dict] = None) -> Dict:
+        """
+        Run OCR, grading and feedback for a submission row, skipping stages
+        whose output the row already holds and checkpointing each new one.
+        `prefetched` is the speculative result the row's OCR came from.
+        """
+        submission_id = row['id']
+        stage = resume_stage(row)
+
+        # 3. Process image with OCR
+        ocr_result = row.get('ocr_result')
+        if stage == "OCR":
+            if prefetched and prefetched.get('quality'):
+                # The page was checked before the row existed; the batch checks happen now
+                flagged = self._check_quality(row, pages, on_stage_change, reports=[prefetched['quality']],
+                                              file_hashes=[prefetched['content_hash']]) is None
+                if flagged:
+                    return {
+                        'submission_id': submission_id,
+                        'status': 'flagged',
+                        'issues': row['quality']['issues']
+                    }
+            if not ocr_result:
+                checked = self._check_quality(row, pages, on_stage_change)
+                if checked is None:
+                    return {
+                        'submission_id': submission_id,
+                        'status': 'flagged',
+                        'issues': row['quality']['issues']
+                    }
+                # The template describes the worksheet itself; continuation pages are sent whole
+                pages = [self._crop_answers(checked[0], assignment_data)] + checked[1:]
+                try:
+                    self.logger.info("Starting OCR processing...")
+                    if on_stage_change:
+                        on_stage_change("OCR", "Processing image with OCR..." if len(pages) == 1
+                                        else f"Processing {len(pages)} pages with OCR...")
+
+                    # All pages go in one request, so the answer is transcribed as a whole
+                    with self._stage("ocr"):
+                        ocr_result = self.ocr_service.process_image(pages, assignment_data)
+                    self.logger.info("OCR processing complete")
+                    if not ocr_result or 'student_response' not in ocr_result:
+                        raise ValueError("OCR processing failed to extract student response")
+                    # OCRService reports failures as a placeholder transcript
+                    if ocr_result['student_response'].startswith('[OCR Error'):
+                        raise ValueError(ocr_result['student_response'])
+                except Exception as ocr_error:
+                    self.logger.error(f"OCR processing failed: {str(ocr_error)}")
+                    raise ValueError(f"OCR processing failed: {str(ocr_error)}")
+                finally:
+                    # The pages aren't needed after OCR - free their buffers before grading
+                    for page in pages:
+                        page.release()
+
+            row['ocr_text'] = ocr_result['student_response']
+            row['ocr_result'] = ocr_result
+            checkpoint = {
+                'stage': 'ocr',
+                'ocr_text': row['ocr_text'],
+                'ocr_result': ocr_result
             }
-            self.storage_service.update_submission(submission_id, updates)
-            
-            # Get updated submission
-            submission.ocr_text = ocr_result['student_response']
-            assignment = Assignment.from_dict(assignment_data)
-            
-            # 4. Grade submission
+            if row.get('quality'):
+                checkpoint['quality'] = row['quality']
+            self.storage_service.update_submission(submission_id, checkpoint)
+        for page in pages:
+            page.release()
+
+        submission = Submission(
+            assignment_id=row['assignment_id'],
+            student_id=row['student_id'],
+            image_path=row['image_path'],
+            ocr_text=row['ocr_text']
+        )
+        assignment = Assignment.from_dict(assignment_data)
+
+        # 4. Grade submission
+        if row.get('score'):
+            grading_result = AssessmentResult(**row['score'])
+        else:
             self.logger.info("Starting grading...")
             if on_stage_change:
                 on_stage_change("GRADING", "Grading submission...")
-            
-            grading_result = self.grading_service.grade_submission(
-                submission,
-                assignment
-            )
+
+            with self._stage("grading"):
+                grading_result = self.grading_service.grade_submission(
+                    submission,
+                    assignment
+                )
             self.logger.info("Grading complete")
-            
-            # 5. Generate feedback
+            row['score'] = grading_result.model_dump()
+            self.storage_service.update_submission(submission_id, {
+                'stage': 'graded',
+                'score': row['score']
+            })
+
+        # 5. Generate feedback
+        feedback = row.get('feedback_md')
+        if not feedback:
             self.logger.info("Starting feedback generation...")
             if on_stage_change:
                 on_stage_change("FEEDBACK", "Generating feedback...")
-            
-            feedback = self.feedback_service.generate_feedback(
-                grading_result,
-                assignment,
-                student_response=ocr_result['student_response']
-            )
+
+            with self._stage("feedback"):
+                feedback = self.feedback_service.generate_feedback(
+                    grading_result,
+                    assignment,
+                    student_response=row['ocr_text']
+                )
             self.logger.info("Feedback generation complete")
-            
-            # 6. Update submission with results
-            updates = {
-                'status': 'complete',
-                'ocr_text': ocr_result['student_response'],
-                'feedback_md': feedback,
-                'score': grading_result.model_dump()
-            }
-            
-            self.storage_service.update_submission(submission_id, updates)
-            
+
+        # 6. Update submission with results
+        updates = {
+            'status': 'complete',
+            'stage': 'complete',
+            'feedback_md': feedback,
+            'error_message': None,
+            'processed_at': datetime.utcnow().isoformat()
+        }
+
+        self.storage_service.update_submission(submission_id, updates)
+
+        if on_stage_change:
+            on_stage_change("COMPLETE", "Processing complete")
+        SUBMISSIONS.inc(outcome="complete")
+
+        return {
+            'submission_id': submission_id,
+            'status': 'complete',
+            'feedback': feedback,
+            'score': row['score']
+        }
+
+    def _check_quality(self, row: Dict, pages: List[ImageSource],
+                       on_stage_change: callable = None,
+                       reports: Optional[List[QualityReport]] = None,
+                       file_hashes: Optional[List[str]] = None) -> Optional[List[ImageSource]]:
+        """
+        Check the pages locally before paying for OCR. Returns the pages to
+        send (turned upright where needed), or None after flagging the
+        submission for the teacher. `quality_override` on the row skips the check.
+        Given the `reports` and `file_hashes` of a prefetch, only the batch
+        checks run and the pages are returned as they are.
+        """
+        if not self.settings.quality_gate or row.get('quality_override'):
+            return pages
+
+        prefetched = reports is not None
+        with self._stage("quality"):
+            reports = reports or [check_image(page.open()) for page in pages]
+            file_hashes = file_hashes or [page.content_hash for page in pages]
+            for number, report in enumerate(reports, 1):
+                if not report.issues:
+                    # Pages of one student's answer may look alike; only other students count.
+                    # Only the identical file is held back: similar pages may share a worksheet
+                    match = self.batch_hashes.check(row.get('batch_id'), file_hashes[number - 1],
+                                                    report.perceptual_hash, row['student_id'])
+                    if match and match[1]:
+                        report.issues.append(f"Same file as {match[0]}")
+                    elif match:
+                        report.warnings.append(f"Looks like {match[0]}'s page")
+                if len(reports) > 1:
+                    report.issues = [f"Page {number}: {issue}" for issue in report.issues]
+                    report.warnings = [f"Page {number}: {warning}" for warning in report.warnings]
+            set_attribute('quality.blur_score', min(report.blur_score for report in reports))
+            set_attribute('quality.ink_coverage', min(report.ink_coverage for report in reports))
+        issues = [issue for report in reports for issue in report.issues]
+        if len(reports) == 1:
+            row['quality'] = reports[0].model_dump()
+        else:
+            row['quality'] = {'issues': issues,
+                              'warnings': [warning for report in reports for warning in report.warnings],
+                              'pages': [report.model_dump() for report in reports]}
+
+        if issues:
+            self.logger.info(f"Flagged {row['student_id']}: {', '.join(issues)}")
+            set_attribute('quality.issues', ", ".join(issues))
+            self.storage_service.update_submission(row['id'], {
+                'status': 'flagged',
+                'stage': 'flagged',
+                'quality': row['quality'],
+                'error_message': "; ".join(issues)
+            })
             if on_stage_change:
-                on_stage_change("COMPLETE", "Processing complete")
-            
-            return {
-                'submission_id': submission_id,
-                'status': 'complete',
-                'feedback': feedback,
-                'score': grading_result.model_dump()
-            }
-            
-        except Exception as e:
-            self.logger.error(f"Pipeline processing failed: {str(e)}")
-            
-            if 'submission_id' in locals():
-                self.storage_service.update_submission(
-                    submission_id,
-                    {
-                        'status': 'error',
-                        'error_message': str(e)
-                    }
-                )
-            
+                on_stage_change("FLAGGED", f"Not sent for grading: {', '.join(issues)}")
+            SUBMISSIONS.inc(outcome="flagged")
+            for page in pages:
+                page.release()
             return None
+        if prefetched:
+            return pages
+
+        checked = []
+        for page, report in zip(pages, reports):
+            if report.rotation or report.exif_orientation != 1:
+                upright = ImageSource(page.name, upright_jpeg(page.open(), report.rotation), "image/jpeg")
+                page.release()
+                page = upright
+            checked.append(page)
+        return checked
+
+    def _crop_answers(self, image: ImageSource, assignment_data: Dict,
+                      release_input: bool = True) -> ImageSource:
+        """
+        Only the answer regions go to OCR when the assignment has a crop template.
+        The whole page is released once cropped, unless `release_input` is False.
+        """
+        try:
+            template = template_for(assignment_data)
+            if not template:
+                return image
+            with self._stage("crop"):
+                cropped = crop_answers(image, template)
+                set_attribute('crop.regions', len(template.regions))
+                set_attribute('crop.aligned', cropped is not image)
+        except Exception as e:
+            self.logger.error(f"Cropping to the answer regions failed, sending the whole page: {str(e)}")
+            return image
+        if cropped is not image and release_input:
+            image.release()
+        return cropped
+
+    @contextmanager
+    def _stage(self, name: str):
+        """Time a stage for the metrics and trace it as a child of the submission"""
+        with STAGE_SECONDS.time(stage=name), span(f"stage.{name}"):
+            yield
+
+    def _mark_failed(self, submission_id: Optional[str], error: Exception) -> None:
+        """Record a failure on the row; its checkpoints are kept for a later resume"""
+        SUBMISSIONS.inc(outcome="error")
+        # The submission's root span; errors are caught here so mark it explicitly
+        root = current_span()
+        if root:
+            root.record_error(error)
+        if not submission_id:
+            return
+        try:
+            self.storage_service.update_submission(
+                submission_id,
+                {
+                    'status': 'error',
+                    'error_message': str(error)
+                }
+            )
+        except Exception as e:
+            self.logger.error(f"Could not record failure for {submission_id}: {str(e)}")
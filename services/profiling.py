@@ -0,0 +1,241 @@
+# services/profiling.py
+"""
+On-demand profiling of single page reruns and single submissions.
+
+Only available with DEBUG on, and only for runs that were asked for: a
+profile is requested ahead of time (`request_profile`) and the next matching
+run consumes it. While a profile runs, a background thread samples the
+profiled thread's stack every PROFILE_INTERVAL_MS and tracemalloc records
+allocations. The result is written to PROFILE_DIR as:
+  profile.speedscope.json  flame graph for https://www.speedscope.app
+  profile.collapsed.txt    collapsed stacks for flamegraph.pl and similar tools
+  allocations.txt          top PROFILE_TOP_N allocation sites still held at the end
+  meta.json                what was profiled, when, and for how long
+
+With nothing requested, the hooks are a dictionary lookup.
+"""
+import json
+import logging
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from config.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+Frame = Tuple[str, str, int]  # function, file, first line
+
+_requested: Counter = Counter()
+_lock = threading.Lock()
+_tracemalloc_users = 0
+
+def request_profile(kind: str, count: int = 1) -> None:
+    """Profile the next `count` runs of `kind` ("submission", "rerun:<page>", ...)"""
+    with _lock:
+        _requested[kind] += count
+
+def pending_requests() -> Dict[str, int]:
+    with _lock:
+        return {kind: n for kind, n in _requested.items() if n}
+
+def consume_request(kind: str) -> bool:
+    """True (once per request) when a run of `kind` should be profiled"""
+    if not _requested.get(kind):
+        return False
+    with _lock:
+        if _requested[kind] <= 0 or not get_settings().debug:
+            return False
+        _requested[kind] -= 1
+        return True
+
+def _start_tracemalloc() -> None:
+    global _tracemalloc_users
+    with _lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracemalloc_users += 1
+
+def _stop_tracemalloc() -> None:
+    global _tracemalloc_users
+    with _lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+class Profiler:
+    """Samples one thread's stack until stopped (or until `until()` turns true)"""
+    def __init__(self, name: str, kind: str, thread_id: Optional[int] = None,
+                 until: Optional[Callable[[List[Frame]], bool]] = None):
+        settings = get_settings()
+        self.name = name
+        self.kind = kind
+        self.thread_id = thread_id or threading.get_ident()
+        self.until = until
+        self.interval = settings.profile_interval_ms / 1000
+        self.top_n = settings.profile_top_n
+        self.samples: Counter = Counter()
+        self.output: Optional[Path] = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{kind}", daemon=True)
+
+    def start(self) -> "Profiler":
+        _start_tracemalloc()
+        self.started_at = datetime.now()
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self) -> Optional[Path]:
+        """Stop sampling and write the profile; returns its directory"""
+        self._stopped.set()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+        return self.output
+
+    def _stack(self) -> Optional[List[Frame]]:
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return None
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack.reverse()  # root first
+        return stack
+
+    def _run(self) -> None:
+        try:
+            while not self._stopped.wait(self.interval):
+                stack = self._stack()
+                if stack is None or (self.until and self.until(stack)):
+                    break
+                self.samples[tuple(stack)] += 1
+            self.duration = time.perf_counter() - self._started
+            snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+            peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+        finally:
+            _stop_tracemalloc()
+        try:
+            self.output = self._write(snapshot, peak)
+            logger.info(f"Profile written to {self.output}")
+        except Exception as e:
+            logger.error(f"Writing profile failed: {str(e)}")
+
+    def _write(self, snapshot, peak_bytes: int) -> Path:
+        slug = re.sub(r"[^\w.-]+", "_", self.name)[:60]
+        output = Path(get_settings().profile_dir) / f"{self.started_at.strftime('%Y%m%d-%H%M%S-%f')}_{slug}"
+        output.mkdir(parents=True, exist_ok=True)
+
+        frames: Dict[Frame, int] = {}
+        speedscope_samples, weights, collapsed = [], [], []
+        for stack, count in self.samples.most_common():
+            speedscope_samples.append([frames.setdefault(f, len(frames)) for f in stack])
+            weights.append(round(count * self.interval, 6))
+            collapsed.append(";".join(f"{Path(file).name}:{func}" for func, file, _ in stack) + f" {count}")
+
+        (output / "profile.speedscope.json").write_text(json.dumps({
+            '$schema': "https://www.speedscope.app/file-format-schema.json",
+            'name': self.name,
+            'exporter': "grade-escape",
+            'shared': {'frames': [{'name': func, 'file': file, 'line': line} for func, file, line in frames]},
+            'profiles': [{
+                'type': "sampled",
+                'name': self.name,
+                'unit': "seconds",
+                'startValue': 0,
+                'endValue': round(self.duration, 6),
+                'samples': speedscope_samples,
+                'weights': weights
+            }]
+        }))
+        (output / "profile.collapsed.txt").write_text("\n".join(collapsed) + "\n")
+
+        allocations = []
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                tracemalloc.Filter(False, __file__)
+            ])
+            for stat in snapshot.statistics("lineno")[:self.top_n]:
+                where = stat.traceback[0]
+                allocations.append({'file': where.filename, 'line': where.lineno,
+                                    'size_kb': round(stat.size / 1024, 1), 'count': stat.count})
+        (output / "allocations.txt").write_text("\n".join(
+            f"{a['size_kb']:>10.1f} KiB {a['count']:>8} blocks  {a['file']}:{a['line']}" for a in allocations
+        ) + "\n")
+
+        (output / "meta.json").write_text(json.dumps({
+            'name': self.name,
+            'kind': self.kind,
+            'started_at': self.started_at.isoformat(),
+            'duration_s': round(self.duration, 4),
+            'samples': sum(self.samples.values()),
+            'interval_ms': self.interval * 1000,
+            'peak_traced_mb': round(peak_bytes / (1024 * 1024), 2),
+            'allocations': allocations
+        }, indent=2))
+        return output
+
+@contextmanager
+def profile(name: str, kind: str) -> Iterator[Profiler]:
+    """Profile the calling thread for the duration of the block"""
+    profiler = Profiler(name, kind).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+
+def profiled(kind: str):
+    """Decorator: profile a call when a profile of `kind` has been requested"""
+    def decorate(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not consume_request(kind):
+                return fn(*args, **kwargs)
+            with profile(f"{kind} {fn.__qualname__}", kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def list_profiles() -> List[Dict]:
+    """Saved profiles, newest first"""
+    root = Path(get_settings().profile_dir)
+    profiles = []
+    for meta in root.glob("*/meta.json") if root.exists() else []:
+        try:
+            profiles.append({**json.loads(meta.read_text()), 'path': str(meta.parent)})
+        except ValueError:
+            continue  # still being written
+    return sorted(profiles, key=lambda p: p['started_at'], reverse=True)
+
+def hottest_functions(path: str, limit: int = 20) -> List[Dict]:
+    """Self and total time per function from a saved collapsed-stack file"""
+    self_samples: Counter = Counter()
+    total_samples: Counter = Counter()
+    overall = 0
+    with open(Path(path) / "profile.collapsed.txt") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if not stack:
+                continue
+            frames = stack.split(";")
+            overall += int(count)
+            self_samples[frames[-1]] += int(count)
+            for frame in set(frames):
+                total_samples[frame] += int(count)
+    return [
+        {'function': frame, 'self %': round(100 * self_samples[frame] / overall, 1),
+         'total %': round(100 * total_samples[frame] / overall, 1)}
+        for frame, _ in self_samples.most_common(limit)
+    ]
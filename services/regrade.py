@@ -0,0 +1,130 @@
+# services/regrade.py
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional
+
+from models.assignment import Assignment
+from services.grading import GradingService
+from services.feedback import FeedbackService
+from services.storage import StorageService
+from services.tracing import propagate, set_attribute, traced
+from config.settings import get_settings
+
+class RegradeEngine:
+    """
+    Re-grades an assignment's submissions after its rubric is edited.
+
+    Stored transcripts are reused (no upload or OCR), per-point results for
+    unchanged rubric points are kept, and only new or edited points are sent
+    for evaluation. Submissions are processed concurrently and written back
+    in bulk at the end.
+    """
+    def __init__(self,
+                 storage_service: Optional[StorageService] = None,
+                 grading_service: Optional[GradingService] = None,
+                 feedback_service: Optional[FeedbackService] = None,
+                 max_workers: Optional[int] = None):
+        self.settings = get_settings()
+        self.storage_service = storage_service or StorageService()
+        self.grading_service = grading_service or GradingService()
+        self.feedback_service = feedback_service or FeedbackService()
+        self.max_workers = max_workers or self.settings.pipeline_workers
+        self.logger = logging.getLogger(__name__)
+
+    def apply_edit(self, old: Assignment, new: Assignment, regrade: bool = True,
+                   on_progress: Callable[[int, int], None] = None) -> Dict:
+        """Save an edited assignment, drop stale cached completions, and re-grade"""
+        self.storage_service.update_assignment(str(old.id), new)
+        if old.rubric_hash() != new.rubric_hash():
+            self.grading_service.cache.invalidate(rubric_hash=old.rubric_hash())
+        if not regrade:
+            return {'submissions': 0, 'regraded': 0}
+        return self.regrade_assignment(old, new, on_progress=on_progress)
+
+    @traced("regrade")
+    def regrade_assignment(self, old: Assignment, new: Assignment,
+                           on_progress: Callable[[int, int], None] = None) -> Dict:
+        """Re-grade every submission of `new` that has a stored transcript"""
+        set_attribute('assignment_id', str(new.id))
+        diff = old.rubric_structure.diff(new.rubric_structure)
+        question_changed = old.question_text.strip() != new.question_text.strip()
+        summary = {
+            'submissions': 0,
+            'regraded': 0,
+            'feedback_regenerated': 0,
+            'skipped': 0,
+            'failed': 0,
+            'added_points': len(diff.added),
+            'removed_points': len(diff.removed),
+            'question_changed': question_changed
+        }
+        if not diff.has_changes and not question_changed:
+            self.logger.info("Rubric unchanged - nothing to re-grade")
+            return summary
+
+        submissions = self.storage_service.get_submissions_by_assignment(str(new.id), refresh_urls=False)
+        summary['submissions'] = len(submissions)
+
+        updates = []
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="regrade") as executor:
+            futures = [
+                executor.submit(propagate(self._regrade_one), submission, new, question_changed)
+                for submission in submissions
+            ]
+            for done, future in enumerate(as_completed(futures), start=1):
+                try:
+                    update = future.result()
+                    if update is None:
+                        summary['skipped'] += 1
+                    else:
+                        updates.append(update)
+                        summary['regraded'] += 1
+                        summary['feedback_regenerated'] += 'feedback_md' in update
+                except Exception as e:
+                    self.logger.error(f"Re-grading a submission failed: {str(e)}")
+                    summary['failed'] += 1
+                if on_progress:
+                    on_progress(done, len(futures))
+
+        # One bulk write at the end; rows without new feedback keep their old text
+        if updates:
+            with_feedback = [u for u in updates if 'feedback_md' in u]
+            without_feedback = [u for u in updates if 'feedback_md' not in u]
+            for rows in (with_feedback, without_feedback):
+                if rows:
+                    self.storage_service.bulk_update_submissions(rows)
+
+        self.logger.info(f"Re-grade complete: {summary}")
+        return summary
+
+    @traced("regrade.submission")
+    def _regrade_one(self, submission: Dict, assignment: Assignment,
+                     question_changed: bool) -> Optional[Dict]:
+        """Re-grade one stored submission; returns its row update or None if it can't be"""
+        set_attribute('submission_id', submission.get('id'))
+        ocr_text = submission.get('ocr_text')
+        if not ocr_text:
+            return None
+
+        # A new question invalidates every stored per-point result
+        previous = {} if question_changed else (submission.get('score') or {})
+        result = self.grading_service.regrade(ocr_text, assignment, previous)
+
+        update = {
+            'id': submission['id'],
+            'assignment_id': submission['assignment_id'],
+            'student_id': submission['student_id'],
+            'image_path': submission['image_path'],
+            'status': 'complete',
+            'score': result.model_dump()
+        }
+
+        # Feedback explains the evaluation; only rewrite it when the evaluation moved
+        if (result.rubric_points_evaluation != previous.get('rubric_points_evaluation')
+                or not submission.get('feedback_md')):
+            update['feedback_md'] = self.feedback_service.generate_feedback(
+                result,
+                assignment,
+                student_response=ocr_text
+            )
+        return update
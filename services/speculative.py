@@ -0,0 +1,114 @@
+# services/speculative.py
+import logging
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Optional, Tuple
+
+from services.ingest import ImageSource
+from services.tracing import propagate
+
+logger = logging.getLogger(__name__)
+
+def _prefetch(pipeline, image: ImageSource, assignment_data: Dict) -> Dict:
+    try:
+        return pipeline.prefetch(image, assignment_data)
+    finally:
+        image.release()
+
+def _discard(future: Future, storage) -> None:
+    """Cancel a pending job, or clean up the upload of one that already ran"""
+    if future.cancel():
+        return
+    future.add_done_callback(lambda done: _cleanup(done, storage))
+
+def _cleanup(future: Future, storage) -> None:
+    if future.cancelled() or future.exception():
+        return
+    image_url = future.result().get('image_url')
+    if image_url:
+        logger.info("Removing unclaimed speculative upload")
+        try:
+            storage.delete_image(image_url)
+        except Exception as e:
+            logger.error(f"Failed to remove speculative upload: {str(e)}")
+
+def _shut_down(executor: ThreadPoolExecutor, jobs: Dict, lock: threading.Lock, storage) -> None:
+    """Discard every unclaimed job and stop the worker threads"""
+    with lock:
+        for future in jobs.values():
+            _discard(future, storage)
+        jobs.clear()
+    executor.shutdown(wait=False)
+
+class SpeculativeIngestor:
+    """
+    Starts the upload and OCR stages for dropped files in the background.
+
+    Jobs are keyed by (assignment id, image identity), so renaming a file or
+    rerunning the page reuses the same work. Jobs for files that disappear
+    from the selection are cancelled, or their uploaded image is deleted
+    if they already finished. `close` does the same for every unclaimed
+    job and stops the workers; it also runs if the ingestor is dropped
+    with its session.
+    """
+    def __init__(self, pipeline, max_workers: int = 4):
+        self.pipeline = pipeline
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+        self.jobs: Dict[Tuple[str, str], Future] = {}
+        self.lock = threading.Lock()
+        self.logger = logger
+        # Jobs hold the pipeline, not the ingestor, so a session that goes away can be collected
+        self._finalizer = weakref.finalize(self, _shut_down, self.executor, self.jobs, self.lock,
+                                           pipeline.storage_service)
+
+    def sync(self, assignment_data: Dict, images: List[ImageSource]) -> None:
+        """Start jobs for new images and discard jobs that are no longer selected"""
+        wanted = {(str(assignment_data['id']), image.identity): image for image in images}
+        with self.lock:
+            for key in list(self.jobs):
+                if key not in wanted:
+                    _discard(self.jobs.pop(key), self.pipeline.storage_service)
+
+            for key, image in wanted.items():
+                if key not in self.jobs:
+                    self.logger.info(f"Speculatively ingesting {image.name}")
+                    self.jobs[key] = self.executor.submit(propagate(_prefetch), self.pipeline,
+                                                          image, assignment_data)
+
+    def take(self, assignment_id: str, identity: str,
+             timeout: Optional[float] = None) -> Optional[Dict]:
+        """
+        Hand over the result for an image, waiting for it if still running.
+        Returns None when there is no job or it failed; the caller then runs
+        the stages itself.
+        """
+        with self.lock:
+            future = self.jobs.pop((str(assignment_id), identity), None)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            _discard(future, self.pipeline.storage_service)
+            return None
+        except Exception as e:
+            self.logger.error(f"Speculative ingestion failed: {str(e)}")
+            return None
+
+    def status(self) -> Dict[str, int]:
+        """Counts of finished and pending jobs for display"""
+        with self.lock:
+            done = sum(1 for future in self.jobs.values() if future.done())
+            return {'done': done, 'pending': len(self.jobs) - done}
+
+    def clear(self) -> None:
+        """Discard every outstanding job"""
+        with self.lock:
+            for future in self.jobs.values():
+                _discard(future, self.pipeline.storage_service)
+            self.jobs.clear()
+
+    def close(self) -> None:
+        """Discard every outstanding job and shut the workers down"""
+        self._finalizer()
@@ -1,74 +1,178 @@
 # services/storage.py
 from typing import Dict, List, Optional
 import logging
+import uuid
 from pathlib import Path
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
 from models.submission import Submission
 from models.assignment import Assignment
+from services.auth import AuthContext
+from services.cassette import install_cassette
+from services.ingest import ImageSource
+from services.metrics import track_db
+from services.tracing import span
 from config.settings import get_settings
-import streamlit as st
 import json
 import time
+from contextlib import contextmanager
+from datetime import datetime
+
+@contextmanager
+def _round_trip(target: str, operation: str):
+    """Time and trace one Supabase call; `target` is a table name or 'storage'"""
+    with track_db(target, operation), \
+            span(f"supabase {operation} {target}", **{'db.system': 'supabase', 'db.operation': operation,
+                                                      'db.target': target}):
+        yield
 
 class StorageService:
-    def __init__(self):
+    def __init__(self, auth: Optional[AuthContext] = None):
+        """
+        `auth` says who the service acts for: a teacher's session (see
+        services.auth.streamlit_auth for the app's pages) or the service role
+        for headless workers. Without it the client is anonymous.
+        """
         self.settings = get_settings()
+        self.auth = auth or AuthContext()
+        install_cassette()
         self.supabase: Client = create_client(
             self.settings.supabase_url,
-            self.settings.supabase_key
+            self.settings.supabase_service_key if self.auth.service_role else self.settings.supabase_key
         )
-        # Sets the auth token from session state if both tokens exist
-        if 'access_token' in st.session_state and 'refresh_token' in st.session_state:
+        if self.auth.has_session and not self.auth.service_role:
             self.supabase.auth.set_session(
-                access_token=st.session_state.access_token,
-                refresh_token=st.session_state.refresh_token
+                access_token=self.auth.access_token,
+                refresh_token=self.auth.refresh_token
             )
+        self._teacher_id = self.auth.teacher_id
         self.logger = logging.getLogger(__name__)
 
     def _get_teacher_id(self) -> str:
         """Get current teacher's ID from auth context"""
-        if 'user' not in st.session_state:
+        if self._teacher_id:
+            return self._teacher_id
+        if not self.auth.auth_id:
             raise ValueError("No authenticated user found")
-            
-        auth_id = st.session_state.user.id
-        result = self.supabase.table('teachers') \
-            .select('id') \
-            .eq('auth_id', auth_id) \
-            .single() \
-            .execute()
-            
-        return result.data['id']
 
-    def upload_image(self, file_path: str, assignment_id: str) -> str:
+        with _round_trip('teachers', 'select'):
+            result = self.supabase.table('teachers') \
+                .select('id') \
+                .eq('auth_id', self.auth.auth_id) \
+                .single() \
+                .execute()
+
+        self._teacher_id = result.data['id']
+        return self._teacher_id
+
+    def _new_storage_path(self, assignment_id: str, name: str, file_hash: str = "") -> str:
+        """Object path for a new image; timestamp and hash keep same-named files apart"""
+        timestamp = int(time.time())
+        if file_hash:
+            return f"{assignment_id}/{timestamp}_{file_hash[:12]}_{Path(name).name}"
+        return f"{assignment_id}/{timestamp}_{uuid.uuid4().hex[:12]}_{Path(name).name}"
+
+    def get_image_url(self, storage_path: str) -> str:
+        """Signed URL (1 year) for an object already in the bucket"""
+        expiry = 365 * 24 * 60 * 60  # 1 year in seconds
+        with _round_trip('storage', 'create_signed_url'):
+            signed_url = self.supabase.storage \
+                .from_(self.settings.storage_bucket) \
+                .create_signed_url(storage_path, expiry)
+        return signed_url['signedURL']
+
+    def create_upload_targets(self, assignment_id: str, files: List[Dict]) -> List[Dict]:
+        """
+        Issue signed upload URLs so the browser can upload straight to the bucket.
+        `files` holds {name} entries reported by the browser; targets come back
+        in the same order. Paths are chosen here, never by the browser.
+        """
+        try:
+            targets = []
+            for file in files:
+                storage_path = self._new_storage_path(assignment_id, str(file['name']))
+                with _round_trip('storage', 'create_signed_upload_url'):
+                    signed = self.supabase.storage \
+                        .from_(self.settings.storage_bucket) \
+                        .create_signed_upload_url(storage_path)
+                targets.append({
+                    'name': file['name'],
+                    'path': storage_path,
+                    'signed_url': signed['signed_url'],
+                    'token': signed['token']
+                })
+            return targets
+
+        except Exception as e:
+            self.logger.error(f"Signed upload URL creation failed: {str(e)}")
+            raise
+
+    def download_image(self, storage_path: str) -> bytes:
+        """Fetch an image's bytes from the bucket"""
+        try:
+            with _round_trip('storage', 'download'):
+                return self.supabase.storage \
+                    .from_(self.settings.storage_bucket) \
+                    .download(storage_path)
+        except Exception as e:
+            self.logger.error(f"Image download failed: {str(e)}")
+            raise
+
+    def stored_image(self, name: str, storage_path: str, content_type: str = None,
+                     file_hash: str = None) -> ImageSource:
+        """ImageSource for an object already in the bucket, downloaded only when read"""
+        return ImageSource.from_storage(
+            name,
+            storage_path,
+            loader=lambda: self.download_image(storage_path),
+            content_type=content_type,
+            file_hash=file_hash
+        )
+
+    def image_for_submission(self, submission: Dict) -> ImageSource:
+        """Lazily downloaded image of a stored submission, for re-running OCR"""
+        storage_path = submission.get('storage_path') or \
+            self.storage_path_from_url(submission['image_path'])
+        return self.stored_image(Path(storage_path).name, storage_path)
+
+    def pages_for_submission(self, submission: Dict) -> List[ImageSource]:
+        """Lazily downloaded pages of a stored submission, in order"""
+        image_paths = submission.get('image_paths') or []
+        if len(image_paths) < 2:
+            return [self.image_for_submission(submission)]
+        storage_paths = [self.storage_path_from_url(url) for url in image_paths]
+        return [self.stored_image(Path(path).name, path) for path in storage_paths]
+
+    def upload_image(self, image: ImageSource, assignment_id: str) -> str:
         """Upload image to Supabase storage"""
         try:
-            path = Path(file_path)
-            timestamp = int(time.time())
-            storage_path = f"{assignment_id}/{timestamp}_{path.name}"
+            # Browser uploads are already in the bucket - just sign them
+            if image.storage_path:
+                return self.get_image_url(image.storage_path)
+
+            # Content hash keeps same-named uploads from different teachers apart
+            storage_path = self._new_storage_path(assignment_id, image.name, image.content_hash)
             self.logger.info(f"Storage path: {storage_path}")
             
-            with open(file_path, 'rb') as f:
-                try:
-                    # Upload file
-                    self.logger.info(f"Uploading to bucket: {self.settings.storage_bucket}")
+            try:
+                # Upload file, streaming straight from the in-memory buffer
+                self.logger.info(f"Uploading to bucket: {self.settings.storage_bucket}")
+                with _round_trip('storage', 'upload'):
                     upload_result = self.supabase.storage \
                         .from_(self.settings.storage_bucket) \
-                        .upload(storage_path, f)
-                    
-                    if not upload_result:
-                        raise Exception("Upload failed - no response received")
+                        .upload(storage_path, image.open(), {"content-type": image.content_type})
+                
+                if not upload_result:
+                    raise Exception("Upload failed - no response received")
 
-                    # Get signed URL with 1 year expiration
-                    expiry = 365 * 24 * 60 * 60  # 1 year in seconds
-                    signed_url = self.supabase.storage \
-                        .from_(self.settings.storage_bucket) \
-                        .create_signed_url(storage_path, expiry)
+                # Get signed URL with 1 year expiration
+                signed_url = self.get_image_url(storage_path)
+                
+                self.logger.info(f"Generated signed URL: {signed_url}")
+                return signed_url
                     
-                    self.logger.info(f"Generated signed URL: {signed_url}")
-                    return signed_url['signedURL']
-                        
-                except Exception as upload_error:
-                    raise Exception(f"Upload failed: {str(upload_error)}")
+            except Exception as upload_error:
+                raise Exception(f"Upload failed: {str(upload_error)}")
 
         except Exception as e:
             self.logger.error(f"Image upload failed: {str(e)}")
@@ -80,9 +184,10 @@ class StorageService:
         """
         try:
             data = submission.to_dict()
-            result = self.supabase.table('submissions') \
-                .insert(data) \
-                .execute()
+            with _round_trip('submissions', 'insert'):
+                result = self.supabase.table('submissions') \
+                    .insert(data) \
+                    .execute()
                 
             return result.data[0]['id']
 
@@ -90,6 +195,56 @@ class StorageService:
             self.logger.error(f"Submission creation failed: {str(e)}")
             raise
 
+    def claim_submission(self, submission: Submission) -> Optional[str]:
+        """
+        Create a submission row unless one with the same idempotency key exists.
+        Returns the new row's id, or None if the key is already taken.
+        """
+        try:
+            return self.create_submission(submission)
+        except APIError as e:
+            if e.code == '23505':  # unique_violation on idempotency_key
+                self.logger.info(f"Submission {submission.idempotency_key} already exists")
+                return None
+            raise
+
+    def get_submission_by_key(self, idempotency_key: str) -> Optional[Dict]:
+        """
+        Get submission by idempotency key
+        """
+        try:
+            with _round_trip('submissions', 'select'):
+                result = self.supabase.table('submissions') \
+                    .select('*') \
+                    .eq('idempotency_key', idempotency_key) \
+                    .limit(1) \
+                    .execute()
+
+            return result.data[0] if result.data else None
+
+        except Exception as e:
+            self.logger.error(f"Submission retrieval failed: {str(e)}")
+            return None
+
+    def claim_failed_submission(self, submission_id: str) -> bool:
+        """
+        Move a failed submission back to processing; False if another run got there first
+        """
+        try:
+            with _round_trip('submissions', 'update'):
+                result = self.supabase.table('submissions') \
+                    .update({'status': 'processing', 'error_message': None,
+                             'updated_at': datetime.utcnow().isoformat()}) \
+                    .eq('id', submission_id) \
+                    .eq('status', 'error') \
+                    .execute()
+
+            return bool(result.data)
+
+        except Exception as e:
+            self.logger.error(f"Submission claim failed: {str(e)}")
+            raise
+
     def update_submission(self, 
                          submission_id: str,
                          updates: Dict) -> None:
@@ -97,10 +252,12 @@ class StorageService:
         Update submission record
         """
         try:
-            self.supabase.table('submissions') \
-                .update(updates) \
-                .eq('id', submission_id) \
-                .execute()
+            updates = {**updates, 'updated_at': datetime.utcnow().isoformat()}
+            with _round_trip('submissions', 'update'):
+                self.supabase.table('submissions') \
+                    .update(updates) \
+                    .eq('id', submission_id) \
+                    .execute()
 
         except Exception as e:
             self.logger.error(f"Submission update failed: {str(e)}")
@@ -111,11 +268,12 @@ class StorageService:
         Get submission by ID
         """
         try:
-            result = self.supabase.table('submissions') \
-                .select('*') \
-                .eq('id', submission_id) \
-                .single() \
-                .execute()
+            with _round_trip('submissions', 'select'):
+                result = self.supabase.table('submissions') \
+                    .select('*') \
+                    .eq('id', submission_id) \
+                    .single() \
+                    .execute()
                 
             return result.data
 
@@ -123,69 +281,127 @@ class StorageService:
             self.logger.error(f"Submission retrieval failed: {str(e)}")
             return None
 
+    def storage_path_from_url(self, image_path: str) -> str:
+        """Extract the object path inside the bucket from a signed or public URL"""
+        # Extract storage path from full URL, avoiding double bucket names
+        path_parts = image_path.split('/storage/v1/object/')[1].split('?')[0]
+        
+        # Remove any prefix and bucket name from path
+        clean_path = path_parts
+        for prefix in ['public/', 'sign/']:
+            if clean_path.startswith(prefix):
+                clean_path = clean_path[len(prefix):]
+        
+        # Remove bucket name if it appears twice
+        bucket_prefix = f"{self.settings.storage_bucket}/"
+        if clean_path.startswith(bucket_prefix):
+            clean_path = clean_path[len(bucket_prefix):]
+        
+        return clean_path
+
     def _refresh_image_url(self, image_path: str) -> str:
         """Refresh a signed URL for an image"""
         try:
-            # Extract storage path from full URL, avoiding double bucket names
-            path_parts = image_path.split('/storage/v1/object/')[1].split('?')[0]
-            
-            # Remove any prefix and bucket name from path
-            clean_path = path_parts
-            for prefix in ['public/', 'sign/']:
-                if clean_path.startswith(prefix):
-                    clean_path = clean_path[len(prefix):]
-            
-            # Remove bucket name if it appears twice
-            bucket_prefix = f"{self.settings.storage_bucket}/"
-            if clean_path.startswith(bucket_prefix):
-                clean_path = clean_path[len(bucket_prefix):]
-            
-            storage_path = clean_path
+            storage_path = self.storage_path_from_url(image_path)
                 
             # Create new signed URL
             expiry = 365 * 24 * 60 * 60  # 1 year in seconds
-            signed_url = self.supabase.storage \
-                .from_(self.settings.storage_bucket) \
-                .create_signed_url(storage_path, expiry)
+            with _round_trip('storage', 'create_signed_url'):
+                signed_url = self.supabase.storage \
+                    .from_(self.settings.storage_bucket) \
+                    .create_signed_url(storage_path, expiry)
             
             return signed_url['signedURL']
         except Exception as e:
             self.logger.error(f"Failed to refresh URL: {str(e)}")
             return image_path  # Return original URL if refresh fails
 
-    def get_submissions_by_assignment(self, assignment_id: str) -> List[Dict]:
+    def delete_image(self, image_path: str) -> None:
+        """
+        Remove an uploaded image that never became a submission
+        """
+        try:
+            storage_path = self.storage_path_from_url(image_path)
+            with _round_trip('storage', 'remove'):
+                self.supabase.storage \
+                    .from_(self.settings.storage_bucket) \
+                    .remove([storage_path])
+        except Exception as e:
+            self.logger.error(f"Image deletion failed: {str(e)}")
+
+    def bulk_update_submissions(self, rows: List[Dict], chunk_size: int = 500) -> None:
+        """
+        Write many submission updates in a few round trips.
+        Each row must carry the full identity of the submission
+        (id, assignment_id, student_id, image_path) because it is upserted.
+        """
+        try:
+            for start in range(0, len(rows), chunk_size):
+                with _round_trip('submissions', 'upsert'):
+                    self.supabase.table('submissions') \
+                        .upsert(rows[start:start + chunk_size]) \
+                        .execute()
+
+        except Exception as e:
+            self.logger.error(f"Bulk submission update failed: {str(e)}")
+            raise
+
+    def refresh_image_urls(self, submissions: List[Dict]) -> List[Dict]:
+        """Replace expired signed image URLs on submission rows"""
+        for submission in submissions:
+            if submission.get('image_path'):
+                submission['image_path'] = self._refresh_image_url(submission['image_path'])
+            if len(submission.get('image_paths') or []) > 1:
+                submission['image_paths'] = [self._refresh_image_url(url) for url in submission['image_paths']]
+        return submissions
+
+    def get_submissions_by_assignment(self, assignment_id: str, refresh_urls: bool = True) -> List[Dict]:
         """
         Get all submissions for an assignment
         """
         try:
-            result = self.supabase.table('submissions') \
-                .select('*') \
-                .eq('assignment_id', assignment_id) \
-                .order('created_at', desc=True) \
-                .execute()
-            
-            # Refresh image URLs
-            submissions = result.data
-            for submission in submissions:
-                if submission.get('image_path'):
-                    submission['image_path'] = self._refresh_image_url(submission['image_path'])
-                
-            return submissions
+            with _round_trip('submissions', 'select'):
+                result = self.supabase.table('submissions') \
+                    .select('*') \
+                    .eq('assignment_id', assignment_id) \
+                    .order('created_at', desc=True) \
+                    .execute()
+
+            return self.refresh_image_urls(result.data) if refresh_urls else result.data
 
         except Exception as e:
             self.logger.error(f"Assignment submissions retrieval failed: {str(e)}")
             return []
 
+    def get_submissions_by_batch(self, batch_id: str, refresh_urls: bool = True) -> List[Dict]:
+        """
+        Get all submissions processed in one batch, oldest first
+        """
+        try:
+            with _round_trip('submissions', 'select'):
+                result = self.supabase.table('submissions') \
+                    .select('*') \
+                    .eq('batch_id', batch_id) \
+                    .order('created_at') \
+                    .execute()
+
+            return self.refresh_image_urls(result.data) if refresh_urls else result.data
+
+        except Exception as e:
+            self.logger.error(f"Batch submissions retrieval failed: {str(e)}")
+            return []
+
     def get_assignment(self, assignment_id: str) -> Optional[Dict]:
         """
         Get assignment by ID
         """
         try:
-            result = self.supabase.table('assignments') \
-                .select('*') \
-                .eq('id', assignment_id) \
-                .single() \
-                .execute()
+            with _round_trip('assignments', 'select'):
+                result = self.supabase.table('assignments') \
+                    .select('*') \
+                    .eq('id', assignment_id) \
+                    .single() \
+                    .execute()
                 
             return result.data
 
@@ -209,9 +425,10 @@ class StorageService:
             # Convert rubric structure to JSON string
             data['rubric_structure'] = json.dumps(data['rubric_structure'])
             
-            result = self.supabase.table('assignments') \
-                .insert(data) \
-                .execute()
+            with _round_trip('assignments', 'insert'):
+                result = self.supabase.table('assignments') \
+                    .insert(data) \
+                    .execute()
                 
             return result.data[0]['id']
 
@@ -219,6 +436,27 @@ class StorageService:
             self.logger.error(f"Assignment creation failed: {str(e)}")
             raise
 
+    def update_assignment(self, assignment_id: str, assignment: Assignment) -> None:
+        """
+        Update an assignment's details and rubric
+        """
+        try:
+            data = assignment.to_dict()
+            data.pop('teacher_id', None)
+            
+            # Convert rubric structure to JSON string
+            data['rubric_structure'] = json.dumps(data['rubric_structure'])
+            
+            with _round_trip('assignments', 'update'):
+                self.supabase.table('assignments') \
+                    .update(data) \
+                    .eq('id', assignment_id) \
+                    .execute()
+
+        except Exception as e:
+            self.logger.error(f"Assignment update failed: {str(e)}")
+            raise
+
     def list_assignments(self) -> List[Dict]:
         """
         Get all assignments for current teacher
@@ -226,11 +464,12 @@ class StorageService:
         try:
             teacher_id = self._get_teacher_id()
             
-            result = self.supabase.table('assignments') \
-                .select('*') \
-                .eq('teacher_id', teacher_id) \
-                .order('created_at', desc=True) \
-                .execute()
+            with _round_trip('assignments', 'select'):
+                result = self.supabase.table('assignments') \
+                    .select('*') \
+                    .eq('teacher_id', teacher_id) \
+                    .order('created_at', desc=True) \
+                    .execute()
                 
             return result.data
 
@@ -245,11 +484,12 @@ class StorageService:
         try:
             teacher_id = self._get_teacher_id()
             
-            result = self.supabase.table('subjects') \
-                .select('*') \
-                .eq('teacher_id', teacher_id) \
-                .order('name') \
-                .execute()
+            with _round_trip('subjects', 'select'):
+                result = self.supabase.table('subjects') \
+                    .select('*') \
+                    .eq('teacher_id', teacher_id) \
+                    .order('name') \
+                    .execute()
                 
             return result.data
 
@@ -264,12 +504,13 @@ class StorageService:
         try:
             teacher_id = self._get_teacher_id()
             
-            result = self.supabase.table('subjects') \
-                .insert({
-                    'name': name,
-                    'teacher_id': teacher_id
-                }) \
-                .execute()
+            with _round_trip('subjects', 'insert'):
+                result = self.supabase.table('subjects') \
+                    .insert({
+                        'name': name,
+                        'teacher_id': teacher_id
+                    }) \
+                    .execute()
                 
             return result.data[0]['id']
 
@@ -0,0 +1,326 @@
+# services/tracing.py
+"""
+Lightweight tracing with OpenTelemetry-compatible output.
+
+Spans nest through a context variable, so a span opened inside another
+becomes its child without passing anything around. Use `propagate` to carry
+the current span into thread pool workers. Finished spans are kept in
+memory for the admin page and written to the configured exporter: a local
+JSONL file (one OTLP JSON span per line) or an OTLP/HTTP collector.
+"""
+import contextvars
+import json
+import logging
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from config.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "grade-escape"
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+def _otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def _plain_value(value: Dict) -> Any:
+    if 'intValue' in value:
+        return int(value['intValue'])
+    return next(iter(value.values()), None)
+
+class Span:
+    """One timed operation; `trace_id` ties together every span of a submission"""
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = {k: v for k, v in (attributes or {}).items() if v is not None}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = "UNSET"
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        self.status = "ERROR"
+        self.status_message = str(error)
+        self.attributes['exception.type'] = type(error).__name__
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    def to_otlp(self) -> Dict:
+        """The span as an OTLP JSON span object"""
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in self.attributes.items()],
+            'status': {'code': {'UNSET': 0, 'OK': 1, 'ERROR': 2}[self.status]}
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.status_message:
+            span['status']['message'] = self.status_message
+        return span
+
+class SpanExporter:
+    """Destination for finished spans; subclass to send them somewhere else"""
+    def export(self, span: Span) -> None:
+        raise NotImplementedError
+
+    def shutdown(self) -> None:
+        pass
+
+class JsonlSpanExporter(SpanExporter):
+    """Appends one OTLP JSON span per line, rotating to `<path>.1` past `max_bytes`"""
+    def __init__(self, path: str, max_bytes: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_otlp(), separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file.tell() + len(line) > self.max_bytes:
+                self._file.close()
+                self.path.replace(self.path.with_name(self.path.name + ".1"))
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._file.close()
+
+class OTLPHttpSpanExporter(SpanExporter):
+    """
+    Sends spans to an OpenTelemetry collector as OTLP/HTTP JSON, batched on a
+    background thread. Spans are dropped (not retried) while the collector is
+    unreachable, so tracing never slows the pipeline down.
+    """
+    def __init__(self, endpoint: str, batch_size: int = 256, interval: float = 2.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: queue.Queue = queue.Queue(maxsize=10000)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span.to_otlp())
+        except queue.Full:
+            pass
+
+    def _run(self) -> None:
+        while not self._stopped.is_set() or not self._queue.empty():
+            batch = []
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size and time.monotonic() < deadline:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch:
+                self._post(batch)
+
+    def _post(self, spans: List[Dict]) -> None:
+        payload = {
+            'resourceSpans': [{
+                'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+                'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}]
+            }]
+        }
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={'Content-Type': 'application/json'},
+            method="POST"
+        )
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except Exception as e:
+            logger.warning(f"Dropped {len(spans)} spans, collector unavailable: {str(e)}")
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        self._thread.join(timeout=self.interval + 5)
+
+class Tracer:
+    def __init__(self, exporter: Optional[SpanExporter] = None, keep: int = 20000):
+        self.exporter = exporter
+        self.recent: deque = deque(maxlen=keep)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Open a span as a child of the current one (or as a new trace's root)"""
+        parent = _current_span.get()
+        span = Span(
+            name,
+            trace_id=parent.trace_id if parent else secrets.token_hex(16),
+            parent_id=parent.span_id if parent else None,
+            attributes=attributes
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.record_error(e)
+            raise
+        finally:
+            span.end()
+            _current_span.reset(token)
+            self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        self.recent.append(span)
+        if self.exporter:
+            try:
+                self.exporter.export(span)
+            except Exception as e:
+                logger.error(f"Span export failed: {str(e)}")
+
+def _load_exporter(name: str) -> Optional[SpanExporter]:
+    settings = get_settings()
+    if name == "jsonl":
+        return JsonlSpanExporter(settings.trace_path, settings.trace_max_mb * 1024 * 1024)
+    if name == "otlp":
+        return OTLPHttpSpanExporter(settings.otlp_endpoint)
+    return None
+
+@lru_cache()
+def get_tracer() -> Tracer:
+    """Process-wide tracer configured from settings"""
+    try:
+        return Tracer(_load_exporter(get_settings().trace_exporter))
+    except Exception as e:
+        logger.error(f"Trace exporter unavailable, keeping spans in memory only: {str(e)}")
+        return Tracer()
+
+def span(name: str, **attributes):
+    """Shorthand for get_tracer().span(...)"""
+    return get_tracer().span(name, **attributes)
+
+def traced(name: str):
+    """Decorator that runs the function inside a span called `name`"""
+    def decorate(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def set_attribute(key: str, value: Any) -> None:
+    """Set an attribute on the current span, if there is one"""
+    active = _current_span.get()
+    if active:
+        active.set_attribute(key, value)
+
+def propagate(fn: Callable) -> Callable:
+    """Bind `fn` to the caller's context so spans it opens in a worker thread nest correctly"""
+    context = contextvars.copy_context()
+    # A context can only be entered by one thread at a time, so each call runs in a copy
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+# Reading traces back, for the waterfall view
+
+def recent_spans() -> List[Dict]:
+    """Spans finished in this process, as OTLP JSON"""
+    return [s.to_otlp() for s in list(get_tracer().recent)]
+
+def read_spans(path: Optional[str] = None) -> List[Dict]:
+    """Spans from the JSONL trace file (and its rotated predecessor)"""
+    path = Path(path or get_settings().trace_path)
+    spans = []
+    for candidate in (path.with_name(path.name + ".1"), path):
+        if not candidate.exists():
+            continue
+        with open(candidate, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    continue  # partially written last line
+    return spans
+
+def build_traces(spans: List[Dict]) -> List[Dict]:
+    """
+    Group OTLP spans into traces. Each trace has its root's name and
+    attributes, total duration, and its spans flattened in start order with
+    depth and offsets relative to the root, ready to draw as a waterfall.
+    """
+    by_trace: Dict[str, List[Dict]] = {}
+    for s in spans:
+        by_trace.setdefault(s['traceId'], []).append(s)
+
+    traces = []
+    for trace_id, members in by_trace.items():
+        ids = {s['spanId'] for s in members}
+        roots = [s for s in members if s.get('parentSpanId') not in ids]
+        root = min(roots, key=lambda s: int(s['startTimeUnixNano']))
+        origin = int(root['startTimeUnixNano'])
+        children: Dict[Optional[str], List[Dict]] = {}
+        for s in members:
+            children.setdefault(s.get('parentSpanId'), []).append(s)
+
+        flat = []
+        def walk(node: Dict, depth: int):
+            start = int(node['startTimeUnixNano'])
+            end = int(node['endTimeUnixNano'])
+            flat.append({
+                'name': node['name'],
+                'span_id': node['spanId'],
+                'depth': depth,
+                'start_ms': (start - origin) / 1e6,
+                'end_ms': (end - origin) / 1e6,
+                'duration_ms': (end - start) / 1e6,
+                'error': node.get('status', {}).get('code') == 2,
+                'attributes': {a['key']: _plain_value(a['value']) for a in node.get('attributes', [])}
+            })
+            for child in sorted(children.get(node['spanId'], []), key=lambda s: int(s['startTimeUnixNano'])):
+                walk(child, depth + 1)
+
+        for r in sorted(roots, key=lambda s: int(s['startTimeUnixNano'])):
+            walk(r, 0)
+        traces.append({
+            'trace_id': trace_id,
+            'name': root['name'],
+            'attributes': flat[0]['attributes'],
+            'duration_ms': max(s['end_ms'] for s in flat),
+            'error': any(s['error'] for s in flat),
+            'spans': flat
+        })
+    return traces
@@ -68,7 +68,7 @@ def process_submissions(storage: StorageService,
     """Process uploaded submissions"""
     try:
         # Initialize processing pipeline
-        pipeline = ProcessingPipeline()
+        pipeline = ProcessingPipeline(storage)
         
         # Process each file
         for i, file in enumerate(uploaded_files):